@@ -1,46 +1,96 @@
 # app.py
 
+import time
 import logging
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request, g
 from apscheduler.schedulers.background import BackgroundScheduler
-from bridge_status import fetch_bridge_status, get_current_bridge_status
+from bridge_status import schedule_fetch_jobs, is_ready
 from bridge_stats import bridge_stats
 from utils import require_api_key
-from config import FETCH_INTERVAL
+from response_cache import cached_response, encode_json
+from snapshot import get_snapshot
+from config import METRICS_ENABLED
+from history_index import history_response, is_filtered
+from routing import route_response
+import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+# Streamed responses (filtered /history) are timed to their first byte and have no size
+@app.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.request_seconds.observe(time.perf_counter() - g.started, route, response.status_code)
+    if response.content_length is not None:
+        metrics.response_bytes.observe(response.content_length, route)
+    return response
+
+def serve_snapshot(name):
+    current = get_snapshot()
+    return cached_response(current.responses[name], current.next_update)
+
 @app.route('/bridge-status', methods=['GET'])
 @require_api_key
 def get_bridge_status():
-    return jsonify(get_current_bridge_status())
+    return serve_snapshot('bridge-status')
 
 @app.route('/stats', methods=['GET'])
 @require_api_key
 def get_bridge_statistics():
-    return jsonify(bridge_stats.get_filtered_stats())
+    return serve_snapshot('stats')
 
 @app.route('/history', methods=['GET'])
 @require_api_key
 def get_bridge_history():
-    return jsonify(bridge_stats.get_filtered_history())
+    if not is_filtered(request.args):
+        return serve_snapshot('history')
+    status, headers, body = history_response(get_snapshot(), request.args, request.headers.get('If-None-Match'),
+                                             bool(request.accept_encodings['gzip']))
+    return Response(body, status=status, headers=headers)
+
+# Closures by Toronto hour of week, 0 is Monday 00:00
+@app.route('/heatmap', methods=['GET'])
+@require_api_key
+def get_heatmap():
+    return serve_snapshot('heatmap')
+
+# Crossings ranked by when you'd be across from lat/lng, going by distance and when each is likely to be open
+@app.route('/route', methods=['GET'])
+@require_api_key
+def get_route():
+    status, payload = route_response(get_snapshot(), request.args)
+    return Response(encode_json(payload), status=status, mimetype='application/json')
 
+# Returns 503 until the first fetch has completed so load balancers hold traffic until there's data to serve
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "healthy"}), 200
+    if not is_ready():
+        return jsonify({"status": "starting", "ready": False}), 503
+    return jsonify({"status": "healthy", "ready": True}), 200
+
+if METRICS_ENABLED:
+    # Needs a key like the API, the labels include the names of the API keys
+    @app.route('/metrics', methods=['GET'])
+    @require_api_key
+    def get_metrics():
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 def init_scheduler():
     scheduler = BackgroundScheduler()
-    scheduler.add_job(fetch_bridge_status, 'interval', seconds=FETCH_INTERVAL)
+    bridge_stats.load()
+    schedule_fetch_jobs(scheduler)  # Fetch initial data in the background
     scheduler.start()
     return scheduler
 
 if __name__ == '__main__':
     scheduler = init_scheduler()
-    fetch_bridge_status()  # Fetch initial data
     
     try:
         app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,231 @@
+# asgi_app.py
+
+import time
+import asyncio
+import logging
+from urllib.parse import parse_qs
+from config import STREAM_HEARTBEAT, FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT, MULTIPROCESS, METRICS_ENABLED
+from sources import SOURCES
+from bridge_status import poll_source, is_ready
+from bridge_stats import bridge_stats
+from bridge_events import broadcaster, snapshot_event, HEARTBEAT
+from response_cache import encode_json, negotiate, accepts_gzip
+from snapshot import get_snapshot
+from history_index import history_response, is_filtered
+from routing import route_response
+from auth import key_store, request_key
+import leader
+import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# httpx logs every poll at INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+SNAPSHOT_ROUTES = {
+    '/bridge-status': 'bridge-status',
+    '/stats': 'stats',
+    '/history': 'history',
+    '/heatmap': 'heatmap'
+}
+STREAM_HEADERS = {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+async def respond(send, status, headers, body=b"", head=False):
+    raw_headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+    raw_headers.append((b'content-length', str(len(body)).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': b"" if head else body})
+
+async def respond_json(send, status, payload, head=False):
+    await respond(send, status, {'Content-Type': 'application/json'}, encode_json(payload), head)
+
+async def send_chunk(send, body):
+    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+async def watch_disconnect(receive, wakeup):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    wakeup.set()
+
+# Follows redirects like the requests session does
+def upstream_client(**kwargs):
+    import httpx
+    return httpx.AsyncClient(timeout=httpx.Timeout(FETCH_READ_TIMEOUT, connect=FETCH_CONNECT_TIMEOUT),
+                             limits=httpx.Limits(max_keepalive_connections=max(4, len(SOURCES))),
+                             follow_redirects=True, **kwargs)
+
+class AsgiApp:
+    # Asyncio serving mode with the same routes, auth and JSON as app.py. The fetcher runs as one task per source
+    # on the server's event loop with an httpx client instead of on scheduler threads. Requests, streams and the
+    # fetches stay on the loop thread, an idle keep-alive connection or stream subscriber is just a coroutine, and
+    # each fetched page is processed and published on bridge_status.process_executor's one worker thread.
+    def __init__(self, fetch=True):
+        self.fetch = fetch
+        self.client = None
+        self.tasks = []
+        self.loop = None
+        # One event per stream subscriber, set whenever the broadcaster publishes
+        self.wakeups = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle(scope, receive, self.recorder(scope, send))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        self.attach()
+        if not self.fetch:
+            return
+        if MULTIPROCESS:
+            # Only the leader polls, a follower that takes over later calls back from its follower thread
+            leader.start(lambda: self.loop.call_soon_threadsafe(self.start_polling))
+        else:
+            bridge_stats.load()
+            self.start_polling()
+
+    def start_polling(self):
+        self.client = upstream_client()
+        # Fetch initial data in the background
+        self.tasks = [asyncio.create_task(poll_source(source, self.client)) for source in SOURCES]
+
+    async def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        if self.notify in broadcaster.listeners:
+            broadcaster.listeners.remove(self.notify)
+
+    def attach(self):
+        self.loop = asyncio.get_running_loop()
+        if self.notify not in broadcaster.listeners:
+            broadcaster.listeners.append(self.notify)
+
+    # Called by the broadcaster on whichever thread published
+    def notify(self):
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wake)
+
+    def wake(self):
+        for wakeup in self.wakeups:
+            wakeup.set()
+
+    # Records latency to the response start and the body size, same as the Flask hooks
+    def recorder(self, scope, send):
+        started = time.perf_counter()
+        path = scope['path']
+        route = path if path in SNAPSHOT_ROUTES or path in ('/health', '/bridge-status/stream', '/route', '/metrics') else "unmatched"
+
+        async def send_recorded(message):
+            if message['type'] == 'http.response.start':
+                metrics.request_seconds.observe(time.perf_counter() - started, route, message['status'])
+                for name, value in message['headers']:
+                    if name == b'content-length':
+                        metrics.response_bytes.observe(int(value), route)
+            await send(message)
+        return send_recorded
+
+    async def handle(self, scope, receive, send):
+        headers = {}
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').lower()
+            headers[name] = f"{headers[name]}, {value.decode('latin-1')}" if name in headers else value.decode('latin-1')
+        path = scope['path']
+        head = scope['method'] == 'HEAD'
+        metrics_route = METRICS_ENABLED and path == '/metrics'
+        if path not in ('/health', '/bridge-status/stream', '/route') and path not in SNAPSHOT_ROUTES and not metrics_route:
+            return await respond_json(send, 404, {"error": "Not found"}, head)
+        if scope['method'] not in ('GET', 'HEAD'):
+            return await respond(send, 405, {'Allow': 'GET, HEAD', 'Content-Type': 'application/json'}, encode_json({"error": "Method not allowed"}))
+        # Returns 503 until the first fetch has completed so load balancers hold traffic until there's data to serve
+        if path == '/health':
+            if not is_ready():
+                return await respond_json(send, 503, {"status": "starting", "ready": False}, head)
+            return await respond_json(send, 200, {"status": "healthy", "ready": True}, head)
+
+        status, retry_after = key_store.authorize(request_key(headers.get('x-api-key'), headers.get('authorization')))
+        if status == 429:
+            return await respond(send, 429, {'Content-Type': 'application/json', 'Retry-After': str(retry_after)},
+                                 encode_json({"error": "Too many requests"}), head)
+        if status != 200:
+            return await respond_json(send, 401, {"error": "Unauthorized"}, head)
+        if metrics_route:
+            return await respond(send, 200, {'Content-Type': metrics.CONTENT_TYPE}, metrics.render(), head)
+        if path == '/bridge-status/stream':
+            return await self.stream(receive, send)
+        current = get_snapshot()
+        query_string = scope.get('query_string', b'').decode('latin-1')
+        if path == '/route':
+            args = {name: values[0] for name, values in parse_qs(query_string).items()}
+            status, payload = route_response(current, args)
+            return await respond_json(send, status, payload, head)
+        if path == '/history':
+            args = {name: values[0] for name, values in parse_qs(query_string, keep_blank_values=True).items()}
+            if is_filtered(args):
+                return await self.stream_history(current, args, headers, send, head)
+        status, response_headers, body = negotiate(current.responses[SNAPSHOT_ROUTES[path]], current.next_update,
+                                                   headers.get('if-none-match'), accepts_gzip(headers.get('accept-encoding')))
+        if status == 200:
+            response_headers['Content-Type'] = 'application/json'
+        await respond(send, status, response_headers, body, head)
+
+    async def stream_history(self, current, args, headers, send, head):
+        status, response_headers, chunks = history_response(current, args, headers.get('if-none-match'),
+                                                            accepts_gzip(headers.get('accept-encoding')))
+        raw_headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response_headers.items()]
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+        if not head:
+            for chunk in chunks:
+                await send_chunk(send, chunk)
+        await send({'type': 'http.response.body', 'body': b""})
+
+    # Server-Sent Events: the full status on connect, then one event per bridge whose state or info changed. Only
+    # served here, each subscriber waits on an asyncio event rather than holding a server thread.
+    async def stream(self, receive, send):
+        self.attach()
+        wakeup = asyncio.Event()
+        self.wakeups.add(wakeup)
+        broadcaster.subscribers += 1
+        disconnected = asyncio.create_task(watch_disconnect(receive, wakeup))
+        try:
+            raw_headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in STREAM_HEADERS.items()]
+            await send({'type': 'http.response.start', 'status': 200, 'headers': raw_headers})
+            sequence = broadcaster.current_sequence()
+            await send_chunk(send, snapshot_event())
+            while True:
+                if broadcaster.current_sequence() == sequence:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), STREAM_HEARTBEAT)
+                    except asyncio.TimeoutError:
+                        pass
+                    wakeup.clear()
+                if disconnected.done():
+                    return
+                events, sequence = broadcaster.events_since(sequence)
+                if events is None:
+                    await send_chunk(send, snapshot_event())
+                elif events:
+                    await send_chunk(send, b"".join(events))
+                else:
+                    await send_chunk(send, HEARTBEAT)
+        finally:
+            broadcaster.subscribers -= 1
+            self.wakeups.discard(wakeup)
+            disconnected.cancel()
+
+app = AsgiApp()
@@ -0,0 +1,145 @@
+# auth.py
+
+import sys
+import json
+import hmac
+import math
+import time
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from config import (API_KEY, API_KEYS, API_KEYS_FILE, API_KEY_SET, RATE_LIMIT, RATE_LIMIT_BURST, DAILY_QUOTA,
+                    TORONTO_TZ)
+import metrics
+
+# Keys come from API_KEY, from API_KEYS as ";"-separated NAME=KEY entries, the name optionally followed by @requests
+# per second. Everything after the first "=" is the key, so a key can hold any character but ";":
+#   API_KEYS=partner@5=3f9c2e...;website=a81d0b...
+# and from API_KEYS_FILE, a JSON list of keys with their sha256 so the file never holds the keys themselves:
+#   [{"name": "partner", "sha256": "<python auth.py KEY>", "rate": 5, "burst": 20, "daily_quota": 100000}]
+# Only the sha256 of each key is kept. A request's key is hashed and looked up by its digest, so the lookup takes the
+# same time whichever key (or how much of one) matches, and the digests are compared with hmac.compare_digest.
+def digest(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+# The key from X-API-Key, or from "Authorization: Bearer KEY" for clients that can only send that, like a Prometheus
+# scrape config's authorization section
+def request_key(x_api_key, authorization):
+    if x_api_key:
+        return x_api_key
+    scheme, _, credentials = (authorization or '').partition(' ')
+    return credentials.strip() if scheme.lower() == 'bearer' else None
+
+def seconds_until_tomorrow(now):
+    tomorrow = TORONTO_TZ.localize(datetime.combine(now.date() + timedelta(days=1), datetime.min.time()))
+    return (tomorrow - now).total_seconds()
+
+class TokenBucket:
+    # Holds up to burst tokens and refills at rate tokens a second, each request takes one
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    # 0 if the request can go ahead, otherwise seconds until a token is available
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class ApiKey:
+    def __init__(self, name, key_digest, rate=RATE_LIMIT, burst=RATE_LIMIT_BURST, daily_quota=DAILY_QUOTA):
+        self.name = name
+        self.digest = key_digest
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.daily_quota = daily_quota
+        self.day = None
+        self.used_today = 0
+        self.lock = threading.Lock()
+
+    # 0 if the request is allowed, otherwise the seconds to send in Retry-After
+    def admit(self):
+        with self.lock:
+            if self.daily_quota:
+                now = datetime.now(TORONTO_TZ)
+                if now.date() != self.day:
+                    self.day = now.date()
+                    self.used_today = 0
+                if self.used_today >= self.daily_quota:
+                    return seconds_until_tomorrow(now)
+            if self.bucket is not None:
+                wait = self.bucket.take(time.monotonic())
+                if wait:
+                    return wait
+            self.used_today += 1
+            return 0
+
+def parse_keys(spec):
+    keys = []
+    for entry in (e.strip() for e in spec.split(';') if e.strip()):
+        name, separator, key = entry.partition('=')
+        name, at, rate = name.partition('@')
+        if not separator or not name.strip() or not key.strip():
+            raise ValueError(f"Invalid API key entry for '{name.strip()}', expected NAME[@rate]=KEY")
+        try:
+            rate = float(rate) if at else RATE_LIMIT
+        except ValueError:
+            raise ValueError(f"Invalid rate for API key '{name.strip()}': {rate}")
+        keys.append(ApiKey(name.strip(), digest(key.strip()), rate))
+    return keys
+
+def read_keys_file(filename):
+    with open(filename, 'r') as f:
+        entries = json.load(f)
+    return [ApiKey(entry["name"], entry["sha256"].lower() if "sha256" in entry else digest(entry["key"]),
+                   entry.get("rate", RATE_LIMIT), entry.get("burst", RATE_LIMIT_BURST), entry.get("daily_quota", DAILY_QUOTA))
+            for entry in entries]
+
+class KeyStore:
+    def __init__(self, keys):
+        self.keys = {}
+        for api_key in keys:
+            if api_key.digest in self.keys:
+                raise ValueError(f"API key '{api_key.name}' is the same key as '{self.keys[api_key.digest].name}'")
+            self.keys[api_key.digest] = api_key
+
+    def lookup(self, key):
+        if not key:
+            return None
+        key_digest = digest(key)
+        api_key = self.keys.get(key_digest)
+        if api_key is None or not hmac.compare_digest(api_key.digest, key_digest):
+            return None
+        return api_key
+
+    # Returns (status, retry_after): 200 to serve the request, 401 for a missing or unknown key, or 429 with the
+    # whole number of seconds until the key may try again. Usage is counted per key name.
+    def authorize(self, key):
+        api_key = self.lookup(key)
+        if api_key is None:
+            metrics.api_requests.inc("unknown", "unauthorized")
+            return 401, None
+        wait = api_key.admit()
+        if wait:
+            metrics.api_requests.inc(api_key.name, "limited")
+            return 429, max(1, math.ceil(wait))
+        metrics.api_requests.inc(api_key.name, "allowed")
+        return 200, None
+
+def load_keys():
+    keys = parse_keys(API_KEYS)
+    if API_KEYS_FILE:
+        keys.extend(read_keys_file(API_KEYS_FILE))
+    if API_KEY_SET or not keys:
+        keys.insert(0, ApiKey("default", digest(API_KEY)))
+    return KeyStore(keys)
+
+key_store = load_keys()
+
+# Prints the sha256 to put in API_KEYS_FILE for a key: python auth.py KEY
+if __name__ == '__main__':
+    print(digest(sys.argv[1]))
@@ -0,0 +1,213 @@
+# backfill.py
+
+import os
+import sys
+import gzip
+import json
+import math
+import time
+import argparse
+import logging
+from collections import deque
+from datetime import datetime
+from config import BRIDGE_STATS_FILE, TORONTO_TZ
+from sources import SOURCES
+from history import PeriodHistory, to_epoch, MAX_PERIOD_DURATION
+from running_stats import (RunningStats, HourOfWeekStats, DurationHistogram, CLOSURE_BUCKETS, HISTOGRAM_MINUTES,
+                           HOURS_PER_WEEK, hour_of_week)
+from bridge_stats import BridgeStats
+from bridge_parser import extract_bridges
+from storage import write_snapshot
+from utils import parse_status
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Rebuild the stats file offline from any mix of:
+#   --seed      a stats file or an exported /history to start from
+#   --events    event logs (BRIDGE_STATS_FILE.log)
+#   --pages     a directory of archived bridge status pages, named by the time they were fetched (ISO 8601 or
+#               epoch seconds, e.g. 2024-06-24T18:00:00-04:00.html or 1719266400.html.gz), otherwise their mtime
+# Pages and events are replayed in time order through the same parse_status and update_status state machine as the
+# live poller, then every aggregate is recomputed from the history columns in one NumPy pass.
+#   python backfill.py --seed bridge_stats.json --pages archive/ --output /app/data/bridge_stats.json
+
+class ReplayHistory(PeriodHistory):
+    # Only the columns are kept while replaying, rebuild_aggregates fills in the aggregates at the end
+    track_aggregates = False
+
+class ReplayBridgeStats(BridgeStats):
+    history_class = ReplayHistory
+
+    def __init__(self):
+        super().__init__(load=False)
+
+# The periods PeriodHistory(records) would keep, in start order since expire() relies on it: outliers are dropped
+# the same way, and only the latest period can still be open
+def seed_columns(records):
+    periods = sorted(((to_epoch(record["start"]), to_epoch(record["end"]) if "end" in record else None) for record in records),
+                     key=lambda period: period[0])
+    kept = [(start, end) for i, (start, end) in enumerate(periods)
+            if ((end - start) / 60 <= MAX_PERIOD_DURATION if end is not None else i == len(periods) - 1)]
+    return ReplayHistory.from_columns([start for start, _ in kept], [end for _, end in kept])
+
+# A stats file keeps its bridge state, an exported /history only has the periods so the state is worked out from them
+def seed(bridge_stats, data):
+    entries = data["bridge_statistics"] if isinstance(data, dict) else data
+    for entry in entries:
+        closures = seed_columns(entry.get("closures", []))
+        raising_soon_times = seed_columns(entry.get("raising_soon_times", []))
+        if "last_status" in entry:
+            bridge_stat = dict(entry)
+        else:
+            times = [t for history in (closures, raising_soon_times) for column in (history.starts, history.ends)
+                     for t in column if not math.isnan(t)]
+            status = "Unavailable" if closures.is_open() else "Available"
+            last_change = datetime.fromtimestamp(max(times, default=time.time()), TORONTO_TZ)
+            bridge_stat = bridge_stats.create_new_bridge_stat(entry["id"], entry["location"], status, last_change)
+            bridge_stat["last_action"] = "Raising Soon" if raising_soon_times.is_open() else None
+        bridge_stat["closures"] = closures
+        bridge_stat["raising_soon_times"] = raising_soon_times
+        bridge_stats.stats["bridge_statistics"].append(bridge_stat)
+
+def read_events(path):
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def page_time(path):
+    name = os.path.basename(path).split('.html')[0]
+    try:
+        return datetime.fromtimestamp(float(name), TORONTO_TZ)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(name)
+        return parsed if parsed.tzinfo else TORONTO_TZ.localize(parsed)
+    except ValueError:
+        return datetime.fromtimestamp(os.path.getmtime(path), TORONTO_TZ)
+
+# Same as a live poll of source, one event per bridge on the page
+def read_pages(directory, source):
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if '.html' not in name or not os.path.isfile(path):
+            continue
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'rb') as f:
+            html = f.read().decode('utf-8', errors='replace')
+        timestamp = page_time(path).isoformat()
+        for _, bridge_name, raw_status in extract_bridges(html):
+            status, action = parse_status(raw_status)
+            yield {"source": source.key, "location": bridge_name, "status": status, "action": action, "ts": timestamp}
+
+# Hour of week for each epoch, converting each distinct hour once instead of every timestamp
+def hours_of_week(epochs):
+    hours, inverse = np.unique(np.floor(epochs / 3600), return_inverse=True)
+    return np.array([hour_of_week(hour * 3600) for hour in hours], dtype=np.int64)[inverse.reshape(-1)]
+
+# Every aggregate RunningStats, HourOfWeekStats and the DurationHistograms keep incrementally, computed from the
+# closed periods in one vectorized pass
+def rebuild_aggregates(history):
+    starts = np.frombuffer(history.starts, dtype=np.float64)[history.head:]
+    ends = np.frombuffer(history.ends, dtype=np.float64)[history.head:]
+    closed = ~np.isnan(ends)
+    starts, ends = starts[closed], ends[closed]
+    durations = (ends - starts) / 60
+
+    stats = RunningStats()
+    stats.count = len(durations)
+    if stats.count:
+        stats.mean_value = float(durations.mean())
+        stats.m2 = float(((durations - stats.mean_value) ** 2).sum())
+        uppers = np.array([upper for _, upper in CLOSURE_BUCKETS])
+        stats.buckets = np.bincount(np.searchsorted(uppers, durations), minlength=len(CLOSURE_BUCKETS)).tolist()
+        # The monotonic windows hold each period that's shorter (or longer) than every period after it
+        later = np.append(durations[1:], np.inf)
+        keep_min = durations < np.minimum.accumulate(later[::-1])[::-1]
+        later = np.append(durations[1:], -np.inf)
+        keep_max = durations > np.maximum.accumulate(later[::-1])[::-1]
+        stats.min_window = deque(zip(starts[keep_min].tolist(), durations[keep_min].tolist()))
+        stats.max_window = deque(zip(starts[keep_max].tolist(), durations[keep_max].tolist()))
+
+    weekly = HourOfWeekStats()
+    start_hours = hours_of_week(starts)
+    weekly.counts = np.bincount(start_hours, minlength=HOURS_PER_WEEK).tolist()
+    weekly.duration_sums = np.bincount(start_hours, weights=durations, minlength=HOURS_PER_WEEK).tolist()
+    minutes = np.zeros(HOURS_PER_WEEK)
+    # A period can't span more hours than this
+    for k in range(math.ceil(HISTOGRAM_MINUTES / 60) + 1):
+        hour_start = (np.floor(starts / 3600) + k) * 3600
+        overlap = np.clip(np.minimum(ends, hour_start + 3600) - np.maximum(starts, hour_start), 0, None) / 60
+        minutes += np.bincount(hours_of_week(hour_start), weights=overlap, minlength=HOURS_PER_WEEK)
+    weekly.minutes = minutes.tolist()
+
+    bins = np.minimum(durations.astype(np.int64), HISTOGRAM_MINUTES)
+    hourly = np.bincount((start_hours % 24) * (HISTOGRAM_MINUTES + 1) + bins, minlength=24 * (HISTOGRAM_MINUTES + 1))
+    hourly = hourly.reshape(24, HISTOGRAM_MINUTES + 1)
+
+    history.stats = stats
+    history.weekly = weekly
+    history.histogram = DurationHistogram(hourly.sum(axis=0).tolist())
+    history.hourly = [DurationHistogram(counts) for counts in hourly.tolist()]
+
+def backfill(seed_files=(), event_files=(), page_dirs=(), source=SOURCES[0]):
+    bridge_stats = ReplayBridgeStats()
+    for path in seed_files:
+        with open(path, 'r') as f:
+            seed(bridge_stats, json.load(f))
+    events = []
+    for path in event_files:
+        events.extend(read_events(path))
+    for directory in page_dirs:
+        events.extend(read_pages(directory, source))
+    events.sort(key=lambda event: datetime.fromisoformat(event["ts"]))
+    bridge_stats.replay_events(events)
+    for bridge_stat in bridge_stats.stats["bridge_statistics"]:
+        rebuild_aggregates(bridge_stat["closures"])
+        rebuild_aggregates(bridge_stat["raising_soon_times"])
+        bridge_stats.recalculate_all_stats(bridge_stat)
+    return bridge_stats, events
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the bridge stats file from archived pages, event logs or exported history")
+    parser.add_argument('--seed', action='append', default=[], help="stats file or exported /history JSON to start from")
+    parser.add_argument('--events', action='append', default=[], help="event log to replay")
+    parser.add_argument('--pages', action='append', default=[], help="directory of archived bridge status pages")
+    parser.add_argument('--source', default=SOURCES[0].key, help="BRIDGE_SOURCES key the pages came from, for bridge ids")
+    parser.add_argument('--output', default=BRIDGE_STATS_FILE, help="stats file to write")
+    parser.add_argument('--force', action='store_true', help="overwrite the output and discard its event log")
+    args = parser.parse_args(argv)
+
+    if np is None:
+        sys.exit("backfill.py needs NumPy: pip install numpy")
+    sources = {source.key: source for source in SOURCES}
+    if args.source not in sources:
+        sys.exit(f"Unknown source {args.source}, expected one of {', '.join(sources)}")
+    logs = [path for path in (f"{args.output}.log", f"{args.output}.log.compacting") if os.path.exists(path)]
+    if (os.path.exists(args.output) or logs) and not args.force:
+        sys.exit(f"{args.output} already exists, stop the server and rerun with --force to replace it")
+
+    started = time.perf_counter()
+    bridge_stats, events = backfill(args.seed, args.events, args.pages, sources[args.source])
+    # Without the old log the server won't replay stale events on top of the new file
+    for path in logs:
+        os.remove(path)
+    write_snapshot(args.output, bridge_stats.serialize_stats(), bridge_stats.serialize_derived())
+    elapsed = time.perf_counter() - started
+
+    closures = sum(len(s["closures"]) for s in bridge_stats.stats["bridge_statistics"])
+    print(f"Replayed {len(events)} observations into {len(bridge_stats.stats['bridge_statistics'])} bridges "
+          f"({closures} closures) in {elapsed:.2f}s, wrote {args.output}")
+    if len(events) > 1:
+        span = (datetime.fromisoformat(events[-1]["ts"]) - datetime.fromisoformat(events[0]["ts"])).total_seconds()
+        print(f"{span / max(elapsed, 1e-9):,.0f}x real time")
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    main()
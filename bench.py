@@ -0,0 +1,189 @@
+# bench.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import logging
+import statistics
+import subprocess
+import tempfile
+from collections import namedtuple
+from datetime import timedelta
+from config import API_KEY
+from sources import SOURCES
+from bridge_stats import BridgeStats
+from storage import JsonFileStorage, EventLogStorage
+from bridge_parser import extract_bridges
+from response_cache import CachedResponse
+from utils import get_current_time
+import synthetic_history
+
+# Times the poll cycle, the stats engine and the endpoints against a synthetic stats file and prints a table,
+# with the results as JSON on stdout (or --output) so runs from different versions can be compared:
+#   python bench.py --bridges 50 --days 180 --output before.json
+#   python bench.py --bridges 50 --days 180 --compare before.json
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "bridge_sct.html")
+
+# Stands in for an upstream response in process_page
+Page = namedtuple("Page", ["content", "text"])
+
+class Bench:
+    def __init__(self, directory, bridges, days, repeat):
+        self.directory = directory
+        self.repeat = repeat
+        self.source_file = os.path.join(directory, "source.json")
+        synthetic_history.write(self.source_file, bridges, days)
+        self.results = {}
+
+    # Runs fn repeat times, each after an untimed setup whose return value is passed to fn
+    def time(self, name, fn, setup=None):
+        samples = []
+        for _ in range(self.repeat):
+            arg = setup() if setup else None
+            started = time.perf_counter()
+            fn(arg) if setup else fn()
+            samples.append(time.perf_counter() - started)
+        self.results[name] = {
+            "runs": len(samples),
+            "min_ms": round(min(samples) * 1e3, 4),
+            "median_ms": round(statistics.median(samples) * 1e3, 4),
+            "mean_ms": round(statistics.mean(samples) * 1e3, 4),
+            "max_ms": round(max(samples) * 1e3, 4)
+        }
+
+    def copy(self, name, derived=False):
+        filename = os.path.join(self.directory, name)
+        for path in (filename, f"{filename}.derived"):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.copy(self.source_file, filename)
+        if derived:
+            # Saving once writes the derived stats the next load trusts
+            BridgeStats(filename, storage=JsonFileStorage(filename)).save_stats()
+        return filename
+
+    def run(self):
+        cold = self.copy("cold.json")
+        self.time("load_cold", lambda: BridgeStats(cold, storage=JsonFileStorage(cold)))
+        warm = self.copy("warm.json", derived=True)
+        self.time("load_warm", lambda: BridgeStats(warm, storage=JsonFileStorage(warm)))
+
+        def loaded():
+            return BridgeStats(warm, storage=JsonFileStorage(warm))
+        now = get_current_time()
+        self.time("cleanup_data", lambda stats: cleanup(stats, now), loaded)
+        self.time("cleanup_data_expire_day", lambda stats: cleanup(stats, now + timedelta(days=1)), loaded)
+
+        logged = self.copy("logged.json", derived=True)
+        stats = BridgeStats(logged, storage=EventLogStorage(logged, compact_events=10 ** 9, compact_interval=10 ** 9))
+        clock = [now]
+        self.time("update_bridge_stat", lambda: transition(stats, clock))
+        self.time("save_stats", stats.save_stats)
+
+        with open(FIXTURE, 'r') as f:
+            html = f.read()
+        self.time("extract_bridges", lambda: extract_bridges(html))
+        self.time("serialize_stats", lambda: CachedResponse(stats.get_filtered_stats()))
+        self.time("serialize_history", lambda: CachedResponse(stats.get_filtered_history()))
+        self.run_pipeline(stats, html)
+        return self.results
+
+    # The parts that go through the module level state the server uses
+    def run_pipeline(self, stats, html):
+        import bridge_status
+        from app import app
+        previous = bridge_status.bridge_stats
+        bridge_status.bridge_stats = stats
+        try:
+            # Alternate two versions of the page so every poll parses and updates the stats
+            pages = [html, html.replace('class="green">Available<', 'class="green">Unavailable<', 1)]
+            pages = [Page(page.encode(), page) for page in pages]
+            polls = [0]
+            def poll():
+                polls[0] += 1
+                bridge_status.process_page(SOURCES[0], pages[polls[0] % 2], 0)
+            self.time("poll_cycle", poll)
+            self.time("poll_cycle_unchanged", lambda: bridge_status.process_page(SOURCES[0], None, 0))
+
+            client = app.test_client()
+            headers = {"X-API-Key": API_KEY}
+            for route in ("/bridge-status", "/stats", "/history"):
+                self.time(f"get{route.replace('/', '_').replace('-', '_')}", lambda: client.get(route, headers=headers).close())
+            self.time("get_history_filtered", lambda: client.get("/history?bridge=1&limit=100", headers=headers).close())
+        finally:
+            bridge_status.bridge_stats = previous
+
+def cleanup(stats, now):
+    for bridge_stat in stats.stats["bridge_statistics"]:
+        stats.cleanup_data(bridge_stat, now)
+
+# One closure opening or ending on every bridge
+def transition(stats, clock):
+    clock[0] += timedelta(minutes=10)
+    for bridge_stat in stats.stats["bridge_statistics"]:
+        status = "Unavailable" if bridge_stat["last_status"] == "Available" else "Available"
+        stats.update_bridge_stat(bridge_stat["id"], bridge_stat["location"], status, None, clock[0])
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Prints each benchmark's median against a previous run and returns the names that got slower than threshold
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if not before or not before["median_ms"]:
+            continue
+        ratio = result["median_ms"] / before["median_ms"]
+        flag = " REGRESSION" if ratio > threshold else ""
+        print(f"{name:<28}{before['median_ms']:12.3f} ->{result['median_ms']:12.3f} ms  x{ratio:.2f}{flag}", file=sys.stderr)
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the poll cycle, stats engine and endpoints")
+    parser.add_argument('--bridges', type=int, default=5)
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help="write the JSON results here instead of stdout")
+    parser.add_argument('--compare', help="JSON results of a previous run to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="median slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory:
+        results = Bench(directory, args.bridges, args.days, args.repeat).run()
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {"bridges": args.bridges, "days": args.days, "repeat": args.repeat},
+        "results": results
+    }
+    for name, result in results.items():
+        print(f"{name:<28}{result['median_ms']:12.3f} ms median{result['min_ms']:12.3f} ms min", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get("params") != report["params"]:
+            print(f"Warning: comparing against a run with different params {baseline.get('params')}", file=sys.stderr)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
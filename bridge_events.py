@@ -0,0 +1,73 @@
+# bridge_events.py
+
+import json
+import threading
+from collections import deque
+from itertools import islice
+from config import STREAM_BACKLOG
+from snapshot import get_snapshot
+
+HEARTBEAT = b": heartbeat\n\n"
+
+def format_event(event, data, event_id=None):
+    message = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{message}event: {event}\ndata: {data}\n\n".encode()
+
+# Full status as the first message of every stream
+def snapshot_event():
+    return format_event("snapshot", str(get_snapshot().responses["bridge-status"].body, "utf-8").strip())
+
+class Broadcaster:
+    # Fans bridge changes out to /bridge-status/stream subscribers. Each change is encoded once into a shared ring
+    # buffer tagged with a sequence number and subscribers only remember the last sequence they sent, so a publish
+    # costs the same however many clients are connected. A subscriber that falls further behind than the buffer
+    # gets a fresh snapshot instead.
+    def __init__(self, backlog=STREAM_BACKLOG):
+        self.condition = threading.Condition()
+        self.sequence = 0
+        self.events = deque(maxlen=backlog)
+        # Open streams, kept by the async server for the bridge_stream_subscribers gauge
+        self.subscribers = 0
+        # Called after every publish, lets the async server wake its subscribers
+        self.listeners = []
+
+    # changes is a list of (event, payload)
+    def publish(self, changes):
+        if not changes:
+            return
+        with self.condition:
+            for event, payload in changes:
+                self.sequence += 1
+                data = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+                self.events.append((self.sequence, format_event(event, data, self.sequence)))
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener()
+
+    # Encoded events after sequence and the latest sequence. Events are None if some were already dropped.
+    def events_since(self, sequence):
+        with self.condition:
+            if sequence == self.sequence:
+                return [], sequence
+            first = self.events[0][0] if self.events else self.sequence + 1
+            if first > sequence + 1:
+                return None, self.sequence
+            return [data for _, data in islice(self.events, sequence + 1 - first, None)], self.sequence
+
+    def current_sequence(self):
+        with self.condition:
+            return self.sequence
+
+broadcaster = Broadcaster()
+
+# Bridges whose state, info or icon changed, and bridges that are gone
+def bridge_changes(previous, current):
+    previous_by_id = {entry['id']: entry for entry in previous}
+    changes = []
+    for entry in current:
+        old = previous_by_id.pop(entry['id'], None)
+        if old is None or any(old.get(k) != entry.get(k) for k in ('state', 'info', 'icon')):
+            # Entries are flat, this also thaws a follower's frozen snapshot entries for encoding
+            changes.append(("bridge", dict(entry)))
+    changes.extend(("remove", {"id": bridge_id}) for bridge_id in previous_by_id)
+    return changes
@@ -0,0 +1,178 @@
+# bridge_parser.py
+
+import sys
+import time
+import logging
+import importlib
+from html.parser import HTMLParser
+from config import HTML_PARSER
+
+logger = logging.getLogger(__name__)
+
+# Every extractor returns (bridge_id, bridge_name, raw status) for each table#grey_box on the bridge status page,
+# numbering the tables in page order. Tables missing a name or status are logged and skipped.
+
+class BridgeTableParser(HTMLParser):
+    # Streaming state machine that only keeps the text of the first span.lgtextblack and span#status
+    # inside each table#grey_box, without building a tree of the page
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self.idx = 0
+        self.table_depth = 0
+        self.box_depth = None
+        self.name = None
+        self.status = None
+        self.capture = None
+        self.capture_depth = 0
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            self.table_depth += 1
+            if self.box_depth is None and dict(attrs).get('id') == 'grey_box':
+                self.box_depth = self.table_depth
+                self.idx += 1
+                self.name = None
+                self.status = None
+            return
+        if tag != 'span' or self.box_depth is None:
+            return
+        if self.capture:
+            self.capture_depth += 1
+            return
+        attrs = dict(attrs)
+        if self.name is None and 'lgtextblack' in (attrs.get('class') or '').split():
+            self.capture = 'name'
+        elif self.status is None and attrs.get('id') == 'status':
+            self.capture = 'status'
+        else:
+            return
+        self.capture_depth = 1
+        self.text = []
+
+    def handle_endtag(self, tag):
+        if tag == 'span' and self.capture:
+            self.capture_depth -= 1
+            if self.capture_depth == 0:
+                self.finish_capture()
+        elif tag == 'table' and self.table_depth:
+            if self.table_depth == self.box_depth:
+                self.finish_capture()
+                if self.name is not None and self.status is not None:
+                    self.rows.append((self.idx, self.name, self.status))
+                else:
+                    logger.error(f"Error processing bridge {self.idx}: missing name or status")
+                self.box_depth = None
+            self.table_depth -= 1
+
+    def handle_data(self, data):
+        if self.capture:
+            self.text.append(data)
+
+    def finish_capture(self):
+        if self.capture:
+            setattr(self, self.capture, ''.join(self.text).strip())
+            self.capture = None
+
+def extract_stream(html):
+    parser = BridgeTableParser()
+    parser.feed(html)
+    parser.close()
+    return parser.rows
+
+def extract_selectolax(html):
+    from selectolax.lexbor import LexborHTMLParser
+    rows = []
+    for idx, table in enumerate(LexborHTMLParser(html).css('table#grey_box'), 1):
+        name = table.css_first('span.lgtextblack')
+        status = table.css_first('span#status')
+        if name is None or status is None:
+            logger.error(f"Error processing bridge {idx}: missing name or status")
+            continue
+        rows.append((idx, name.text().strip(), status.text().strip()))
+    return rows
+
+def extract_lxml(html):
+    from lxml import html as lxml_html
+    rows = []
+    for idx, table in enumerate(lxml_html.fromstring(html).xpath('//table[@id="grey_box"]'), 1):
+        name = table.xpath('.//span[contains(concat(" ", normalize-space(@class), " "), " lgtextblack ")]')
+        status = table.xpath('.//span[@id="status"]')
+        if not name or not status:
+            logger.error(f"Error processing bridge {idx}: missing name or status")
+            continue
+        rows.append((idx, name[0].text_content().strip(), status[0].text_content().strip()))
+    return rows
+
+def extract_bs4(html):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    rows = []
+    for idx, table in enumerate(soup.find_all('table', {'id': 'grey_box'}), 1):
+        try:
+            bridge_name = table.find('span', {'class': 'lgtextblack'}).text.strip()
+            status = table.find('span', {'id': 'status'}).text.strip()
+            rows.append((idx, bridge_name, status))
+        except Exception as e:
+            logger.error(f"Error processing bridge {idx}: {str(e)}", exc_info=True)
+    return rows
+
+EXTRACTORS = {
+    'selectolax': extract_selectolax,
+    'lxml': extract_lxml,
+    'stream': extract_stream,
+    'bs4': extract_bs4
+}
+
+# "auto" picks the fastest backend that's installed, the streaming parser needs nothing beyond the standard library
+def choose_extractor(name=HTML_PARSER):
+    if name != 'auto':
+        return name
+    for candidate, module in (('selectolax', 'selectolax.lexbor'), ('lxml', 'lxml.html')):
+        try:
+            importlib.import_module(module)
+            return candidate
+        except ImportError:
+            pass
+    return 'stream'
+
+# Picked on first use so importing a backend doesn't slow down startup
+extractor = None
+
+# Falls back to BeautifulSoup if the chosen backend fails or finds no bridges
+def extract_bridges(html):
+    global extractor
+    if extractor is None:
+        extractor = choose_extractor()
+        logger.info(f"Using {extractor} to extract bridge status")
+    if extractor != 'bs4':
+        try:
+            rows = EXTRACTORS[extractor](html)
+            if rows:
+                return rows
+            logger.warning(f"{extractor} extractor found no bridges, falling back to BeautifulSoup")
+        except Exception as e:
+            logger.warning(f"{extractor} extractor failed, falling back to BeautifulSoup: {str(e)}")
+    return extract_bs4(html)
+
+# Time each available extractor on a page: python bridge_parser.py fixtures/bridge_sct.html
+def benchmark_extractors(html, number=200):
+    results = {}
+    for name, extract in EXTRACTORS.items():
+        try:
+            extract(html)
+        except ImportError:
+            continue
+        start = time.perf_counter()
+        for _ in range(number):
+            extract(html)
+        results[name] = (time.perf_counter() - start) / number
+    return results
+
+if __name__ == '__main__':
+    logging.disable(logging.ERROR)
+    with open(sys.argv[1], 'r') as f:
+        page = f.read()
+    for name, seconds in sorted(benchmark_extractors(page).items(), key=lambda item: item[1]):
+        print(f"{name:<12}{seconds * 1e6:10.1f} us/page")
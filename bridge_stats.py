@@ -1,40 +1,117 @@
 # bridge_stats.py
 
 import json
-import os
-import math
-from scipy import stats
+import time
+import threading
 from datetime import datetime, timedelta
 from config import BRIDGE_STATS_FILE
+from storage import create_storage
+from history import PeriodHistory, to_epoch, RETENTION_DAYS
+from running_stats import WEEK_SECONDS
+import metrics
 
 class BridgeStats:
-    def __init__(self, filename=BRIDGE_STATS_FILE):
+    history_class = PeriodHistory
+
+    def __init__(self, filename=BRIDGE_STATS_FILE, storage=None, load=True):
         self.filename = filename
-        self.stats = self.load_stats()
+        self.lock = threading.RLock()
+        # Bumped whenever closures or raising soon times change, so cached /history output can be reused until then
+        self.history_generation = 0
+        self.storage = storage
+        self.stats = {"bridge_statistics": []}
+        # (source key, bridge name) -> id, see bridge_id
+        self.bridge_ids = {}
+        if load:
+            self.load()
+
+    # Read the stats from storage and take ownership of writing them. In multi-process mode only the leader calls this.
+    def load(self):
+        with self.lock:
+            self.storage = self.storage or create_storage(self.filename)
+            self.stats, events, derived = self.storage.load()
+            # Compared against snapshots other processes published, so a process that takes over as leader starts
+            # from a generation none of them could have reached and re-encodes the history on its first publish
+            self.history_generation = time.time_ns()
+            self.restore(events, derived)
+
+    def restore(self, events, derived):
+        self.bridge_ids = {(s["source"], s["location"]): s["id"] for s in self.stats["bridge_statistics"] if s.get("source")}
         for bridge_stat in self.stats["bridge_statistics"]:
-            self.recalculate_all_stats(bridge_stat)
-        self.save_stats()
+            state = derived.get(str(bridge_stat["id"])) if derived else None
+            if state:
+                # Trust the persisted columns and aggregates, nothing to parse or recalculate
+                bridge_stat["closures"] = PeriodHistory.from_state(state["closures"])
+                bridge_stat["raising_soon_times"] = PeriodHistory.from_state(state["raising_soon_times"])
+            else:
+                bridge_stat["closures"] = PeriodHistory(bridge_stat["closures"])
+                bridge_stat["raising_soon_times"] = PeriodHistory(bridge_stat["raising_soon_times"])
+                self.recalculate_all_stats(bridge_stat)
+        self.replay_events(events)
+        self.storage.attach(self.lock, self.capture, self.serialize_stats, self.serialize_derived)
+        if events:
+            self.save_stats()
+
+    # A copy of the stats for storage to encode without holding the lock. Called with the lock held, it only copies
+    # the scalar fields and the history columns so updates from the pollers aren't held up by a save.
+    def capture(self):
+        return {**self.stats, "bridge_statistics": [
+            {**bridge_stat, "closures": bridge_stat["closures"].copy(), "raising_soon_times": bridge_stat["raising_soon_times"].copy()}
+            for bridge_stat in self.stats["bridge_statistics"]
+        ]}
 
-    def load_stats(self):
-        try:
-            with open(self.filename, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return {"bridge_statistics": []}
+    def serialize_stats(self, stats=None):
+        return json.dumps(stats or self.stats, indent=2, default=PeriodHistory.to_list)
+
+    def serialize_derived(self, stats=None):
+        return {
+            str(bridge_stat["id"]): {
+                "closures": bridge_stat["closures"].to_state(),
+                "raising_soon_times": bridge_stat["raising_soon_times"].to_state()
+            }
+            for bridge_stat in (stats or self.stats)["bridge_statistics"]
+        }
 
     def save_stats(self):
-        directory = os.path.dirname(self.filename)
-        if directory:
-            os.makedirs(directory, exist_ok=True)
-        with open(self.filename, 'w') as f:
-            json.dump(self.stats, f, indent=2)
+        self.storage.save()
+
+    # Re-apply logged transitions on top of the last snapshot. Events the snapshot already covers are skipped
+    # so a log left behind by an interrupted compaction can be replayed safely.
+    def replay_events(self, events):
+        for event in events:
+            timestamp = datetime.fromisoformat(event["ts"])
+            # Archived pages replayed by backfill.py only know which source and bridge they came from
+            bridge_id = event["id"] if "id" in event else self.bridge_id(event["source"], event["location"])
+            bridge_stat = self.get_bridge_stat(bridge_id)
+            if bridge_stat and timestamp <= datetime.fromisoformat(bridge_stat["stats_last_updated"]):
+                continue
+            self.apply_update(bridge_id, event["location"], event["status"], event["action"], timestamp, event.get("source"))
+
+    # A bridge's id is assigned the first time it's seen on its source's page and kept with its stats, so it never
+    # changes when upstream reorders, adds or removes bridges or BRIDGE_SOURCES is reordered. Stats saved before
+    # bridges had a source are claimed by the first source that lists a bridge of the same name.
+    def bridge_id(self, source, bridge_name):
+        with self.lock:
+            bridge_id = self.bridge_ids.get((source, bridge_name))
+            if bridge_id is None:
+                bridge_stat = next((s for s in self.stats["bridge_statistics"]
+                                    if s["location"] == bridge_name and not s.get("source")), None)
+                if bridge_stat:
+                    bridge_stat["source"] = source
+                    bridge_id = bridge_stat["id"]
+                else:
+                    taken = [s["id"] for s in self.stats["bridge_statistics"]] + list(self.bridge_ids.values())
+                    bridge_id = max(taken, default=0) + 1
+                self.bridge_ids[(source, bridge_name)] = bridge_id
+            return bridge_id
 
     def get_bridge_stat(self, bridge_id):
         return next((s for s in self.stats["bridge_statistics"] if s["id"] == bridge_id), None)
 
-    def create_new_bridge_stat(self, bridge_id, bridge_name, status, timestamp):
+    def create_new_bridge_stat(self, bridge_id, bridge_name, status, timestamp, source=None):
         return {
             "id": bridge_id,
+            "source": source,
             "location": bridge_name,
             "last_status": status,
             "last_action": None,
@@ -43,157 +120,111 @@ class BridgeStats:
             "avg_closure_duration": 0,
             "avg_raising_soon_to_unavailable": 0,
             "closure_durations": {"1-9m": 0, "10-15m": 0, "16-20m": 0, "21-25m": 0, "26-30m": 0, "31m+": 0},
-            "closures": [],
-            "raising_soon_times": [],
+            "closures": self.history_class(),
+            "raising_soon_times": self.history_class(),
             "last_status_change": timestamp.isoformat(),
             "stats_last_updated": timestamp.isoformat()
         }
 
-    def update_bridge_stat(self, bridge_id, bridge_name, status, action, timestamp):
+    # Only polls that change something are written to storage, so I/O scales with transitions rather than history size
+    def update_bridge_stat(self, bridge_id, bridge_name, status, action, timestamp, source=None):
+        with self.lock:
+            with metrics.stats_update_seconds.time():
+                changed = self.apply_update(bridge_id, bridge_name, status, action, timestamp, source)
+            event = None
+            if changed:
+                metrics.transitions.inc(bridge_id, metrics.transition_state(status, action))
+                event = {"id": bridge_id, "source": source, "location": bridge_name, "status": status, "action": action,
+                         "ts": timestamp.isoformat()}
+            self.storage.record(event)
+
+    def apply_update(self, bridge_id, bridge_name, status, action, timestamp, source=None):
         bridge_stat = self.get_bridge_stat(bridge_id)
+        changed = False
         if not bridge_stat:
-            bridge_stat = self.create_new_bridge_stat(bridge_id, bridge_name, status, timestamp)
+            bridge_stat = self.create_new_bridge_stat(bridge_id, bridge_name, status, timestamp, source)
             self.stats["bridge_statistics"].append(bridge_stat)
+            if source:
+                self.bridge_ids[(source, bridge_name)] = bridge_id
+            changed = True
         
-        self.update_status(bridge_stat, status, action, timestamp)
-        self.cleanup_data(bridge_stat, timestamp)
+        changed = self.update_status(bridge_stat, status, action, timestamp) or changed
+        if self.cleanup_data(bridge_stat, timestamp) or changed:
+            self.history_generation += 1
         
         bridge_stat["stats_last_updated"] = timestamp.isoformat()
-        self.save_stats()
+        return changed
 
+    # Returns True if the update changed the bridge's recorded state
     def update_status(self, bridge_stat, status, action, timestamp):
+        changed = False
+        epoch = timestamp.timestamp()
+        closures = bridge_stat["closures"]
+        raising_soon_times = bridge_stat["raising_soon_times"]
         # Close out any open raising_soon periods
-        if bridge_stat["raising_soon_times"] and "end" not in bridge_stat["raising_soon_times"][-1]:
+        if raising_soon_times.is_open():
             if action != "Raising Soon":
-                bridge_stat["raising_soon_times"][-1]["end"] = timestamp.isoformat()
-                self.update_raising_soon_stats(bridge_stat, bridge_stat["raising_soon_times"][-1])
+                raising_soon_times.close(epoch)
+                self.update_raising_soon_stats(bridge_stat)
+                changed = True
 
         if status != bridge_stat["last_status"] or action != bridge_stat.get("last_action"):
+            changed = True
             if status == "Unavailable" and bridge_stat["last_status"] == "Available":
-                bridge_stat["closures"].append({"start": timestamp.isoformat()})
+                closures.open(epoch)
             elif status == "Available" and bridge_stat["last_status"] == "Unavailable":
-                if bridge_stat["closures"] and "end" not in bridge_stat["closures"][-1]:
-                    bridge_stat["closures"][-1]["end"] = timestamp.isoformat()
-                    self.update_closure_stats(bridge_stat, bridge_stat["closures"][-1])
+                if closures.is_open():
+                    closures.close(epoch)
+                    self.update_closure_stats(bridge_stat)
             
             if action == "Raising Soon":
-                bridge_stat["raising_soon_times"].append({"start": timestamp.isoformat()})
+                raising_soon_times.open(epoch)
             
             bridge_stat["last_status"] = status
             bridge_stat["last_action"] = action
             bridge_stat["last_status_change"] = timestamp.isoformat()
+        return changed
 
-    def update_closure_stats(self, bridge_stat, closure):
-        duration = round((datetime.fromisoformat(closure["end"]) - datetime.fromisoformat(closure["start"])).total_seconds() / 60)
-        
-        if len(bridge_stat["closures"]) == 1:
-            bridge_stat["avg_closure_duration"] = duration
+    # Derived fields are read straight off the running aggregates, so refreshing them is O(1)
+    def update_closure_stats(self, bridge_stat):
+        running = bridge_stat["closures"].stats
+        bridge_stat["avg_closure_duration"] = round(running.mean())
+        bridge_stat["shortest_closure"] = round(running.min())
+        bridge_stat["longest_closure"] = round(running.max())
+        bridge_stat["closure_durations"] = running.bucket_counts()
+        if running.count:
+            bridge_stat["closure_duration_ci"] = running.ci()
+            bridge_stat["closure_duration_quantiles"] = [round(q) for q in bridge_stat["closures"].histogram.quantiles(0)[1]]
         else:
-            total_duration = bridge_stat["avg_closure_duration"] * (len(bridge_stat["closures"]) - 1) + duration
-            bridge_stat["avg_closure_duration"] = round(total_duration / len(bridge_stat["closures"]))
-        
-        if duration < bridge_stat["shortest_closure"] or bridge_stat["shortest_closure"] == 0:
-            bridge_stat["shortest_closure"] = duration
-        if duration > bridge_stat["longest_closure"]:
-            bridge_stat["longest_closure"] = duration
-
-        if duration <= 9:
-            bridge_stat["closure_durations"]["1-9m"] += 1
-        elif duration <= 15:
-            bridge_stat["closure_durations"]["10-15m"] += 1
-        elif duration <= 20:
-            bridge_stat["closure_durations"]["16-20m"] += 1
-        elif duration <= 25:
-            bridge_stat["closure_durations"]["21-25m"] += 1
-        elif duration <= 30:
-            bridge_stat["closure_durations"]["26-30m"] += 1
-        else:
-            bridge_stat["closure_durations"]["31m+"] += 1
+            bridge_stat.pop("closure_duration_ci", None)
+            bridge_stat.pop("closure_duration_quantiles", None)
 
-    def update_raising_soon_stats(self, bridge_stat, raising_soon_time):
-        duration = round((datetime.fromisoformat(raising_soon_time["end"]) - datetime.fromisoformat(raising_soon_time["start"])).total_seconds() / 60)
-        if len(bridge_stat["raising_soon_times"]) == 1:
-            bridge_stat["avg_raising_soon_to_unavailable"] = duration
+    def update_raising_soon_stats(self, bridge_stat):
+        running = bridge_stat["raising_soon_times"].stats
+        bridge_stat["avg_raising_soon_to_unavailable"] = round(running.mean())
+        if running.count:
+            bridge_stat["raising_soon_ci"] = running.ci()
+            bridge_stat["raising_soon_quantiles"] = [round(q) for q in bridge_stat["raising_soon_times"].histogram.quantiles(0)[1]]
         else:
-            total_duration = bridge_stat["avg_raising_soon_to_unavailable"] * (len(bridge_stat["raising_soon_times"]) - 1) + duration
-            bridge_stat["avg_raising_soon_to_unavailable"] = round(total_duration / len(bridge_stat["raising_soon_times"]))
-
-    def calculate_ci(self, data, confidence=0.95):
-        if not data:
-            return 0, 0
-        data = [d for d in data if d is not None]
-        mean = sum(data) / len(data)
-        std_err = stats.sem(data)
-        ci = stats.t.interval(confidence, len(data)-1, loc=mean, scale=std_err)
-        return round(ci[0]), round(ci[1])
-
-    # calc the stats from scratch, called on app start or when an outlier is deleted because data history changed
-    def recalculate_all_stats(self, bridge_stat):
-        closures = bridge_stat["closures"]
-        raising_soon_times = bridge_stat["raising_soon_times"]
+            bridge_stat.pop("raising_soon_ci", None)
+            bridge_stat.pop("raising_soon_quantiles", None)
 
-        # Reset stats
-        bridge_stat["shortest_closure"] = 0
-        bridge_stat["longest_closure"] = 0
-        bridge_stat["avg_closure_duration"] = 0
-        bridge_stat["avg_raising_soon_to_unavailable"] = 0
-        bridge_stat["closure_durations"] = {"1-9m": 0, "10-15m": 0, "16-20m": 0, "21-25m": 0, "26-30m": 0, "31m+": 0}
-
-       # Recalculate closure stats
-        if closures:
-            durations = [(datetime.fromisoformat(c["end"]) - datetime.fromisoformat(c["start"])).total_seconds() / 60 
-                         for c in closures if "end" in c]
-            bridge_stat["avg_closure_duration"] = round(sum(durations) / len(durations))
-            bridge_stat["closure_duration_ci"] = self.calculate_ci(durations)
-            bridge_stat["shortest_closure"] = round(min(durations))
-            bridge_stat["longest_closure"] = round(max(durations))
-
-            for duration in durations:
-                if duration <= 9:
-                    bridge_stat["closure_durations"]["1-9m"] += 1
-                elif duration <= 15:
-                    bridge_stat["closure_durations"]["10-15m"] += 1
-                elif duration <= 20:
-                    bridge_stat["closure_durations"]["16-20m"] += 1
-                elif duration <= 25:
-                    bridge_stat["closure_durations"]["21-25m"] += 1
-                elif duration <= 30:
-                    bridge_stat["closure_durations"]["26-30m"] += 1
-                else:
-                    bridge_stat["closure_durations"]["31m+"] += 1
-
-        # Recalculate raising_soon stats
-        if raising_soon_times:
-            durations = [(datetime.fromisoformat(r["end"]) - datetime.fromisoformat(r["start"])).total_seconds() / 60 
-                         for r in raising_soon_times if "end" in r]
-            bridge_stat["avg_raising_soon_to_unavailable"] = round(sum(durations) / len(durations))
-            bridge_stat["raising_soon_ci"] = self.calculate_ci(durations)
+    def recalculate_all_stats(self, bridge_stat):
+        self.update_closure_stats(bridge_stat)
+        self.update_raising_soon_stats(bridge_stat)
 
-    # Remove data thats older than 180 days and durations that are longer than 1.5 hours since they are outliers, and recalculate all stats from scratch if something is deleted
+    # Remove data thats older than 180 days. History is time ordered so only the expired prefix is touched,
+    # and the removed durations are subtracted from the aggregates (outliers never get recorded in the first place)
     def cleanup_data(self, bridge_stat, current_timestamp):
-        sixty_days_ago = current_timestamp - timedelta(days=180)
-        max_duration = timedelta(hours=1, minutes=30)
+        min_start = to_epoch(current_timestamp - timedelta(days=RETENTION_DAYS))
 
-        original_length = len(bridge_stat["closures"]) + len(bridge_stat["raising_soon_times"])
-
-        bridge_stat["closures"] = [
-            closure for closure in bridge_stat["closures"]
-            if datetime.fromisoformat(closure["start"]) > sixty_days_ago
-            and ("end" not in closure or 
-                 datetime.fromisoformat(closure["end"]) - datetime.fromisoformat(closure["start"]) <= max_duration)
-        ]
-
-        bridge_stat["raising_soon_times"] = [
-            time for time in bridge_stat["raising_soon_times"]
-            if datetime.fromisoformat(time["start"]) > sixty_days_ago
-            and ("end" not in time or 
-                 datetime.fromisoformat(time["end"]) - datetime.fromisoformat(time["start"]) <= max_duration)
-        ]
-
-        new_length = len(bridge_stat["closures"]) + len(bridge_stat["raising_soon_times"])
-
-        if new_length < original_length:
-            self.recalculate_all_stats(bridge_stat)
+        closures_removed = bridge_stat["closures"].expire(min_start)
+        if closures_removed:
+            self.update_closure_stats(bridge_stat)
+        raising_soon_removed = bridge_stat["raising_soon_times"].expire(min_start)
+        if raising_soon_removed:
+            self.update_raising_soon_stats(bridge_stat)
+        return closures_removed + raising_soon_removed
 
     # Output for API splitting the stats
     def get_filtered_stats(self):
@@ -202,10 +233,30 @@ class BridgeStats:
             for stat in self.stats.get('bridge_statistics', [])
         ]
     
+    # Closures by Toronto hour of week for /heatmap, straight off each history's weekly aggregates. Probabilities are
+    # over the weeks since the earliest closure still retained, counted as at least one week.
+    def get_heatmap(self, now):
+        heatmap = []
+        for stat in self.stats.get('bridge_statistics', []):
+            closures = stat["closures"]
+            weeks_observed = max(1.0, (now - closures.starts[closures.head]) / WEEK_SECONDS) if len(closures) else 0.0
+            summary = closures.weekly.summary(weeks_observed)
+            heatmap.append({
+                "id": stat["id"],
+                "location": stat["location"],
+                "weeks_observed": round(weeks_observed, 2),
+                "closures": summary["counts"],
+                "avg_closure_duration": summary["mean_durations"],
+                "closure_probability": summary["probabilities"]
+            })
+        return heatmap
+
     def get_filtered_history(self):
         return [
-            {k: v for k, v in stat.items() if k in ['raising_soon_times', 'closures', 'id', 'location']}
+            {k: (v.to_list() if isinstance(v, PeriodHistory) else v) for k, v in stat.items() if k in ['raising_soon_times', 'closures', 'id', 'location']}
             for stat in self.stats.get('bridge_statistics', [])
         ]
     
-bridge_stats = BridgeStats()
\ No newline at end of file
+# The server's stats, loaded by whichever process starts fetching: straight away with one process, once it's elected
+# leader with MULTIPROCESS=true. Importing this module (backfill.py, bench.py) doesn't touch BRIDGE_STATS_FILE.
+bridge_stats = BridgeStats(load=False)
\ No newline at end of file
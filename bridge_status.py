@@ -1,24 +1,66 @@
 # bridge_status.py
 
-import requests
-from bs4 import BeautifulSoup
+import time
+import json
+import asyncio
+import hashlib
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from config import URL
+from config import FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT, BRIDGE_COORDINATES_FILE
+from sources import SOURCES
+from poll_policy import PollPolicy
 from bridge_stats import bridge_stats
 from utils import parse_status, get_current_time
+from bridge_parser import extract_bridges
+from history import PeriodHistory
+import snapshot
+import shared_snapshot
+import metrics
+from bridge_events import broadcaster, bridge_changes
+from routing import crossing_eta
 
+# Coordinates by source key and bridge name. Only the St. Catharines sector's are built in, other sectors' can be
+# added with BRIDGE_COORDINATES_FILE in the same shape, e.g. {"PC": {"Clarence St.": {"lat": 42.88, "lng": -79.25}}}.
+# Bridges without coordinates have null lat/lng and are left out of /route.
 BRIDGE_COORDINATES = {
-    "Lakeshore Rd": {"lat": 43.21617521494522, "lng": -79.21223177177772},
-    "Carlton St.": {"lat": 43.19185980424842, "lng": -79.20100809118367},
-    "Queenston St.": {"lat": 43.165824700918485, "lng": -79.19492604380804},
-    "Glendale Ave.": {"lat": 43.145269317159695, "lng": -79.19232941376643},
-    "Highway 20": {"lat": 43.076504078254914, "lng": -79.21046775066173}
+    "SCT": {
+        "Lakeshore Rd": {"lat": 43.21617521494522, "lng": -79.21223177177772},
+        "Carlton St.": {"lat": 43.19185980424842, "lng": -79.20100809118367},
+        "Queenston St.": {"lat": 43.165824700918485, "lng": -79.19492604380804},
+        "Glendale Ave.": {"lat": 43.145269317159695, "lng": -79.19232941376643},
+        "Highway 20": {"lat": 43.076504078254914, "lng": -79.21046775066173}
+    }
 }
 
 logger = logging.getLogger(__name__)
 
-bridge_status = []
+def load_coordinates(filename):
+    coordinates = {key: dict(bridges) for key, bridges in BRIDGE_COORDINATES.items()}
+    if filename:
+        with open(filename, 'r') as f:
+            for key, bridges in json.load(f).items():
+                coordinates.setdefault(key, {}).update(bridges)
+    return coordinates
+
+coordinates = load_coordinates(BRIDGE_COORDINATES_FILE)
+# Bridges already logged as missing coordinates
+uncharted = set()
+
+def bridge_position(source, bridge_name):
+    position = coordinates.get(source.key, {}).get(bridge_name)
+    if position is None and (source.key, bridge_name) not in uncharted:
+        uncharted.add((source.key, bridge_name))
+        logger.warning(f"No coordinates for {bridge_name} ({source.key}), it's left out of /route")
+    return position or {}
+
+# p10 to p90 minutes left from the period durations seen so far, or None to fall back to the CI of the mean
+def predicted_range(history, elapsed, start):
+    if not isinstance(history, PeriodHistory):
+        return None
+    prediction = history.remaining(elapsed, start.timestamp())
+    return (prediction[0], prediction[2]) if prediction else None
 
 def format_display_data(current_status, action_status, current_time, bridge_stat):
     last_status_change = datetime.fromisoformat(bridge_stat['last_status_change'])
@@ -34,12 +76,18 @@ def format_display_data(current_status, action_status, current_time, bridge_stat
             icon = "checkmarkWarning"
             avg_raising_time = bridge_stat.get("avg_raising_soon_to_unavailable", 0)
             raising_soon_ci = bridge_stat.get("raising_soon_ci", (0, 0))
-            if avg_raising_time:
-                time_since_change = (current_time - last_status_change).total_seconds() / 60
-                lower_remaining = max(0, int(raising_soon_ci[0] - time_since_change))
-                upper_remaining = max(0, int(raising_soon_ci[1] - time_since_change))
+            time_since_change = (current_time - last_status_change).total_seconds() / 60
+            prediction = predicted_range(bridge_stat.get("raising_soon_times"), time_since_change, last_status_change)
+            if prediction or avg_raising_time:
+                if prediction:
+                    lower_remaining, upper_remaining = prediction
+                    basis = "est"
+                else:
+                    lower_remaining = max(0, int(raising_soon_ci[0] - time_since_change))
+                    upper_remaining = max(0, int(raising_soon_ci[1] - time_since_change))
+                    basis = "avg"
                 if upper_remaining > 1:
-                    display_details = f"Closing soon in {lower_remaining}-{upper_remaining}m (avg)"
+                    display_details = f"Closing soon in {lower_remaining}-{upper_remaining}m ({basis})"
                 else:
                     display_details = "Closing soon (longer than usual)"
             else:
@@ -73,12 +121,18 @@ def format_display_data(current_status, action_status, current_time, bridge_stat
             closure_start = datetime.fromisoformat(bridge_stat["closures"][-1]["start"]) if bridge_stat["closures"] else last_status_change
             avg_closure_time = bridge_stat.get("avg_closure_duration", 0)
             closure_duration_ci = bridge_stat.get("closure_duration_ci", (0, 0))
-            if avg_closure_time:
-                time_closed = (current_time - closure_start).total_seconds() / 60
-                lower_remaining = max(0, int(closure_duration_ci[0] - time_closed))
-                upper_remaining = max(0, int(closure_duration_ci[1] - time_closed))
+            time_closed = (current_time - closure_start).total_seconds() / 60
+            prediction = predicted_range(bridge_stat["closures"], time_closed, closure_start)
+            if prediction or avg_closure_time:
+                if prediction:
+                    lower_remaining, upper_remaining = prediction
+                    basis = "est"
+                else:
+                    lower_remaining = max(0, int(closure_duration_ci[0] - time_closed))
+                    upper_remaining = max(0, int(closure_duration_ci[1] - time_closed))
+                    basis = "avg"
                 if upper_remaining > 1:
-                    display_details = f"Closed {format_time(closure_start)}. Open in {lower_remaining}-{upper_remaining}m (avg)"
+                    display_details = f"Closed {format_time(closure_start)}. Open in {lower_remaining}-{upper_remaining}m ({basis})"
                 else:
                     display_details = f"Closed {format_time(closure_start)} for longer than usual"
             else:
@@ -102,56 +156,241 @@ def format_display_data(current_status, action_status, current_time, bridge_stat
 
     return display_status, display_details, icon
 
-def fetch_bridge_status():
-    global bridge_status
+# Kept between polls so an unchanged page can be skipped
+class PageCache:
+    def __init__(self):
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self.rows = None
+
+page_caches = {source.key: PageCache() for source in SOURCES}
+policies = {source.key: PollPolicy(source.interval) for source in SOURCES}
+# Epoch time each source will next be polled, for Cache-Control
+next_polls = {}
+# Latest bridge entries per source, merged into one status whenever any source updates
+source_status = {}
+# Latest ETA table rows per source for /route, merged the same way
+source_routes = {}
+# Sources are fetched on separate threads, this keeps their publishes from interleaving
+publish_lock = threading.Lock()
+session = None
+
+# One pooled keep-alive session for all polls instead of a new TLS connection every time
+def get_session():
+    global session
+    if session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(4, len(SOURCES)))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+    return session
+
+def conditional_headers(page_cache):
+    headers = {}
+    if page_cache.etag:
+        headers['If-None-Match'] = page_cache.etag
+    if page_cache.last_modified:
+        headers['If-Modified-Since'] = page_cache.last_modified
+    return headers
+
+# Works with both requests and httpx responses. Returns the response, or None if upstream says the page hasn't changed
+def check_page(response, page_cache):
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+    page_cache.etag = response.headers.get('ETag')
+    page_cache.last_modified = response.headers.get('Last-Modified')
+    return response
+
+def fetch_page(source, page_cache):
+    response = get_session().get(source.url, headers=conditional_headers(page_cache), timeout=(FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT))
+    return check_page(response, page_cache)
+
+# Returns how many seconds to wait before polling this source again
+def fetch_source(source):
     try:
-        #logger.info("Fetching bridge status")
-        response = requests.get(URL)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        bridge_tables = soup.find_all('table', {'id': 'grey_box'})
-        
+        #logger.info(f"Fetching bridge status for {source.key}")
+        started = time.monotonic()
+        response = fetch_page(source, page_caches[source.key])
+    except Exception as e:
+        return fetch_failed(source, e)
+    return metrics.profiled(process_page, source, response, time.monotonic() - started)
+
+# Parsing, the stats update and encoding the snapshot for the async server. A single worker keeps every source's
+# process_page on the same thread, like one scheduler thread would, without blocking the event loop.
+process_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="process-page")
+
+# Same as fetch_source for the async server, client is a shared httpx.AsyncClient
+async def fetch_source_async(source, client):
+    page_cache = page_caches[source.key]
+    try:
+        started = time.monotonic()
+        response = check_page(await client.get(source.url, headers=conditional_headers(page_cache)), page_cache)
+    except Exception as e:
+        return fetch_failed(source, e)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(process_executor, metrics.profiled, process_page, source, response,
+                                      time.monotonic() - started)
+
+def fetch_failed(source, e):
+    logger.error(f"Error fetching bridge status for {source.key}: {str(e)}", exc_info=True)
+    metrics.fetch_errors.inc(source.key)
+    delay = policies[source.key].after_failure()
+    next_polls[source.key] = time.time() + delay
+    return delay
+
+# Parse a fetched page (None when upstream returned 304), update the stats and publish. Returns the next poll delay.
+def process_page(source, response, elapsed):
+    page_cache = page_caches[source.key]
+    policy = policies[source.key]
+    try:
+        metrics.fetch_seconds.observe(elapsed, source.key)
         last_updated = get_current_time()
+        content_hash = hashlib.blake2b(response.content, digest_size=16).digest() if response is not None else None
+        # When the page is byte-identical skip parsing and the stats update, only the display text is refreshed
+        if page_cache.rows is not None and (response is None or content_hash == page_cache.content_hash):
+            rows = page_cache.rows
+            changed = False
+        else:
+            with metrics.parse_seconds.time(source.key):
+                rows = extract_bridges(response.text)
+            page_cache.rows = rows
+            page_cache.content_hash = content_hash
+            changed = True
+
         updated_status = []
-        
-        for idx, table in enumerate(bridge_tables, 1):
+        bridge_states = []
+        route_rows = []
+        for _, bridge_name, status in rows:
             try:
-                bridge_name = table.find('span', {'class': 'lgtextblack'}).text.strip()
-                status = table.find('span', {'id': 'status'}).text.strip()
-                
-                #logger.info(f"Raw Bridge {idx}: {bridge_name}, status: {status}")
+                bridge_id = bridge_stats.bridge_id(source.key, bridge_name)
+                #logger.info(f"Raw Bridge {bridge_id}: {bridge_name}, status: {status}")
                 current_status, action_status = parse_status(status)
-                #logger.info(f"Parsed Bridge {idx}: {bridge_name}, current_status='{current_status}', action_status='{action_status}'")
+                #logger.info(f"Parsed Bridge {bridge_id}: {bridge_name}, current_status='{current_status}', action_status='{action_status}'")
                 
-                bridge_data = bridge_stats.get_bridge_stat(idx)
+                bridge_data = bridge_stats.get_bridge_stat(bridge_id)
                 if not bridge_data:
-                    bridge_data = bridge_stats.create_new_bridge_stat(idx, bridge_name, current_status, last_updated)
+                    bridge_data = bridge_stats.create_new_bridge_stat(bridge_id, bridge_name, current_status, last_updated, source.key)
                 
-                bridge_stats.update_bridge_stat(idx, bridge_name, current_status, action_status, last_updated)
+                if changed:
+                    bridge_stats.update_bridge_stat(bridge_id, bridge_name, current_status, action_status, last_updated, source.key)
                 
+                bridge_states.append((current_status, action_status, bridge_data))
                 display_status, display_details, icon = format_display_data(current_status, action_status, last_updated, bridge_data)
+                position = bridge_position(source, bridge_name)
                 
                 bridge_data_entry = {
-                    'id': idx,
+                    'id': bridge_id,
+                    'source': source.key,
                     'location': bridge_name,
                     'state': display_status,
                     'info': display_details,
                     'icon': icon,
-                    'lat': BRIDGE_COORDINATES.get(bridge_name, {}).get('lat'),
-                    'lng': BRIDGE_COORDINATES.get(bridge_name, {}).get('lng')
+                    'lat': position.get('lat'),
+                    'lng': position.get('lng')
                 }
                 updated_status.append(bridge_data_entry)
+                if position:
+                    route_rows.append(crossing_eta(bridge_data_entry, current_status, action_status, bridge_data, last_updated.timestamp()))
             except Exception as e:
-                logger.error(f"Error processing bridge {idx}: {str(e)}", exc_info=True)
+                logger.error(f"Error processing bridge {bridge_name} ({source.key}): {str(e)}", exc_info=True)
 
-        bridge_status = {
-            'updated': last_updated.isoformat(),
-            'bridges': updated_status
-        }
+        delay = policy.after_success(bridge_states, elapsed, last_updated.timestamp())
+        with publish_lock:
+            changes = bridge_changes(source_status.get(source.key, []), updated_status)
+            source_status[source.key] = updated_status
+            source_routes[source.key] = route_rows
+            next_polls[source.key] = time.time() + delay
+            publish_snapshot({
+                'updated': last_updated.isoformat(),
+                'bridges': [entry for s in SOURCES for entry in source_status.get(s.key, [])]
+            })
+            broadcaster.publish(changes)
         #logger.info("Updated bridge_status")
+        return delay
 
     except Exception as e:
-        logger.error(f"Error fetching bridge status: {str(e)}", exc_info=True)
+        return fetch_failed(source, e)
+
+# Fetch every source at once, a slow sector doesn't hold up the others
+def fetch_bridge_status():
+    with ThreadPoolExecutor(max_workers=len(SOURCES)) as pool:
+        list(pool.map(fetch_source, SOURCES))
+
+# Each source polls itself as a one-off job that schedules the next one after the delay from its PollPolicy.
+# The first run fires straight away on the scheduler's thread pool so the server can start listening in the meantime.
+def schedule_fetch_jobs(scheduler):
+    for source in SOURCES:
+        schedule_fetch(scheduler, source, 0)
+
+def schedule_fetch(scheduler, source, delay):
+    scheduler.add_job(run_fetch_job, 'date', args=[scheduler, source], name=f"fetch-{source.key}",
+                      run_date=datetime.now() + timedelta(seconds=delay), misfire_grace_time=60)
+
+def run_fetch_job(scheduler, source):
+    delay = source.interval
+    try:
+        delay = fetch_source(source)
+    finally:
+        schedule_fetch(scheduler, source, delay)
+
+# The async server's replacement for the scheduler jobs, one task per source on the server's event loop
+async def poll_source(source, client):
+    while True:
+        delay = await fetch_source_async(source, client)
+        await asyncio.sleep(delay)
+
+# Copy what the API serves out of bridge_stats and publish it with the new status as one immutable snapshot.
+# Responses are encoded here once per poll instead of once per request, /history only when it changed.
+def publish_snapshot(status):
+    with bridge_stats.lock:
+        stats = bridge_stats.get_filtered_stats()
+        history_generation = bridge_stats.history_generation
+        history = None
+        heatmap = ()
+        if history_generation != snapshot.get_snapshot().history_generation:
+            history = bridge_stats.get_filtered_history()
+            heatmap = bridge_stats.get_heatmap(time.time())
+    next_update = min(next_polls.values(), default=time.time() + min(source.interval for source in SOURCES))
+    crossings = [row for s in SOURCES for row in source_routes.get(s.key, [])]
+    routes = {"as_of": min((row["as_of"] for row in crossings), default=time.time()), "crossings": crossings}
+    published = snapshot.publish(status, stats, history_generation, history, next_update=next_update, heatmap=heatmap,
+                                 routes=routes)
+    if shared_snapshot.enabled:
+        try:
+            shared_snapshot.write(published)
+        except Exception as e:
+            logger.error(f"Error writing shared snapshot: {str(e)}", exc_info=True)
+    return published
 
 def get_current_bridge_status():
-    return bridge_status
\ No newline at end of file
+    return snapshot.get_snapshot().status
+
+# Ready once the first fetch has published a status
+def is_ready():
+    return bool(snapshot.get_snapshot().status)
+
+# Seconds since the status being served was fetched, also right in followers
+def data_age():
+    status = snapshot.get_snapshot().status
+    if not status:
+        return {}
+    return {(): round(time.time() - datetime.fromisoformat(status["updated"]).timestamp(), 3)}
+
+def history_sizes():
+    with bridge_stats.lock:
+        bridges = bridge_stats.stats.get("bridge_statistics", [])
+        return {(name,): sum(len(s[name]) for s in bridges) for name in ("closures", "raising_soon_times")}
+
+metrics.register(metrics.Gauge("bridge_data_age_seconds", "Seconds since the served status was fetched", data_age))
+metrics.register(metrics.Gauge("bridge_source_failures", "Failed polls in a row per source",
+                               lambda: {(key,): policy.failures for key, policy in policies.items()}, ("source",)))
+metrics.register(metrics.Gauge("bridge_history_periods", "Periods kept in the history", history_sizes, ("type",)))
+metrics.register(metrics.Gauge("bridge_stream_subscribers", "Open /bridge-status/stream connections",
+                               lambda: {(): broadcaster.subscribers}))
+
+# Serve the stored stats and history until the first fetch completes
+publish_snapshot([])
@@ -6,14 +6,86 @@ import pytz
 # Bridge status URL
 URL = os.getenv('BRIDGE_STATUS_URL', 'https://seaway-greatlakes.com/bridgestatus/detailsnai?key=BridgeSCT')
 
+# Extra Seaway sectors to poll alongside or instead of BRIDGE_STATUS_URL, see sources.py for the format
+BRIDGE_SOURCES = os.getenv('BRIDGE_SOURCES', '')
+# JSON file of coordinates for bridges in other sectors, see bridge_status.py
+BRIDGE_COORDINATES_FILE = os.getenv('BRIDGE_COORDINATES_FILE', '')
+
 # Fetch interval in seconds
 FETCH_INTERVAL = int(os.getenv('FETCH_INTERVAL', 30))
 
+# Adaptive polling: poll every FETCH_INTERVAL_FAST seconds while a bridge is moving or a closure is about to end,
+# and every FETCH_INTERVAL_IDLE seconds while every bridge is open and quiet
+ADAPTIVE_POLLING = os.getenv('ADAPTIVE_POLLING', 'true').lower() == 'true'
+FETCH_INTERVAL_FAST = int(os.getenv('FETCH_INTERVAL_FAST', 10))
+FETCH_INTERVAL_IDLE = int(os.getenv('FETCH_INTERVAL_IDLE', 90))
+
+# Upstream responses slower than this count as failures for backoff. Backoff is capped at FETCH_BACKOFF_MAX seconds,
+# after BREAKER_FAILURES failures in a row the source is only retried every BREAKER_COOLDOWN seconds
+FETCH_SLOW_SECONDS = float(os.getenv('FETCH_SLOW_SECONDS', 5))
+FETCH_BACKOFF_MAX = int(os.getenv('FETCH_BACKOFF_MAX', 600))
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 5))
+BREAKER_COOLDOWN = int(os.getenv('BREAKER_COOLDOWN', 300))
+
+# Upstream connect and read timeouts in seconds
+FETCH_CONNECT_TIMEOUT = float(os.getenv('FETCH_CONNECT_TIMEOUT', 5))
+FETCH_READ_TIMEOUT = float(os.getenv('FETCH_READ_TIMEOUT', 15))
+
+# HTML extractor for the bridge page: auto, selectolax, lxml, stream (standard library) or bs4
+HTML_PARSER = os.getenv('HTML_PARSER', 'auto')
+
+# /bridge-status/stream (start_asgi.py only): seconds between heartbeats when nothing changed, and how many changes
+# are kept for subscribers that fall behind
+STREAM_HEARTBEAT = int(os.getenv('STREAM_HEARTBEAT', 15))
+STREAM_BACKLOG = int(os.getenv('STREAM_BACKLOG', 1000))
+WAITRESS_THREADS = int(os.getenv('WAITRESS_THREADS', 32))
+
+# How long start_asgi.py keeps an idle keep-alive connection open, they're cheap on the event loop
+KEEPALIVE_TIMEOUT = int(os.getenv('KEEPALIVE_TIMEOUT', 75))
+
 # API key for authentication
 API_KEY = os.getenv('API_KEY', 'your_secret_api_key_here')
 
+# More API keys, see auth.py for the formats. API_KEY stays valid (as "default") when it's set or no other keys are
+API_KEYS = os.getenv('API_KEYS', '')
+API_KEYS_FILE = os.getenv('API_KEYS_FILE', '')
+API_KEY_SET = 'API_KEY' in os.environ
+
+# Limits for each key that doesn't set its own: sustained requests per second with bursts of up to RATE_LIMIT_BURST,
+# and requests per Toronto day. 0 turns either off. They're kept in memory per server process.
+RATE_LIMIT = float(os.getenv('RATE_LIMIT', 0))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', 20))
+DAILY_QUOTA = int(os.getenv('DAILY_QUOTA', 0))
+
 # Local timezone (Toronto time) used in utils.py
 TORONTO_TZ = pytz.timezone('America/Toronto')
 
 # History storage. If unset use root dir
-BRIDGE_STATS_FILE = os.getenv('BRIDGE_STATS_FILE', 'bridge_stats.json')
\ No newline at end of file
+BRIDGE_STATS_FILE = os.getenv('BRIDGE_STATS_FILE', 'bridge_stats.json')
+
+# Stats storage backend: "eventlog" appends transitions to BRIDGE_STATS_FILE.log and compacts in the background, "json" rewrites the whole file every poll
+STATS_STORAGE = os.getenv('STATS_STORAGE', 'eventlog')
+
+# Compact the event log into the stats file after this many events or seconds, whichever comes first
+STATS_COMPACT_EVENTS = int(os.getenv('STATS_COMPACT_EVENTS', 500))
+STATS_COMPACT_INTERVAL = int(os.getenv('STATS_COMPACT_INTERVAL', 3600))
+
+# Default and maximum number of records per page of a filtered /history
+HISTORY_PAGE_LIMIT = int(os.getenv('HISTORY_PAGE_LIMIT', 500))
+HISTORY_PAGE_MAX = int(os.getenv('HISTORY_PAGE_MAX', 5000))
+
+# Several server processes sharing one data directory: one leader (holding an flock on BRIDGE_STATS_FILE.lock) polls
+# and writes the stats, and publishes each snapshot to SHARED_SNAPSHOT_FILE for the others to mmap and serve.
+# Followers check for a new snapshot, and whether they should take over as leader, every LEADER_CHECK_INTERVAL seconds.
+MULTIPROCESS = os.getenv('MULTIPROCESS', 'false').lower() == 'true'
+SHARED_SNAPSHOT_FILE = os.getenv('SHARED_SNAPSHOT_FILE', BRIDGE_STATS_FILE + '.shared')
+LEADER_CHECK_INTERVAL = float(os.getenv('LEADER_CHECK_INTERVAL', 1))
+
+# /metrics in Prometheus text format, it needs an API key. PROFILE_POLL_RATE of polls (0 to 1) are run under
+# cProfile with the accumulated stats written to PROFILE_FILE
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+PROFILE_POLL_RATE = float(os.getenv('PROFILE_POLL_RATE', 0))
+PROFILE_FILE = os.getenv('PROFILE_FILE', os.path.join(os.path.dirname(BRIDGE_STATS_FILE), 'poll.prof'))
+
+# Average driving speed in km/h /route uses to work out when you'd reach each crossing
+ROUTE_SPEED_KMH = float(os.getenv('ROUTE_SPEED_KMH', 40))
@@ -0,0 +1,58 @@
+# Fixtures and fakes shared by the test modules
+import asyncio
+import pytest
+import bridge_status
+from asgi_app import AsgiApp
+from bridge_stats import BridgeStats
+
+# Calls the ASGI app with one request and returns (status, headers, body)
+def request(path, headers=None, method="GET"):
+    path, _, query_string = path.partition("?")
+    async def run():
+        messages = []
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+        async def send(message):
+            messages.append(message)
+        scope = {"type": "http", "method": method, "path": path, "query_string": query_string.encode(),
+                 "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]}
+        await AsgiApp(fetch=False)(scope, receive, send)
+        return messages
+    messages = asyncio.run(run())
+    response_headers = {k.decode(): v.decode() for k, v in messages[0]["headers"]}
+    return messages[0]["status"], response_headers, b"".join(m.get("body", b"") for m in messages[1:])
+
+PAGE = """<html><body>
+<table id="grey_box"><tr><td><span class="lgtextblack">Lakeshore Rd</span><br><span id="status">Available</span></td></tr></table>
+<table id="grey_box"><tr><td><span class="lgtextblack">Carlton St.</span><br><span id="status">Unavailable (Raising)</span></td></tr></table>
+</body></html>"""
+
+class FakeResponse:
+    def __init__(self, text="", status_code=200, headers=None):
+        self.text = text
+        self.content = text.encode()
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        pass
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.sent_headers = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.sent_headers.append(headers)
+        return self.responses.pop(0)
+
+@pytest.fixture
+def fetcher(tmp_path, monkeypatch):
+    stats = BridgeStats(str(tmp_path / "stats.json"))
+    monkeypatch.setattr(bridge_status, "bridge_stats", stats)
+    monkeypatch.setattr(bridge_status, "page_caches", {source.key: bridge_status.PageCache() for source in bridge_status.SOURCES})
+    monkeypatch.setattr(bridge_status, "source_status", {})
+    parsed = []
+    extract_bridges = bridge_status.extract_bridges
+    monkeypatch.setattr(bridge_status, "extract_bridges", lambda html: parsed.append(html) or extract_bridges(html))
+    return parsed
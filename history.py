@@ -0,0 +1,173 @@
+# history.py
+
+import math
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from config import TORONTO_TZ
+from running_stats import RunningStats, HourOfWeekStats, DurationHistogram, hour_of_week
+
+# History older than this is dropped
+RETENTION_DAYS = 180
+# Periods longer than this (minutes) are outliers and never recorded
+MAX_PERIOD_DURATION = 90
+# Predictions need this many closed periods, and an hour of day needs as many of its own (with at least
+# MIN_SURVIVORS lasting as long as the current period) before its histogram is used over the overall one
+MIN_QUANTILE_SAMPLES = 10
+MIN_SURVIVORS = 5
+
+def to_epoch(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = TORONTO_TZ.localize(value)
+    return value.timestamp()
+
+def to_iso(epoch):
+    return datetime.fromtimestamp(epoch, TORONTO_TZ).isoformat()
+
+class PeriodHistory:
+    # Subclasses that rebuild the aggregates in bulk (see backfill.py) switch off the per-period updates
+    track_aggregates = True
+
+    # Closures or raising soon periods stored column-wise as epoch seconds, oldest first, with the duration
+    # in minutes worked out once when a period closes. Open periods have a NaN end and duration.
+    # ISO strings are only built when the history is sent to the API or written to the stats file.
+    # Expired periods are dropped from the front by moving head forward, the arrays are trimmed once
+    # the dead prefix outgrows the live part.
+    def __init__(self, records=()):
+        self.starts = array('d')
+        self.ends = array('d')
+        self.durations = array('d')
+        self.head = 0
+        self.stats = RunningStats()
+        self.weekly = HourOfWeekStats()
+        self.histogram = DurationHistogram()
+        # Durations by the Toronto hour of day the period started in
+        self.hourly = [DurationHistogram() for _ in range(24)]
+        for record in records:
+            self.open(to_epoch(record["start"]))
+            if "end" in record:
+                self.close(to_epoch(record["end"]))
+
+    # Columns and aggregates as plain JSON for the derived stats file, open ends are stored as null
+    def to_state(self):
+        return {
+            "starts": self.starts[self.head:].tolist(),
+            "ends": [None if math.isnan(end) else end for end in self.ends[self.head:]],
+            "stats": self.stats.to_state(),
+            "weekly": self.weekly.to_state(),
+            "histogram": self.histogram.counts,
+            "hourly": [histogram.counts for histogram in self.hourly]
+        }
+
+    # Columns only, with empty aggregates for callers that fill them in themselves
+    @classmethod
+    def from_columns(cls, starts, ends):
+        history = cls()
+        history.starts = array('d', starts)
+        history.ends = array('d', (math.nan if end is None else end for end in ends))
+        history.durations = array('d', ((end - start) / 60 for start, end in zip(history.starts, history.ends)))
+        return history
+
+    @classmethod
+    def from_state(cls, state):
+        history = cls.from_columns(state["starts"], state["ends"])
+        history.stats = RunningStats.from_state(state["stats"])
+        history.weekly = HourOfWeekStats.from_state(state["weekly"])
+        history.histogram = DurationHistogram(state["histogram"])
+        history.hourly = [DurationHistogram(counts) for counts in state["hourly"]]
+        return history
+
+    # Copy to encode while this history keeps changing, the columns are copied as arrays and the aggregates through
+    # their state, no ISO strings or per-period objects are built
+    def copy(self):
+        history = type(self)()
+        history.starts = self.starts[self.head:]
+        history.ends = self.ends[self.head:]
+        history.durations = self.durations[self.head:]
+        history.stats = RunningStats.from_state(self.stats.to_state())
+        history.weekly = HourOfWeekStats.from_state(self.weekly.to_state())
+        history.histogram = DurationHistogram(self.histogram.counts)
+        history.hourly = [DurationHistogram(histogram.counts) for histogram in self.hourly]
+        return history
+
+    def __len__(self):
+        return len(self.starts) - self.head
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("period index out of range")
+        index += self.head
+        record = {"start": to_iso(self.starts[index])}
+        if not math.isnan(self.ends[index]):
+            record["end"] = to_iso(self.ends[index])
+        return record
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def is_open(self):
+        return len(self) > 0 and math.isnan(self.ends[-1])
+
+    def open(self, epoch):
+        self.starts.append(epoch)
+        self.ends.append(math.nan)
+        self.durations.append(math.nan)
+
+    # Close the latest period and return its duration in minutes. Outliers are discarded and return None.
+    def close(self, epoch):
+        duration = (epoch - self.starts[-1]) / 60
+        if duration > MAX_PERIOD_DURATION:
+            self.starts.pop()
+            self.ends.pop()
+            self.durations.pop()
+            return None
+        self.ends[-1] = epoch
+        self.durations[-1] = duration
+        if self.track_aggregates:
+            self.stats.add(self.starts[-1], duration)
+            self.weekly.add(self.starts[-1], epoch)
+            self.histogram.add(duration)
+            self.hourly[hour_of_week(self.starts[-1]) % 24].add(duration)
+        return duration
+
+    # p10/p50/p90 of the minutes left for a period that started at start and has been running elapsed minutes,
+    # out of the recorded periods that lasted at least that long. None until there's enough history.
+    def remaining(self, elapsed, start):
+        if self.histogram.total < MIN_QUANTILE_SAMPLES:
+            return None
+        hourly = self.hourly[hour_of_week(start) % 24]
+        if hourly.total >= MIN_QUANTILE_SAMPLES:
+            survivors, values = hourly.quantiles(elapsed)
+            if survivors >= MIN_SURVIVORS:
+                return tuple(max(0, int(value - elapsed)) for value in values)
+        survivors, values = self.histogram.quantiles(elapsed)
+        return tuple(max(0, int(value - elapsed)) for value in values)
+
+    def closed_durations(self):
+        return [d for d in self.durations[self.head:] if not math.isnan(d)]
+
+    # Drop periods that started at or before min_start and return how many were removed
+    def expire(self, min_start):
+        cut = bisect_right(self.starts, min_start, self.head)
+        if self.track_aggregates:
+            for i in range(self.head, cut):
+                if not math.isnan(self.durations[i]):
+                    self.stats.remove(self.starts[i], self.durations[i])
+                    self.weekly.remove(self.starts[i], self.ends[i])
+                    self.histogram.remove(self.durations[i])
+                    self.hourly[hour_of_week(self.starts[i]) % 24].remove(self.durations[i])
+        removed = cut - self.head
+        self.head = cut
+        if self.head > 64 and self.head * 2 > len(self.starts):
+            del self.starts[:self.head]
+            del self.ends[:self.head]
+            del self.durations[:self.head]
+            self.head = 0
+        return removed
+
+    def to_list(self):
+        return list(self)
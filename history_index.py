@@ -0,0 +1,172 @@
+# history_index.py
+
+import json
+import math
+import zlib
+import hashlib
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from heapq import merge
+from config import TORONTO_TZ, HISTORY_PAGE_LIMIT, HISTORY_PAGE_MAX
+from response_cache import encode_json, cache_headers, etag_matches, gzip_etag
+
+RECORD_TYPES = ("closures", "raising_soon_times")
+# Any of these switches /history to filtered pages, other query parameters (e.g. cache busters) are ignored
+QUERY_PARAMS = ("bridge", "type", "since", "until", "limit", "cursor")
+# Records are encoded into the response in batches of this many
+CHUNK_RECORDS = 200
+
+class HistoryQuery:
+    # Filters for /history?bridge=&type=&since=&until=&limit=&cursor=, raises ValueError for anything invalid
+    def __init__(self, args):
+        self.bridge = int_arg(args, 'bridge')
+        self.type = args.get('type') or None
+        if self.type is not None and self.type not in RECORD_TYPES:
+            raise ValueError(f"type must be one of {', '.join(RECORD_TYPES)}")
+        self.since = time_arg(args, 'since', float('-inf'))
+        self.until = time_arg(args, 'until', float('inf'))
+        self.limit = int_arg(args, 'limit', HISTORY_PAGE_LIMIT)
+        if not 0 < self.limit <= HISTORY_PAGE_MAX:
+            raise ValueError(f"limit must be between 1 and {HISTORY_PAGE_MAX}")
+        self.cursor = parse_cursor(args['cursor']) if args.get('cursor') else None
+        self.key = json.dumps([self.bridge, self.type, self.since, self.until, self.limit, self.cursor]).encode()
+
+def is_filtered(args):
+    return any(name in args for name in QUERY_PARAMS)
+
+def int_arg(args, name, default=None):
+    if not args.get(name):
+        return default
+    try:
+        return int(args[name])
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+# ISO 8601 (local Toronto time if no offset is given) or epoch seconds
+def time_arg(args, name, default):
+    value = args.get(name)
+    if not value:
+        return default
+    try:
+        epoch = float(value)
+    except ValueError:
+        pass
+    else:
+        if not math.isfinite(epoch):
+            raise ValueError(f"{name} must be a finite time")
+        return epoch
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 time or epoch seconds")
+    if parsed.tzinfo is None:
+        parsed = TORONTO_TZ.localize(parsed)
+    return parsed.timestamp()
+
+# A cursor is the start time of the next record and how many records starting at that same time were already
+# returned, so it stays valid when the index is rebuilt with new or expired records
+def format_cursor(start, skip):
+    return f"{start!r}:{skip}"
+
+def parse_cursor(cursor):
+    start, _, skip = cursor.rpartition(':')
+    try:
+        start, skip = float(start), int(skip)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not math.isfinite(start) or skip < 0:
+        raise ValueError("Invalid cursor")
+    return start, skip
+
+class HistoryIndex:
+    # Every closure and raising soon period from one /history payload, each encoded once and kept sorted by start
+    # time for the whole history, per bridge, per record type and per bridge and type, so a query is a bisect into
+    # the right list and a slice of already encoded records
+    def __init__(self, history):
+        per_key = {}
+        for bridge in history:
+            for record_type in RECORD_TYPES:
+                records = []
+                for period in bridge.get(record_type, ()):
+                    record = {"id": bridge["id"], "location": bridge["location"], "type": record_type, **period}
+                    start = datetime.fromisoformat(period["start"]).timestamp()
+                    records.append((start, bridge["id"], json.dumps(record, sort_keys=True, separators=(',', ':')).encode()))
+                per_key[(bridge["id"], record_type)] = records
+        self.lists = {}
+        for bridge_id, record_type in list(per_key):
+            self.add((bridge_id, record_type), [per_key[(bridge_id, record_type)]])
+        bridge_ids = {bridge_id for bridge_id, _ in per_key}
+        for bridge_id in bridge_ids:
+            self.add((bridge_id, None), [per_key[(bridge_id, t)] for t in RECORD_TYPES if (bridge_id, t) in per_key])
+        for record_type in RECORD_TYPES:
+            self.add((None, record_type), [per_key[(b, record_type)] for b in bridge_ids if (b, record_type) in per_key])
+        self.add((None, None), [records for (_, _), records in per_key.items()])
+
+    # Each bridge's periods are already in start order, so the combined lists are a merge rather than a sort
+    def add(self, key, sorted_lists):
+        records = list(merge(*sorted_lists, key=lambda record: (record[0], record[1])))
+        self.lists[key] = ([record[0] for record in records], [record[2] for record in records])
+
+    # Returns the encoded records for one page and the cursor for the next one, or None on the last page
+    def query(self, query):
+        starts, records = self.lists.get((query.bridge, query.type), ((), ()))
+        lo = bisect_left(starts, query.since)
+        if query.cursor is not None:
+            start, skip = query.cursor
+            lo = max(lo, bisect_left(starts, start) + skip)
+        hi = min(bisect_left(starts, query.until), lo + query.limit)
+        page = records[lo:hi]
+        next_cursor = None
+        if hi < len(starts) and starts[hi] < query.until:
+            next_start = starts[hi]
+            next_cursor = format_cursor(next_start, hi - bisect_left(starts, next_start))
+        return page, next_cursor
+
+index = None
+index_etag = None
+index_lock = threading.Lock()
+
+# Built on the first filtered request after /history changes. Followers in multi-process mode only have the
+# encoded /history body, so they build it from that.
+def get_index(current):
+    global index, index_etag
+    cached = current.responses["history"]
+    with index_lock:
+        if index_etag != cached.etag:
+            index = HistoryIndex(current.history or json.loads(bytes(cached.body)))
+            index_etag = cached.etag
+        return index
+
+def encode_page(page, next_cursor):
+    yield b'{"records":['
+    for i in range(0, len(page), CHUNK_RECORDS):
+        yield (b"," if i else b"") + b",".join(page[i:i + CHUNK_RECORDS])
+    yield b'],"next_cursor":' + json.dumps(next_cursor).encode() + b'}\n'
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+# Returns (status, headers, body chunks) for a filtered /history request. The body is generated as it's sent,
+# and the ETag only depends on the history and the query so pages can be revalidated.
+def history_response(current, args, if_none_match, gzip_ok):
+    try:
+        query = HistoryQuery(args)
+    except ValueError as e:
+        return 400, {"Content-Type": "application/json"}, [encode_json({"error": str(e)})]
+    page, next_cursor = get_index(current).query(query)
+    etag = f'"{hashlib.sha256(current.responses["history"].etag.encode() + query.key).hexdigest()[:32]}"'
+    headers = cache_headers(gzip_etag(etag) if gzip_ok else etag, current.next_update)
+    if etag_matches(etag, if_none_match):
+        return 304, headers, []
+    headers["Content-Type"] = "application/json"
+    chunks = encode_page(page, next_cursor)
+    if gzip_ok:
+        headers["Content-Encoding"] = "gzip"
+        chunks = gzip_chunks(chunks)
+    return 200, headers, chunks
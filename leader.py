@@ -0,0 +1,81 @@
+# leader.py
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from config import BRIDGE_STATS_FILE, LEADER_CHECK_INTERVAL
+import snapshot
+import shared_snapshot
+from bridge_stats import bridge_stats
+from bridge_status import publish_snapshot
+from bridge_events import broadcaster, bridge_changes
+
+logger = logging.getLogger(__name__)
+
+# With MULTIPROCESS=true every server process calls start(). Whichever holds the flock on LOCK_FILE is the leader:
+# the only process that loads and writes the stats and polls upstream. The rest follow the snapshots it publishes
+# and keep trying the lock, the kernel releases it when the leader exits so one of them takes over.
+LOCK_FILE = BRIDGE_STATS_FILE + '.lock'
+lock_file = None
+
+def acquire_lock(filename=LOCK_FILE):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    f = open(filename, 'a')
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+def is_leader():
+    return lock_file is not None
+
+# start_fetching is called once this process becomes the leader, straight away or when it takes over
+def start(start_fetching):
+    global lock_file
+    lock_file = acquire_lock()
+    if lock_file is not None:
+        lead(start_fetching)
+    else:
+        logger.info(f"Process {os.getpid()} is following the fetch leader")
+        threading.Thread(target=follow, args=(start_fetching,), name="leader-follower", daemon=True).start()
+
+def lead(start_fetching):
+    logger.info(f"Process {os.getpid()} is the fetch leader")
+    bridge_stats.load()
+    shared_snapshot.enabled = True
+    # Keep serving the status followed so far until the first fetch replaces it
+    current = snapshot.get_snapshot()
+    publish_snapshot(json.loads(bytes(current.responses["bridge-status"].body)) if current.status else [])
+    start_fetching()
+
+def follow(start_fetching, reader=None):
+    global lock_file
+    reader = reader or shared_snapshot.SharedSnapshotReader()
+    while True:
+        try:
+            follow_snapshot(reader)
+        except Exception as e:
+            logger.error(f"Error reading shared snapshot: {str(e)}", exc_info=True)
+        lock_file = acquire_lock()
+        if lock_file is not None:
+            lead(start_fetching)
+            return
+        time.sleep(LEADER_CHECK_INTERVAL)
+
+# Swap in the leader's latest snapshot and pass its changes on to this process's stream subscribers
+def follow_snapshot(reader):
+    shared = reader.refresh()
+    if shared is None:
+        return False
+    previous = snapshot.get_snapshot().status
+    changes = bridge_changes(previous["bridges"] if previous else [], shared.status["bridges"] if shared.status else [])
+    snapshot.install(shared)
+    broadcaster.publish(changes)
+    return True
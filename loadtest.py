@@ -0,0 +1,297 @@
+# loadtest.py
+
+import os
+import sys
+import gzip
+import json
+import time
+import shlex
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime
+from urllib.parse import urlsplit
+from config import API_KEY
+import simulator
+
+# Drives a running server with concurrent clients and reports p50/p99 latency and throughput per route:
+#   python loadtest.py --url http://localhost:5000 --concurrency 16 --duration 30
+# With --server the whole pipeline runs locally: the upstream simulator in this process and the server command
+# started against it with a throwaway data directory, so the fetcher polls and publishes while requests are served:
+#   python loadtest.py --server "python start_waitress.py" --speed 120 --concurrency 32 --streams 8
+# Every /bridge-status body is also checked, a client should never see an older update than it already has, or
+# a bridge twice, whatever the fetcher is doing. Those count as inconsistent responses.
+DEFAULT_ROUTES = (("/bridge-status", 10), ("/stats", 2), ("/history", 1), ("/heatmap", 1))
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.bytes = 0
+        self.errors = 0
+        self.inconsistent = 0
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.bytes += other.bytes
+        self.errors += other.errors
+        self.inconsistent += other.inconsistent
+
+    def summary(self, duration):
+        latencies = sorted(self.latencies)
+        return {
+            "requests": len(latencies),
+            "rps": round(len(latencies) / duration, 1),
+            "p50_ms": round(percentile(latencies, 0.5) * 1e3, 3),
+            "p90_ms": round(percentile(latencies, 0.9) * 1e3, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1e3, 3),
+            "max_ms": round(latencies[-1] * 1e3, 3) if latencies else 0.0,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "inconsistent": self.inconsistent
+        }
+
+class Client:
+    # One keep-alive connection making weighted random requests until deadline. Results are kept per client and
+    # merged at the end so the clients never share a lock.
+    def __init__(self, url, api_key, routes, deadline, use_gzip, revalidate, seed):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.api_key = api_key
+        self.paths = [path for path, _ in routes]
+        self.weights = [weight for _, weight in routes]
+        self.deadline = deadline
+        self.use_gzip = use_gzip
+        self.revalidate = revalidate
+        self.random = random.Random(seed)
+        self.stats = {path: RouteStats() for path in self.paths}
+        self.etags = {}
+        # Latest "updated" seen, as an epoch so times either side of a DST change compare correctly
+        self.last_updated = float('-inf')
+        self.connection = None
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            path = self.random.choices(self.paths, self.weights)[0]
+            self.request(path, self.stats[path])
+        if self.connection is not None:
+            self.connection.close()
+
+    def request(self, path, stats):
+        headers = {"X-API-Key": self.api_key}
+        if self.use_gzip:
+            headers["Accept-Encoding"] = "gzip"
+        if self.revalidate and path in self.etags:
+            headers["If-None-Match"] = self.etags[path]
+        started = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            self.connection.request("GET", path, headers=headers)
+            response = self.connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            stats.errors += 1
+            if self.connection is not None:
+                self.connection.close()
+            self.connection = None
+            return
+        stats.latencies.append(time.perf_counter() - started)
+        stats.statuses[response.status] = stats.statuses.get(response.status, 0) + 1
+        stats.bytes += len(body)
+        if response.status != 200:
+            return
+        if response.getheader("ETag"):
+            self.etags[path] = response.getheader("ETag")
+        if path == "/bridge-status":
+            if response.getheader("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            if not self.consistent(json.loads(body)):
+                stats.inconsistent += 1
+
+    def consistent(self, status):
+        ids = [bridge["id"] for bridge in status.get("bridges", [])]
+        updated = datetime.fromisoformat(status["updated"]).timestamp() if status.get("updated") else float('-inf')
+        ok = len(ids) == len(set(ids)) and updated >= self.last_updated
+        self.last_updated = max(self.last_updated, updated)
+        return ok
+
+class StreamClient:
+    # Holds a /bridge-status/stream connection open, counting the events it gets
+    def __init__(self, url, api_key, deadline):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.api_key = api_key
+        self.deadline = deadline
+        self.status = None
+        self.events = 0
+        self.heartbeats = 0
+
+    def run(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=max(1, self.deadline - time.monotonic()))
+        try:
+            connection.request("GET", "/bridge-status/stream", headers={"X-API-Key": self.api_key})
+            response = connection.getresponse()
+            self.status = response.status
+            while response.status == 200 and time.monotonic() < self.deadline:
+                line = response.fp.readline()
+                if not line:
+                    break
+                if line.startswith(b"event:"):
+                    self.events += 1
+                elif line.startswith(b": heartbeat"):
+                    self.heartbeats += 1
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            connection.close()
+
+def run_load(url, api_key=API_KEY, routes=DEFAULT_ROUTES, concurrency=8, duration=10.0, streams=0, use_gzip=False,
+             revalidate=False, seed=0):
+    deadline = time.monotonic() + duration
+    clients = [Client(url, api_key, routes, deadline, use_gzip, revalidate, seed + i) for i in range(concurrency)]
+    stream_clients = [StreamClient(url, api_key, deadline) for _ in range(streams)]
+    threads = [threading.Thread(target=client.run, daemon=True) for client in stream_clients + clients]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    total = RouteStats()
+    per_route = {}
+    for path, _ in routes:
+        stats = RouteStats()
+        for client in clients:
+            stats.merge(client.stats[path])
+        total.merge(stats)
+        per_route[path] = stats.summary(elapsed)
+    report = {
+        "url": url,
+        "concurrency": concurrency,
+        "duration": round(elapsed, 3),
+        "total": total.summary(elapsed),
+        "routes": per_route
+    }
+    if streams:
+        report["streams"] = {
+            "statuses": [client.status for client in stream_clients],
+            "events": sum(client.events for client in stream_clients),
+            "heartbeats": sum(client.heartbeats for client in stream_clients)
+        }
+    return report
+
+def wait_until_ready(url, timeout):
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=2)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return True
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    return False
+
+# Runs the simulator here and the server command in a subprocess polling it, returns (simulator server, process)
+def start_pipeline(command, data_directory, speed, latency, error_rate, fetch_interval):
+    upstream = simulator.make_server(simulator.Simulation(simulator.default_bridges(len(simulator.DEFAULT_BRIDGES)), speed),
+                                     simulator.Faults(latency, latency / 2, error_rate))
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    env = dict(os.environ)
+    env.update({
+        "BRIDGE_STATUS_URL": f"http://127.0.0.1:{upstream.server_port}/bridgestatus/detailsnai?key=BridgeSCT",
+        "BRIDGE_SOURCES": "",
+        "BRIDGE_STATS_FILE": os.path.join(data_directory, "bridge_stats.json"),
+        "FETCH_INTERVAL": str(fetch_interval),
+        "FETCH_INTERVAL_FAST": str(fetch_interval),
+        "FETCH_INTERVAL_IDLE": str(fetch_interval),
+        "API_KEY": env.get("API_KEY", API_KEY)
+    })
+    process = subprocess.Popen(shlex.split(command), env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return upstream, process
+
+def print_report(report):
+    print(f"{'route':<18}{'requests':>10}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}{'bad':>6}", file=sys.stderr)
+    for path, summary in list(report["routes"].items()) + [("total", report["total"])]:
+        print(f"{path:<18}{summary['requests']:>10}{summary['rps']:>10}{summary['p50_ms']:>10}{summary['p99_ms']:>10}"
+              f"{summary['max_ms']:>10}{summary['errors']:>8}{summary['inconsistent']:>6}", file=sys.stderr)
+    if "streams" in report:
+        streams = report["streams"]
+        print(f"streams: {streams['events']} events, {streams['heartbeats']} heartbeats, statuses {streams['statuses']}", file=sys.stderr)
+
+def parse_route(value):
+    path, _, weight = value.partition('=')
+    return path, float(weight or 1)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the bridge status API")
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--api-key', default=API_KEY)
+    parser.add_argument('--route', action='append', type=parse_route, help="PATH=WEIGHT, repeatable")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--streams', type=int, default=0, help="stream subscribers to hold open during the test")
+    parser.add_argument('--gzip', action='store_true', help="send Accept-Encoding: gzip")
+    parser.add_argument('--revalidate', action='store_true', help="send If-None-Match with the last ETag")
+    parser.add_argument('--output', help="write the JSON report here")
+    parser.add_argument('--server', help="server command to start against a local upstream simulator")
+    parser.add_argument('--speed', type=float, default=60, help="simulator speed with --server")
+    parser.add_argument('--latency', type=float, default=100, help="simulator latency in milliseconds with --server")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="simulator error rate with --server")
+    parser.add_argument('--fetch-interval', type=int, default=2, help="server poll interval with --server")
+    args = parser.parse_args(argv)
+
+    upstream = process = None
+    report = upstream_counts = None
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            if args.server:
+                upstream, process = start_pipeline(args.server, directory, args.speed, args.latency / 1000,
+                                                   args.error_rate, args.fetch_interval)
+                if not wait_until_ready(args.url, 30):
+                    sys.exit(f"{args.server} wasn't ready on {args.url} within 30s")
+            report = run_load(args.url, args.api_key, args.route or DEFAULT_ROUTES, args.concurrency, args.duration,
+                              args.streams, args.gzip, args.revalidate)
+        finally:
+            if process is not None:
+                process.terminate()
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+            if upstream is not None:
+                upstream_counts = dict(upstream.RequestHandlerClass.counts)
+                upstream.shutdown()
+                upstream.server_close()
+    # Only reached once the load ran, a failure to start or run it has already been raised above
+    if upstream_counts is not None:
+        report["upstream"] = {str(status): count for status, count in upstream_counts.items()}
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 1 if report["total"]["errors"] or report["total"]["inconsistent"] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
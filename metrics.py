@@ -0,0 +1,163 @@
+# metrics.py
+
+import os
+import time
+import random
+import logging
+import threading
+import cProfile
+import pstats
+from bisect import bisect_left
+from contextlib import contextmanager
+from config import PROFILE_POLL_RATE, PROFILE_FILE
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text format for /metrics without a client library. Observing is a bisect and a few additions under
+# the metric's lock, gauges are callbacks that only run when /metrics is scraped. Each server process keeps its
+# own metrics, with MULTIPROCESS=true only the leader fetches so the fetch and stats metrics come from it.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = sorted(self.values.items())
+        lines.extend(f"{self.name}{format_labels(self.labels, labels)} {value}" for labels, value in values)
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # Per label values: a count per bucket (not cumulative, plus +Inf), the sum and the count
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            values = sorted((labels, (list(series[0]), series[1], series[2])) for labels, series in self.values.items())
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(self.labels + ("le",), labels + (bound,))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+        return lines
+
+class Gauge:
+    # collect returns {label values tuple: value}, called on every scrape
+    def __init__(self, name, help, collect, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = sorted(self.collect().items())
+        except Exception as e:
+            logger.error(f"Error collecting {self.name}: {str(e)}", exc_info=True)
+            values = []
+        lines.extend(f"{self.name}{format_labels(self.labels, labels)} {value}" for labels, value in values)
+        return lines
+
+registry = []
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+fetch_seconds = register(Histogram("bridge_fetch_seconds", "Upstream fetch latency", ("source",)))
+fetch_errors = register(Counter("bridge_fetch_errors_total", "Failed upstream fetches", ("source",)))
+parse_seconds = register(Histogram("bridge_parse_seconds", "Time to extract the bridges from a page", ("source",)))
+stats_update_seconds = register(Histogram("bridge_stats_update_seconds", "Time to apply one status update to the stats"))
+save_seconds = register(Histogram("bridge_stats_save_seconds", "Time to write the stats file", buckets=LATENCY_BUCKETS + (30, 60)))
+transitions = register(Counter("bridge_transitions_total", "Bridge state changes by the state changed to", ("bridge", "state")))
+request_seconds = register(Histogram("http_request_seconds", "Request latency by route", ("route", "status")))
+response_bytes = register(Histogram("http_response_bytes", "Response body size by route", ("route",), SIZE_BUCKETS))
+api_requests = register(Counter("api_requests_total", "Authenticated requests by key name and result", ("key", "result")))
+
+def transition_state(status, action):
+    return f"{status} ({action})" if action else status
+
+# Polls are profiled at PROFILE_POLL_RATE (0 to 1) with the stats of every profiled poll accumulated in PROFILE_FILE,
+# e.g. python -c "import pstats; pstats.Stats('poll.prof').sort_stats('cumulative').print_stats(20)"
+profile_stats = None
+profile_lock = threading.Lock()
+
+# Only one profiler can run at a time, a poll that comes up while another is being profiled just runs
+def profiled(function, *args):
+    if not PROFILE_POLL_RATE or random.random() >= PROFILE_POLL_RATE or not profile_lock.acquire(blocking=False):
+        return function(*args)
+    global profile_stats
+    try:
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args)
+        finally:
+            try:
+                if profile_stats is None:
+                    profile_stats = pstats.Stats(profile)
+                else:
+                    profile_stats.add(profile)
+                directory = os.path.dirname(PROFILE_FILE)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                profile_stats.dump_stats(PROFILE_FILE)
+            except Exception as e:
+                logger.error(f"Error saving poll profile: {str(e)}", exc_info=True)
+    finally:
+        profile_lock.release()
@@ -0,0 +1,78 @@
+# poll_policy.py
+
+import random
+import time
+import logging
+from config import (FETCH_INTERVAL_FAST, FETCH_INTERVAL_IDLE, FETCH_SLOW_SECONDS, FETCH_BACKOFF_MAX,
+                    BREAKER_FAILURES, BREAKER_COOLDOWN, ADAPTIVE_POLLING)
+
+logger = logging.getLogger(__name__)
+
+# Actions that mean a bridge is about to change state
+TRANSITIONAL_ACTIONS = ("Raising Soon", "Raising", "Lowering")
+# Start polling fast this many seconds before a closure is expected to end
+PREDICTION_WINDOW = 300
+
+def closure_ending_soon(bridge_stat, now):
+    closures = bridge_stat.get("closures")
+    if not closures or not closures.is_open():
+        return False
+    # Earliest likely end from the duration quantiles once there's enough history
+    prediction = closures.remaining((now - closures.starts[-1]) / 60, closures.starts[-1])
+    if prediction:
+        return prediction[0] * 60 <= PREDICTION_WINDOW
+    if not bridge_stat.get("avg_closure_duration"):
+        return False
+    expected_minutes = bridge_stat.get("closure_duration_ci", (bridge_stat["avg_closure_duration"],))[0]
+    return now >= closures.starts[-1] + expected_minutes * 60 - PREDICTION_WINDOW
+
+class PollPolicy:
+    # Works out how long to wait before polling a source again. Polls fast while a bridge is moving or a closure
+    # is due to end, relaxes while every bridge is open and quiet, and backs off with jitter while upstream is
+    # failing or slow. After BREAKER_FAILURES failures in a row the breaker opens and the source is only tried
+    # once every BREAKER_COOLDOWN seconds until a poll succeeds.
+    def __init__(self, interval, fast_interval=FETCH_INTERVAL_FAST, idle_interval=FETCH_INTERVAL_IDLE, adaptive=ADAPTIVE_POLLING):
+        self.interval = interval
+        self.fast_interval = min(fast_interval, interval)
+        self.idle_interval = max(idle_interval, interval)
+        self.adaptive = adaptive
+        self.failures = 0
+
+    @property
+    def breaker_open(self):
+        return self.failures >= BREAKER_FAILURES
+
+    # bridges is (current_status, action_status, bridge_stat) for each bridge on the page
+    def state_interval(self, bridges, now=None):
+        if not self.adaptive or not bridges:
+            return self.interval
+        now = time.time() if now is None else now
+        all_quiet = True
+        for current_status, action_status, bridge_stat in bridges:
+            if action_status in TRANSITIONAL_ACTIONS:
+                return self.fast_interval
+            if current_status == "Unavailable" and closure_ending_soon(bridge_stat, now):
+                return self.fast_interval
+            if current_status != "Available" or action_status:
+                all_quiet = False
+        return self.idle_interval if all_quiet else self.interval
+
+    def after_success(self, bridges, elapsed, now=None):
+        interval = self.state_interval(bridges, now)
+        if elapsed < FETCH_SLOW_SECONDS:
+            if self.failures:
+                logger.info(f"Upstream recovered after {self.failures} failed or slow polls")
+            self.failures = 0
+            return interval
+        logger.warning(f"Upstream took {elapsed:.1f}s to respond, backing off")
+        return max(interval, self.after_failure())
+
+    def after_failure(self):
+        self.failures += 1
+        if self.breaker_open:
+            if self.failures == BREAKER_FAILURES:
+                logger.warning(f"{self.failures} failed polls in a row, only retrying every {BREAKER_COOLDOWN}s")
+            return BREAKER_COOLDOWN
+        # Full jitter between the normal interval and the exponential cap
+        cap = min(FETCH_BACKOFF_MAX, self.interval * 2 ** self.failures)
+        return random.uniform(self.interval, max(self.interval, cap))
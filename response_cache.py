@@ -0,0 +1,71 @@
+# response_cache.py
+
+import gzip
+import json
+import time
+import hashlib
+from flask import Response, request
+
+# Same output as jsonify
+def encode_json(payload):
+    return (json.dumps(payload, sort_keys=True, separators=(',', ':')) + "\n").encode()
+
+# A strong ETag names one exact body, so the gzipped body gets its own: the identity ETag with -gz on the end
+def gzip_etag(etag):
+    return etag[:-1] + '-gz"'
+
+class CachedResponse:
+    # JSON body encoded once along with its gzipped copy and a strong ETag
+    def __init__(self, payload):
+        self.body = encode_json(payload)
+        self.gzip_body = gzip.compress(self.body, compresslevel=6)
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+
+# Either representation's ETag revalidates, the client already has the same content
+def etag_matches(etag, if_none_match):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') in (etag, gzip_etag(etag)) for tag in if_none_match.split(','))
+
+# For servers without werkzeug's Accept-Encoding parsing
+def accepts_gzip(accept_encoding):
+    qualities = {}
+    for coding in (accept_encoding or '').split(','):
+        name, _, params = coding.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0)) > 0
+
+# Cacheable until the next poll could change it
+def cache_headers(etag, next_update):
+    return {
+        "ETag": etag,
+        "Cache-Control": f"max-age={max(0, int(next_update - time.time()))}",
+        "Vary": "Accept-Encoding, X-API-Key"
+    }
+
+# Returns (status, headers, body) for a request with these If-None-Match and gzip preferences
+def negotiate(cached, next_update, if_none_match, gzip_ok):
+    headers = cache_headers(gzip_etag(cached.etag) if gzip_ok else cached.etag, next_update)
+    if etag_matches(cached.etag, if_none_match):
+        return 304, headers, b""
+    if gzip_ok:
+        headers["Content-Encoding"] = "gzip"
+        return 200, headers, cached.gzip_body
+    return 200, headers, cached.body
+
+def cached_response(cached, next_update):
+    status, headers, body = negotiate(cached, next_update, request.headers.get('If-None-Match'), bool(request.accept_encodings['gzip']))
+    if status == 304:
+        return Response(status=304, headers=headers)
+    # Followers in multi-process mode serve memoryviews of the shared snapshot
+    return Response(body if isinstance(body, bytes) else [body], mimetype='application/json', headers=headers)
@@ -0,0 +1,156 @@
+# routing.py
+
+import json
+import math
+import time
+import threading
+from datetime import datetime
+from config import TORONTO_TZ, ROUTE_SPEED_KMH
+from history import PeriodHistory
+from history_index import int_arg
+
+EARTH_RADIUS_KM = 6371.0088
+# A bridge that's lowering is open again in about this many minutes (low, likely, high)
+LOWERING_MINUTES = (0, 1, 3)
+
+# Minutes left (low, likely, high) for a period of history that started at start, from its duration quantiles, or
+# from the CI and mean of its durations before there's enough of them. None with no history at all.
+def remaining(history, ci, mean, start, now):
+    elapsed = (now - start) / 60
+    if isinstance(history, PeriodHistory):
+        prediction = history.remaining(elapsed, start)
+        if prediction:
+            return list(prediction)
+    if not mean:
+        return None
+    low, high = ci or (mean, mean)
+    return [max(0, round(low - elapsed)), max(0, round(mean - elapsed)), max(0, round(high - elapsed))]
+
+# One row of the ETA table for a bridge in the state just polled. open_in is how long until a closed bridge opens
+# (None if it's closed with no estimate, e.g. for construction), closes_in how long until a bridge that's raising
+# soon closes, and closure how long that closure would then last. as_of is when they were estimated, each source
+# polls on its own schedule so queries count every row down from its own poll.
+def crossing_eta(entry, current_status, action_status, bridge_stat, now):
+    row = {
+        "as_of": now,
+        "id": entry["id"],
+        "location": entry["location"],
+        "state": entry["state"],
+        "lat": entry["lat"],
+        "lng": entry["lng"],
+        "available": current_status == "Available",
+        "open_in": None,
+        "closes_in": None,
+        "closure": None
+    }
+    last_change = datetime.fromisoformat(bridge_stat["last_status_change"]).timestamp()
+    closures = bridge_stat.get("closures")
+    closure_ci = bridge_stat.get("closure_duration_ci")
+    closure_mean = bridge_stat.get("avg_closure_duration", 0)
+    if current_status == "Available":
+        if action_status == "Raising Soon":
+            row["closes_in"] = remaining(bridge_stat.get("raising_soon_times"), bridge_stat.get("raising_soon_ci"),
+                                         bridge_stat.get("avg_raising_soon_to_unavailable", 0), last_change, now)
+            row["closure"] = remaining(closures, closure_ci, closure_mean, now, now)
+    elif action_status == "Lowering":
+        row["open_in"] = list(LOWERING_MINUTES)
+    elif action_status != "Work in Progress":
+        start = closures.starts[-1] if isinstance(closures, PeriodHistory) and closures.is_open() else last_change
+        row["open_in"] = remaining(closures, closure_ci, closure_mean, start, now)
+    return row
+
+class RouteIndex:
+    # The ETA table from one snapshot with each crossing's position projected once onto a flat plane around the
+    # crossings (equirectangular, well under 0.1% off over the length of the canal), so ranking them for a query is a
+    # few multiplications per crossing. There are a handful of crossings, so a scan beats a tree. as_of is when the
+    # oldest row was estimated.
+    def __init__(self, table, as_of):
+        self.as_of = as_of
+        self.rows = [row for row in table if row["lat"] is not None and row["lng"] is not None]
+        mean_lat = sum(row["lat"] for row in self.rows) / len(self.rows) if self.rows else 0
+        self.cos_lat = math.cos(math.radians(mean_lat))
+        self.points = [(math.radians(row["lng"]) * self.cos_lat, math.radians(row["lat"])) for row in self.rows]
+
+    # Crossings ranked by when you'd be across: travel time at ROUTE_SPEED_KMH plus the likely wait on arrival.
+    # Crossings with no estimate go last, ties go to the nearer one.
+    def query(self, lat, lng, now, limit=None, speed=ROUTE_SPEED_KMH):
+        x, y = math.radians(lng) * self.cos_lat, math.radians(lat)
+        results = []
+        for row, (px, py) in zip(self.rows, self.points):
+            elapsed = (now - row["as_of"]) / 60
+            distance = math.hypot(px - x, py - y) * EARTH_RADIUS_KM
+            travel = distance / speed * 60
+            wait = arrival_wait(row, travel, elapsed)
+            results.append((travel + wait if wait is not None else math.inf, distance, row, travel, wait, elapsed))
+        results.sort(key=lambda result: (result[0], result[1]))
+        return [{
+            "id": row["id"],
+            "location": row["location"],
+            "state": row["state"],
+            "distance_km": round(distance, 2),
+            "travel_min": round(travel, 1),
+            "wait_min": round(wait) if wait is not None else None,
+            "open_on_arrival": wait == 0 if wait is not None else None,
+            "open_in": shifted(row["open_in"], elapsed),
+            "closes_in": shifted(row["closes_in"], elapsed)
+        } for _, distance, row, travel, wait, elapsed in results[:limit]]
+
+def shifted(minutes, elapsed):
+    return [max(0, round(m - elapsed)) for m in minutes] if minutes is not None else None
+
+# Likely minutes spent waiting at a crossing reached travel minutes from now, None if it can't be estimated
+def arrival_wait(row, travel, elapsed):
+    if row["available"]:
+        closes_in = row["closes_in"]
+        # Across before it can close, otherwise wait out the closure from when it likely closes
+        if closes_in is None or travel < closes_in[0] - elapsed:
+            return 0
+        if row["closure"] is None:
+            return None
+        return max(0, closes_in[1] - elapsed + row["closure"][1] - travel)
+    if row["open_in"] is None:
+        return None
+    return max(0, row["open_in"][1] - elapsed - travel)
+
+index = None
+index_etag = None
+index_lock = threading.Lock()
+
+# Rebuilt on the first query after a publish, followers in multi-process mode build it from the encoded table
+def get_index(current):
+    global index, index_etag
+    cached = current.responses.get("routes")
+    if cached is None:
+        return RouteIndex([], time.time())
+    with index_lock:
+        if index_etag != cached.etag:
+            table = json.loads(bytes(cached.body))
+            index = RouteIndex(table["crossings"], table["as_of"])
+            index_etag = cached.etag
+        return index
+
+def float_arg(args, name, low, high):
+    try:
+        value = float(args.get(name, ''))
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+
+# Returns (status, payload) for /route?lat=&lng=&limit=
+def route_response(current, args, now=None):
+    try:
+        lat = float_arg(args, 'lat', -90, 90)
+        lng = float_arg(args, 'lng', -180, 180)
+        limit = int_arg(args, 'limit')
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be at least 1")
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    route_index = get_index(current)
+    now = now or time.time()
+    return 200, {
+        "as_of": datetime.fromtimestamp(route_index.as_of, TORONTO_TZ).isoformat(),
+        "crossings": route_index.query(lat, lng, now, limit)
+    }
@@ -0,0 +1,217 @@
+# running_stats.py
+
+import math
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+from config import TORONTO_TZ
+
+CLOSURE_BUCKETS = (("1-9m", 9), ("10-15m", 15), ("16-20m", 20), ("21-25m", 25), ("26-30m", 30), ("31m+", math.inf))
+
+# Two-sided 95% Student-t critical values for 1-30 degrees of freedom
+T_CRITICAL_95 = (
+    12.7062, 4.3027, 3.1824, 2.7764, 2.5706, 2.4469, 2.3646, 2.3060, 2.2622, 2.2281,
+    2.2010, 2.1788, 2.1604, 2.1448, 2.1314, 2.1199, 2.1098, 2.1009, 2.0930, 2.0860,
+    2.0796, 2.0739, 2.0687, 2.0639, 2.0595, 2.0555, 2.0518, 2.0484, 2.0452, 2.0423
+)
+Z_95 = 1.959964
+
+def t_critical_95(df):
+    if df <= len(T_CRITICAL_95):
+        return T_CRITICAL_95[df - 1]
+    # Cornish-Fisher expansion around the normal quantile, within 1e-4 of the exact value past 30 df
+    z = Z_95
+    return z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+
+def bucket_index(duration):
+    for i, (_, upper) in enumerate(CLOSURE_BUCKETS):
+        if duration <= upper:
+            return i
+
+# DurationHistogram has one bin per minute, longer periods are never recorded (see MAX_PERIOD_DURATION)
+HISTOGRAM_MINUTES = 90
+QUANTILES = (0.1, 0.5, 0.9)
+
+HOURS_PER_WEEK = 168
+WEEK_SECONDS = HOURS_PER_WEEK * 3600
+
+# 0 is Monday 00:00-00:59 Toronto time
+def hour_of_week(epoch):
+    local = datetime.fromtimestamp(epoch, TORONTO_TZ)
+    return local.weekday() * 24 + local.hour
+
+class RunningStats:
+    # Aggregates over the durations currently in a PeriodHistory. Periods are added when they close and subtracted
+    # when they expire, oldest first, so min/max are kept in monotonic windows instead of rescanning the history.
+    # Mean and variance use Welford's update (and its inverse on removal) to stay numerically stable.
+    def __init__(self):
+        self.count = 0
+        self.mean_value = 0.0
+        self.m2 = 0.0
+        self.buckets = [0] * len(CLOSURE_BUCKETS)
+        self.min_window = deque()
+        self.max_window = deque()
+
+    def to_state(self):
+        return {
+            "count": self.count,
+            "mean": self.mean_value,
+            "m2": self.m2,
+            "buckets": list(self.buckets),
+            "min_window": list(self.min_window),
+            "max_window": list(self.max_window)
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        running = cls()
+        running.count = state["count"]
+        running.mean_value = state["mean"]
+        running.m2 = state["m2"]
+        running.buckets = list(state["buckets"])
+        running.min_window = deque(tuple(item) for item in state["min_window"])
+        running.max_window = deque(tuple(item) for item in state["max_window"])
+        return running
+
+    def add(self, start, duration):
+        self.count += 1
+        delta = duration - self.mean_value
+        self.mean_value += delta / self.count
+        self.m2 += delta * (duration - self.mean_value)
+        self.buckets[bucket_index(duration)] += 1
+        while self.min_window and self.min_window[-1][1] >= duration:
+            self.min_window.pop()
+        self.min_window.append((start, duration))
+        while self.max_window and self.max_window[-1][1] <= duration:
+            self.max_window.pop()
+        self.max_window.append((start, duration))
+
+    def remove(self, start, duration):
+        self.count -= 1
+        if self.count == 0:
+            self.mean_value = 0.0
+            self.m2 = 0.0
+        else:
+            previous_mean = self.mean_value
+            self.mean_value = (previous_mean * (self.count + 1) - duration) / self.count
+            self.m2 = max(0.0, self.m2 - (duration - previous_mean) * (duration - self.mean_value))
+        self.buckets[bucket_index(duration)] -= 1
+        while self.min_window and self.min_window[0][0] <= start:
+            self.min_window.popleft()
+        while self.max_window and self.max_window[0][0] <= start:
+            self.max_window.popleft()
+
+    def mean(self):
+        return self.mean_value
+
+    def variance(self):
+        if self.count < 2:
+            return 0
+        return self.m2 / (self.count - 1)
+
+    def min(self):
+        return self.min_window[0][1] if self.min_window else 0
+
+    def max(self):
+        return self.max_window[0][1] if self.max_window else 0
+
+    def bucket_counts(self):
+        return {name: count for (name, _), count in zip(CLOSURE_BUCKETS, self.buckets)}
+
+    # 95% confidence interval of the mean
+    def ci(self):
+        mean = self.mean()
+        if self.count < 2:
+            return round(mean), round(mean)
+        margin = t_critical_95(self.count - 1) * math.sqrt(self.variance() / self.count)
+        return round(mean - margin), round(mean + margin)
+
+class DurationHistogram:
+    # Durations counted in one minute bins, which unlike a sketch stays exact when expired periods are removed.
+    # For each whole minute k, the p10/p50/p90 of the durations that lasted at least k minutes (interpolated within
+    # bins) are worked out in one pass the first time they're needed after a change, so a prediction for a period
+    # that's been running k minutes is a table lookup.
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts else [0] * (HISTOGRAM_MINUTES + 1)
+        self.total = sum(self.counts)
+        self.table = None
+
+    def add(self, duration, sign=1):
+        self.counts[min(int(duration), HISTOGRAM_MINUTES)] += sign
+        self.total += sign
+        self.table = None
+
+    def remove(self, duration):
+        self.add(duration, -1)
+
+    def build_table(self):
+        # cumulative[j] is how many durations fall in bins below j
+        cumulative = [0]
+        for count in self.counts:
+            cumulative.append(cumulative[-1] + count)
+        table = []
+        for k in range(len(self.counts)):
+            survivors = self.total - cumulative[k]
+            if not survivors:
+                table.append((0, (0.0,) * len(QUANTILES)))
+                continue
+            values = []
+            for q in QUANTILES:
+                target = cumulative[k] + q * survivors
+                j = bisect_left(cumulative, target, k + 1) - 1
+                values.append(j + (target - cumulative[j]) / self.counts[j])
+            table.append((survivors, tuple(values)))
+        self.table = table
+
+    # How many durations lasted at least elapsed minutes, and their p10/p50/p90 in minutes
+    def quantiles(self, elapsed):
+        if self.table is None:
+            self.build_table()
+        return self.table[min(max(int(elapsed), 0), HISTOGRAM_MINUTES)]
+
+class HourOfWeekStats:
+    # Periods bucketed by the hour of the week: how many started in each hour, their total duration, and how many
+    # minutes fell in each hour with a period split across every hour it spans (at most three, periods are capped
+    # at 90 minutes). Adding or removing a period is O(1) like RunningStats.
+    def __init__(self):
+        self.counts = [0] * HOURS_PER_WEEK
+        self.duration_sums = [0.0] * HOURS_PER_WEEK
+        self.minutes = [0.0] * HOURS_PER_WEEK
+
+    def to_state(self):
+        return {"counts": list(self.counts), "duration_sums": list(self.duration_sums), "minutes": list(self.minutes)}
+
+    @classmethod
+    def from_state(cls, state):
+        weekly = cls()
+        weekly.counts = list(state["counts"])
+        weekly.duration_sums = list(state["duration_sums"])
+        weekly.minutes = list(state["minutes"])
+        return weekly
+
+    def add(self, start, end, sign=1):
+        bucket = hour_of_week(start)
+        self.counts[bucket] += sign
+        self.duration_sums[bucket] += sign * (end - start) / 60
+        if not self.counts[bucket]:
+            # Don't let rounding error build up in empty hours
+            self.duration_sums[bucket] = 0.0
+        # Toronto's UTC offset is a whole number of hours, so local hours start on multiples of 3600 epoch seconds
+        t = start
+        while t < end:
+            boundary = min(end, (math.floor(t / 3600) + 1) * 3600)
+            self.minutes[hour_of_week(t)] += sign * (boundary - t) / 60
+            t = boundary
+
+    def remove(self, start, end):
+        self.add(start, end, -1)
+
+    # Per hour of week: periods started, their mean duration in minutes, and the chance of being inside a period at
+    # any moment in that hour over weeks_observed weeks
+    def summary(self, weeks_observed):
+        return {
+            "counts": list(self.counts),
+            "mean_durations": [round(total / count) if count else 0 for total, count in zip(self.duration_sums, self.counts)],
+            "probabilities": [round(min(1.0, max(0.0, minutes / (60 * weeks_observed))), 4) if weeks_observed else 0.0
+                              for minutes in self.minutes]
+        }
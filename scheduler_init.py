@@ -1,14 +1,20 @@
 from apscheduler.schedulers.background import BackgroundScheduler
-from bridge_status import fetch_bridge_status
-from config import FETCH_INTERVAL
+from bridge_status import schedule_fetch_jobs
+from bridge_stats import bridge_stats
+from config import MULTIPROCESS
+import leader
 
 scheduler = BackgroundScheduler()
 
 def start_scheduler():
     if not scheduler.running:
-        scheduler.add_job(fetch_bridge_status, 'interval', seconds=FETCH_INTERVAL, misfire_grace_time=60)
         scheduler.start()
-        fetch_bridge_status()
+        if MULTIPROCESS:
+            # Only the leader adds the fetch jobs
+            leader.start(lambda: schedule_fetch_jobs(scheduler))
+        else:
+            bridge_stats.load()
+            schedule_fetch_jobs(scheduler)
 
 def stop_scheduler():
     if scheduler.running:
@@ -0,0 +1,85 @@
+# shared_snapshot.py
+
+import os
+import json
+import mmap
+import struct
+from types import MappingProxyType
+from config import SHARED_SNAPSHOT_FILE
+from snapshot import Snapshot, freeze
+from storage import write_file
+
+# The leader writes every published snapshot's encoded responses to one file, swapped in atomically:
+#   magic, header length | JSON header (generation, next_update, etag and offsets of each body) | bodies
+# Followers mmap it read-only and serve views into the mapping, so the bodies live once in the page cache however
+# many processes serve them and a follower never decodes or re-encodes a response.
+PREFIX = struct.Struct("<4sI")
+MAGIC = b"BSS1"
+
+# Set in the leader once it's elected, publish_snapshot then writes every snapshot out for the followers
+enabled = False
+
+def write(current, filename=SHARED_SNAPSHOT_FILE):
+    responses = {}
+    blobs = []
+    offset = 0
+    for name, cached in current.responses.items():
+        responses[name] = {
+            "etag": cached.etag,
+            "body": [offset, len(cached.body)],
+            "gzip": [offset + len(cached.body), len(cached.gzip_body)]
+        }
+        blobs += [cached.body, cached.gzip_body]
+        offset += len(cached.body) + len(cached.gzip_body)
+    header = json.dumps({
+        "generation": current.generation,
+        "history_generation": current.history_generation,
+        "next_update": current.next_update,
+        "responses": responses
+    }, separators=(',', ':')).encode()
+    write_file(filename, b"".join([PREFIX.pack(MAGIC, len(header)), header] + blobs))
+
+class MappedResponse:
+    # Same attributes as CachedResponse, with the bodies as memoryviews into the shared mapping
+    def __init__(self, blobs, etag, body, gzip_body):
+        self.etag = etag
+        self.body = blobs[body[0]:body[0] + body[1]]
+        self.gzip_body = blobs[gzip_body[0]:gzip_body[0] + gzip_body[1]]
+
+# The views keep the mapping alive, so a request still sending an old snapshot is unaffected when the leader
+# replaces the file and the follower maps the new one
+def read_mapping(mapping):
+    view = memoryview(mapping)
+    magic, header_length = PREFIX.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("Not a shared bridge status snapshot")
+    header = json.loads(bytes(view[PREFIX.size:PREFIX.size + header_length]))
+    blobs = view[PREFIX.size + header_length:]
+    responses = {
+        name: MappedResponse(blobs, response["etag"], response["body"], response["gzip"])
+        for name, response in header["responses"].items()
+    }
+    # Followers only decode the status, for /health and to work out stream events
+    status = freeze(json.loads(bytes(responses["bridge-status"].body)))
+    return Snapshot(header["generation"], status, (), (), header["history_generation"], MappingProxyType(responses), header["next_update"])
+
+class SharedSnapshotReader:
+    def __init__(self, filename=SHARED_SNAPSHOT_FILE):
+        self.filename = filename
+        self.identity = None
+
+    # Returns the leader's snapshot if it published a new one since the last call, otherwise None
+    def refresh(self):
+        try:
+            f = open(self.filename, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            stat = os.fstat(f.fileno())
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if identity == self.identity or not stat.st_size:
+                return None
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        shared = read_mapping(mapping)
+        self.identity = identity
+        return shared
@@ -0,0 +1,248 @@
+# simulator.py
+
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from html import escape
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config import TORONTO_TZ
+
+# A local stand-in for the Seaway bridge status page, for running the fetcher, the server and loadtest.py without
+# touching seaway-greatlakes.com:
+#   python simulator.py --port 8080 --speed 60 --latency 150 --error-rate 0.02
+#   BRIDGE_STATUS_URL=http://localhost:8080/bridgestatus/detailsnai?key=BridgeSCT python start_waitress.py
+# Each bridge loops through a script of (status, seconds) states in simulated time, which runs --speed times faster
+# than real time. {since} in a status is replaced with the simulated time the state started, like the real page.
+DEFAULT_SCRIPT = (
+    ("Available", 1800),
+    ("Available (Raising Soon)", 600),
+    ("Unavailable (Fully Raised since {since})", 900),
+    ("Unavailable (--Lowering--)", 120)
+)
+DEFAULT_BRIDGES = ("Lakeshore Rd", "Carlton St.", "Queenston St.", "Glendale Ave.", "Highway 20")
+
+PAGE_HEAD = """<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=utf-8" />
+<title>Bridge Status - St. Catharines</title>
+</head>
+<body>
+<div id="wrapper">
+  <h1>St. Catharines&nbsp;&amp;&nbsp;Thorold Bridges</h1>
+  <table width="100%" border="0" cellspacing="0" cellpadding="4">
+"""
+BRIDGE_ROW = """    <tr>
+      <td valign="top">
+        <table id="grey_box" width="100%" border="0" cellspacing="0" cellpadding="6">
+          <tr>
+            <td width="40"><img src="/bridgestatus/images/bridge_{colour}.gif" width="32" height="32" alt="" /></td>
+            <td><span class="lgtextblack">{name}</span><br />
+              <span class="smtextgrey">Bridge {number}</span></td>
+          </tr>
+          <tr>
+            <td colspan="2">Status: <span id="status" class="{colour}">{status}</span></td>
+          </tr>
+        </table>
+      </td>
+    </tr>
+"""
+PAGE_TAIL = """  </table>
+  <p class="smtextgrey">Status last updated: {updated}</p>
+</div>
+</body>
+</html>
+"""
+
+def status_colour(status):
+    if status.startswith("Unavailable"):
+        return "red"
+    return "yellow" if "(" in status else "green"
+
+# bridges is a list of (name, status text)
+def render_page(bridges, updated):
+    rows = "".join(BRIDGE_ROW.format(colour=status_colour(status), name=escape(name), number=i, status=escape(status))
+                   for i, (name, status) in enumerate(bridges, 1))
+    return PAGE_HEAD + rows + PAGE_TAIL.format(updated=updated.strftime("%Y-%m-%d %H:%M:%S"))
+
+class SimulatedBridge:
+    # offset is how many seconds into its script the bridge is at the simulation's start
+    def __init__(self, name, states=DEFAULT_SCRIPT, offset=0):
+        self.name = name
+        self.states = [(status, float(seconds)) for status, seconds in states]
+        self.cycle = sum(seconds for _, seconds in self.states)
+        self.offset = offset
+
+    def status(self, elapsed, start):
+        position = (elapsed + self.offset) % self.cycle
+        state_start = elapsed - position
+        for status, seconds in self.states:
+            if position < seconds:
+                since = datetime.fromtimestamp(start + state_start, TORONTO_TZ).strftime("%H:%M")
+                return status.replace("{since}", since)
+            position -= seconds
+            state_start += seconds
+        return self.states[-1][0]
+
+class Simulation:
+    def __init__(self, bridges, speed=1.0, start=None):
+        self.bridges = bridges
+        self.speed = speed
+        self.start = start if start is not None else time.time()
+        self.started = time.monotonic()
+
+    def now(self):
+        return self.start + (time.monotonic() - self.started) * self.speed
+
+    def page(self):
+        now = self.now()
+        statuses = [(bridge.name, bridge.status(now - self.start, self.start)) for bridge in self.bridges]
+        return render_page(statuses, datetime.fromtimestamp(now, TORONTO_TZ))
+
+# Archived pages shown one after another for the time between their timestamps (see backfill.py for the naming),
+# looping back to the first
+class Replay:
+    def __init__(self, pages, speed=1.0):
+        self.pages = pages
+        self.speed = speed
+        self.times = [t - pages[0][0] for t, _ in pages]
+        # Show the last page as long as the average gap before looping
+        self.cycle = self.times[-1] + (self.times[-1] / (len(pages) - 1) if len(pages) > 1 else 60)
+        self.started = time.monotonic()
+
+    def page(self):
+        position = ((time.monotonic() - self.started) * self.speed) % self.cycle
+        index = max(i for i, t in enumerate(self.times) if t <= position)
+        return self.pages[index][1]
+
+    @classmethod
+    def from_directory(cls, directory, speed=1.0):
+        from backfill import page_time
+        pages = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if '.html' not in name or not os.path.isfile(path):
+                continue
+            opener = gzip.open if name.endswith('.gz') else open
+            with opener(path, 'rb') as f:
+                pages.append((page_time(path).timestamp(), f.read().decode('utf-8', errors='replace')))
+        if not pages:
+            raise ValueError(f"No .html pages in {directory}")
+        return cls(sorted(pages), speed)
+
+class Faults:
+    # latency and jitter are in seconds, every response waits latency plus up to jitter. error_rate of responses
+    # are a 503 and hang_rate hang for hang seconds first, long enough to hit the fetcher's read timeout.
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, hang_rate=0.0, hang=30.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang = hang
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def delay(self):
+        with self.lock:
+            hang = self.random.random() < self.hang_rate
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        return delay + (self.hang if hang else 0)
+
+    def fails(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+def make_handler(simulation, faults):
+    class SimulatorHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Requests are counted per status code, for tests and the summary printed on exit
+        counts = {}
+        counts_lock = threading.Lock()
+
+        def do_GET(self):
+            delay = faults.delay()
+            if delay:
+                time.sleep(delay)
+            if faults.fails():
+                return self.send_body(503, b"Service Unavailable", "text/plain")
+            body = simulation.page().encode()
+            etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+            if self.headers.get('If-None-Match') == etag:
+                return self.send_body(304, b"", None, etag)
+            self.send_body(200, body, "text/html; charset=utf-8", etag)
+
+        def send_body(self, status, body, content_type, etag=None):
+            with self.counts_lock:
+                self.counts[status] = self.counts.get(status, 0) + 1
+            self.send_response(status)
+            if content_type:
+                self.send_header('Content-Type', content_type)
+            if etag:
+                self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return SimulatorHandler
+
+def make_server(simulation, faults=None, host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), make_handler(simulation, faults or Faults()))
+    server.daemon_threads = True
+    return server
+
+# Script file: {"bridges": [{"name": "Lakeshore Rd", "offset": 0, "states": [["Available", 1800], ...]}, ...]}
+def load_script(filename):
+    with open(filename, 'r') as f:
+        script = json.load(f)
+    return [SimulatedBridge(bridge["name"], bridge.get("states", DEFAULT_SCRIPT), bridge.get("offset", 0))
+            for bridge in script["bridges"]]
+
+# The default bridges are staggered through the script so something is always moving
+def default_bridges(count):
+    cycle = sum(seconds for _, seconds in DEFAULT_SCRIPT)
+    names = [DEFAULT_BRIDGES[i] if i < len(DEFAULT_BRIDGES) else f"Bridge {i + 1}" for i in range(count)]
+    return [SimulatedBridge(name, DEFAULT_SCRIPT, i * cycle / count) for i, name in enumerate(names)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a simulated Seaway bridge status page")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--bridges', type=int, default=len(DEFAULT_BRIDGES), help="bridges on the default script")
+    parser.add_argument('--script', help="JSON file of bridges and their states")
+    parser.add_argument('--pages', help="replay archived pages from this directory instead")
+    parser.add_argument('--speed', type=float, default=1.0, help="simulated seconds per real second")
+    parser.add_argument('--latency', type=float, default=0.0, help="milliseconds before every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many extra milliseconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of responses that are a 503")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="fraction of responses that hang first")
+    parser.add_argument('--hang', type=float, default=30.0, help="seconds a hanging response hangs for")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    if args.pages:
+        simulation = Replay.from_directory(args.pages, args.speed)
+    else:
+        simulation = Simulation(load_script(args.script) if args.script else default_bridges(args.bridges), args.speed)
+    faults = Faults(args.latency / 1000, args.jitter / 1000, args.error_rate, args.hang_rate, args.hang, args.seed)
+    server = make_server(simulation, faults, args.host, args.port)
+    print(f"Simulating the bridge status page on http://{args.host}:{server.server_port}/ at {args.speed:g}x", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Responses by status: {server.RequestHandlerClass.counts}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
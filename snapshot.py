@@ -0,0 +1,51 @@
+# snapshot.py
+
+import time
+from collections import namedtuple
+from types import MappingProxyType
+from response_cache import CachedResponse
+
+# Everything a request needs from one poll. The fetcher builds a new one from fresh copies of the data and
+# publishes it by swapping the module level reference, request threads read whatever snapshot is current
+# without taking a lock and never see a half-updated bridge.
+Snapshot = namedtuple("Snapshot", ["generation", "status", "stats", "history", "history_generation", "responses", "next_update"])
+
+def freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+current = Snapshot(0, (), (), (), None, MappingProxyType({}), 0)
+
+def get_snapshot():
+    return current
+
+# Followers in multi-process mode serve the leader's snapshot as is
+def install(shared):
+    global current
+    current = shared
+
+# history and heatmap are only passed when history_generation moved, otherwise the previous snapshot's are reused.
+# routes is the ETA table for /route (see routing.py), it's only decoded when a route is asked for.
+def publish(status, stats, history_generation, history, next_update, heatmap=(), routes=None):
+    global current
+    previous = current
+    if history is None:
+        frozen_history = previous.history
+        history_response = previous.responses["history"]
+        heatmap_response = previous.responses["heatmap"]
+    else:
+        frozen_history = freeze(history)
+        history_response = CachedResponse(history)
+        heatmap_response = CachedResponse(list(heatmap))
+    responses = MappingProxyType({
+        "bridge-status": CachedResponse(status),
+        "stats": CachedResponse(stats),
+        "history": history_response,
+        "heatmap": heatmap_response,
+        "routes": CachedResponse(routes or {"as_of": time.time(), "crossings": []})
+    })
+    current = Snapshot(previous.generation + 1, freeze(status), freeze(stats), frozen_history, history_generation, responses, next_update)
+    return current
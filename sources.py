@@ -0,0 +1,29 @@
+# sources.py
+
+from collections import namedtuple
+from config import URL, FETCH_INTERVAL, BRIDGE_SOURCES
+
+# A bridge status page to poll. Bridges are identified by the source key and their name (see BridgeStats.bridge_id),
+# so keys shouldn't change once a source has been polled.
+Source = namedtuple("Source", ["key", "url", "interval"])
+
+# Sources are separated by ";" as KEY=URL with an optional @interval in seconds, e.g.
+# SCT=https://seaway-greatlakes.com/bridgestatus/detailsnai?key=BridgeSCT;PC=https://seaway-greatlakes.com/bridgestatus/detailsnai?key=BridgePC@60
+def parse_sources(spec, default_url=URL, default_interval=FETCH_INTERVAL):
+    if not spec or not spec.strip():
+        return [Source("SCT", default_url, default_interval)]
+    sources = []
+    for entry in (e.strip() for e in spec.split(';') if e.strip()):
+        key, separator, url = entry.partition('=')
+        if not separator or not key.strip() or not url.strip():
+            raise ValueError(f"Invalid bridge source '{entry}', expected KEY=URL[@interval]")
+        interval = default_interval
+        prefix, _, suffix = url.rpartition('@')
+        if prefix and suffix.isdigit():
+            url, interval = prefix, int(suffix)
+        if any(source.key == key.strip() for source in sources):
+            raise ValueError(f"Duplicate bridge source '{key.strip()}'")
+        sources.append(Source(key.strip(), url.strip(), interval))
+    return sources
+
+SOURCES = parse_sources(BRIDGE_SOURCES)
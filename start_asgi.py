@@ -0,0 +1,7 @@
+# start_asgi.py
+import uvicorn
+from config import KEEPALIVE_TIMEOUT
+
+# Single process asyncio server, the fetcher runs on the same event loop (see asgi_app.py)
+if __name__ == "__main__":
+    uvicorn.run("asgi_app:app", host="0.0.0.0", port=5000, timeout_keep_alive=KEEPALIVE_TIMEOUT)
@@ -2,7 +2,8 @@
 from scheduler_init import start_scheduler
 import waitress
 from app import app
+from config import WAITRESS_THREADS
 
 if __name__ == "__main__":
     start_scheduler()
-    waitress.serve(app, listen="0.0.0.0:5000")
\ No newline at end of file
+    waitress.serve(app, listen="0.0.0.0:5000", threads=WAITRESS_THREADS)
\ No newline at end of file
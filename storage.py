@@ -0,0 +1,185 @@
+# storage.py
+
+import json
+import os
+import time
+import hashlib
+import threading
+import logging
+from config import STATS_STORAGE, STATS_COMPACT_EVENTS, STATS_COMPACT_INTERVAL
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the derived stats file changes so old files are ignored
+DERIVED_STATS_VERSION = 3
+
+def read_snapshot(filename):
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return {"bridge_statistics": []}, None
+    return json.loads(data), hashlib.sha256(data).hexdigest()
+
+# Derived stats are only trusted if they were written for exactly this stats file
+def read_derived(filename, checksum):
+    if checksum is None:
+        return None
+    try:
+        with open(f"{filename}.derived", 'r') as f:
+            derived = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if derived.get("version") != DERIVED_STATS_VERSION or derived.get("checksum") != checksum:
+        logger.info("Derived stats are stale, recalculating")
+        return None
+    return derived["bridges"]
+
+# Write to a temp file and swap it in so a crash mid-write never leaves a truncated stats file
+def write_file(filename, data):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_filename, filename)
+
+def write_snapshot(filename, data, derived):
+    data = data.encode()
+    write_file(filename, data)
+    derived = {"version": DERIVED_STATS_VERSION, "checksum": hashlib.sha256(data).hexdigest(), "bridges": derived}
+    write_file(f"{filename}.derived", json.dumps(derived, separators=(',', ':')).encode())
+
+class JsonFileStorage:
+    # Rewrites the whole stats file on every update
+    def __init__(self, filename):
+        self.filename = filename
+        self.capture = None
+        self.serialize = None
+        self.serialize_derived = None
+
+    def attach(self, lock, capture, serialize, serialize_derived):
+        self.capture = capture
+        self.serialize = serialize
+        self.serialize_derived = serialize_derived
+
+    def load(self):
+        snapshot, checksum = read_snapshot(self.filename)
+        return snapshot, [], read_derived(self.filename, checksum)
+
+    def record(self, event):
+        self.save()
+
+    def save(self):
+        with metrics.save_seconds.time():
+            stats = self.capture()
+            write_snapshot(self.filename, self.serialize(stats), self.serialize_derived(stats))
+
+class EventLogStorage:
+    # Appends status transitions to a log and folds them into the stats file from a background thread.
+    # While compacting, the log is moved aside so new events keep appending to a fresh file.
+    def __init__(self, filename, compact_events=STATS_COMPACT_EVENTS, compact_interval=STATS_COMPACT_INTERVAL):
+        self.filename = filename
+        self.log_filename = f"{filename}.log"
+        self.compacting_filename = f"{filename}.log.compacting"
+        self.compact_events = compact_events
+        self.compact_interval = compact_interval
+        self.lock = None
+        self.capture = None
+        self.serialize = None
+        self.serialize_derived = None
+        self.log_file = None
+        self.pending_events = 0
+        self.last_compaction = time.monotonic()
+        self.compact_requested = threading.Event()
+        self.compactor = None
+        # Keeps an older snapshot from being written over a newer one
+        self.save_lock = threading.Lock()
+
+    # capture copies the stats with the lock held, serialize and serialize_derived encode the copy without it
+    def attach(self, lock, capture, serialize, serialize_derived):
+        self.lock = lock
+        self.capture = capture
+        self.serialize = serialize
+        self.serialize_derived = serialize_derived
+        if self.compactor is None:
+            self.compactor = threading.Thread(target=self.run_compactor, name="stats-compactor", daemon=True)
+            self.compactor.start()
+
+    def load(self):
+        events = []
+        for path in (self.compacting_filename, self.log_filename):
+            events.extend(self.read_events(path))
+        snapshot, checksum = read_snapshot(self.filename)
+        return snapshot, events, read_derived(self.filename, checksum)
+
+    def read_events(self, path):
+        events = []
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        logger.warning(f"Skipping corrupt event in {path}")
+        except FileNotFoundError:
+            pass
+        return events
+
+    # Called with the stats lock held
+    def record(self, event):
+        if event is None:
+            return
+        if self.log_file is None:
+            directory = os.path.dirname(self.log_filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.log_file = open(self.log_filename, 'a')
+        self.log_file.write(json.dumps(event, separators=(',', ':')) + '\n')
+        self.log_file.flush()
+        self.pending_events += 1
+        if self.pending_events >= self.compact_events or time.monotonic() - self.last_compaction >= self.compact_interval:
+            self.compact_requested.set()
+
+    def rotate_log(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+        if not os.path.exists(self.log_filename):
+            return
+        if os.path.exists(self.compacting_filename):
+            # A previous compaction failed, keep its events along with the new ones
+            with open(self.log_filename, 'r') as src, open(self.compacting_filename, 'a') as dst:
+                dst.write(src.read())
+            os.remove(self.log_filename)
+        else:
+            os.replace(self.log_filename, self.compacting_filename)
+
+    def save(self):
+        with self.save_lock, metrics.save_seconds.time():
+            with self.lock:
+                stats = self.capture()
+                self.rotate_log()
+                self.pending_events = 0
+                self.last_compaction = time.monotonic()
+            write_snapshot(self.filename, self.serialize(stats), self.serialize_derived(stats))
+            try:
+                os.remove(self.compacting_filename)
+            except FileNotFoundError:
+                pass
+
+    def run_compactor(self):
+        while True:
+            self.compact_requested.wait()
+            self.compact_requested.clear()
+            try:
+                self.save()
+            except Exception as e:
+                logger.error(f"Error compacting bridge stats: {str(e)}", exc_info=True)
+
+def create_storage(filename):
+    if STATS_STORAGE == 'json':
+        return JsonFileStorage(filename)
+    return EventLogStorage(filename)
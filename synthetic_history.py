@@ -0,0 +1,74 @@
+# synthetic_history.py
+
+import sys
+import json
+import random
+import argparse
+from datetime import datetime
+from config import TORONTO_TZ
+from history import to_iso
+from running_stats import CLOSURE_BUCKETS
+from storage import write_file
+
+# Writes a stats file in the same layout as BRIDGE_STATS_FILE for benchmarks and load tests, e.g.
+#   python synthetic_history.py --bridges 50 --days 180 --output /tmp/bridge_stats.json
+# Ids 1-5 match the bridges on fixtures/bridge_sct.html so a poll of that page updates the generated stats.
+FIXTURE_BRIDGES = ("Lakeshore Rd", "Carlton St.", "Queenston St.", "Glendale Ave.", "Highway 20")
+
+# Each bridge has a raising soon warning of a few minutes and then a closure, closures_per_day times a day on average.
+# Closure durations are gamma distributed around 15 minutes, like the real ones, with the odd one past the
+# 90 minute cutoff that's never recorded.
+def generate(bridges=5, days=30, closures_per_day=6, seed=0, end=None):
+    rng = random.Random(seed)
+    end = (end or datetime.now(TORONTO_TZ)).timestamp()
+    start = end - days * 86400
+    bridge_statistics = []
+    for i in range(1, bridges + 1):
+        closures = []
+        raising_soon_times = []
+        t = start + rng.expovariate(closures_per_day / 86400)
+        while t < end - 3 * 3600:
+            warning = rng.uniform(3, 20) * 60
+            raising_soon_times.append({"start": to_iso(t), "end": to_iso(t + warning)})
+            duration = rng.gammavariate(4, 4) * 60
+            if duration <= 90 * 60:
+                closures.append({"start": to_iso(t + warning), "end": to_iso(t + warning + duration)})
+            t += warning + duration + rng.expovariate(closures_per_day / 86400)
+        last_change = closures[-1]["end"] if closures else to_iso(start)
+        bridge_statistics.append({
+            "id": i,
+            "location": FIXTURE_BRIDGES[i - 1] if i <= len(FIXTURE_BRIDGES) else f"Bridge {i}",
+            "last_status": "Available",
+            "last_action": None,
+            "shortest_closure": 0,
+            "longest_closure": 0,
+            "avg_closure_duration": 0,
+            "avg_raising_soon_to_unavailable": 0,
+            "closure_durations": {name: 0 for name, _ in CLOSURE_BUCKETS},
+            "closures": closures,
+            "raising_soon_times": raising_soon_times,
+            "last_status_change": last_change,
+            "stats_last_updated": to_iso(end)
+        })
+    return {"bridge_statistics": bridge_statistics}
+
+# Only the stats file is written, so the first load works out every aggregate like a stats file from an older version
+def write(filename, bridges=5, days=30, closures_per_day=6, seed=0, end=None):
+    stats = generate(bridges, days, closures_per_day, seed, end)
+    write_file(filename, json.dumps(stats, indent=2).encode())
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic bridge stats file")
+    parser.add_argument('--bridges', type=int, default=5)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--closures-per-day', type=float, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args(argv)
+    stats = write(args.output, args.bridges, args.days, args.closures_per_day, args.seed)
+    closures = sum(len(bridge["closures"]) for bridge in stats["bridge_statistics"])
+    print(f"Wrote {args.bridges} bridges with {closures} closures over {args.days} days to {args.output}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
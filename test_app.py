@@ -0,0 +1,84 @@
+import gzip
+import json
+import time
+import pytest
+from app import app
+from config import API_KEY
+import snapshot
+from bridge_events import Broadcaster, bridge_changes
+
+HEADERS = {"X-API-Key": API_KEY}
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+@pytest.fixture
+def published():
+    status = {"updated": "2024-06-24T18:00:00-04:00", "bridges": [{"id": 1, "location": "Lakeshore Rd", "state": "OPEN"}]}
+    snapshot.publish(status, [], -1, [], next_update=time.time() + 20)
+    return status
+
+def test_requires_api_key(client, published):
+    assert client.get("/bridge-status").status_code == 401
+
+def test_serves_published_response(client, published):
+    response = client.get("/bridge-status", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json == published
+    assert response.headers["ETag"] == snapshot.get_snapshot().responses["bridge-status"].etag
+    assert 0 < int(response.headers["Cache-Control"].split("=")[1]) <= 20
+
+def test_if_none_match_returns_304(client, published):
+    etag = client.get("/bridge-status", headers=HEADERS).headers["ETag"]
+    response = client.get("/bridge-status", headers={**HEADERS, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+def test_gzip_body(client, published):
+    response = client.get("/bridge-status", headers={**HEADERS, "Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(response.data)) == published
+    # Each representation has its own ETag, either one revalidates
+    etag = snapshot.get_snapshot().responses["bridge-status"].etag
+    assert response.headers["ETag"] == etag[:-1] + '-gz"'
+    revalidated = client.get("/bridge-status", headers={**HEADERS, "If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304 and revalidated.headers["ETag"] == etag
+
+def test_health_reports_ready(client, published):
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json["ready"] is True
+
+def test_published_snapshot_is_immutable(published):
+    current = snapshot.get_snapshot()
+    with pytest.raises(TypeError):
+        current.status["bridges"][0]["state"] = "CLOSED"
+    assert current.status["bridges"][0]["state"] == "OPEN"
+
+# Streams are only served by the asyncio server, a WSGI worker thread is never tied up by one
+def test_stream_not_served_by_wsgi(client, published):
+    assert client.get("/bridge-status/stream", headers=HEADERS).status_code == 404
+
+def test_broadcaster_replays_missed_events():
+    events = Broadcaster(backlog=2)
+    events.publish([("bridge", {"id": 1})])
+    missed, sequence = events.events_since(0)
+    assert missed == [b'id: 1\nevent: bridge\ndata: {"id":1}\n\n'] and sequence == 1
+    events.publish([("bridge", {"id": 2}), ("bridge", {"id": 3})])
+    # Event 1 fell out of the backlog, so a subscriber still at 0 needs a new snapshot
+    assert events.events_since(0) == (None, 3)
+    assert len(events.events_since(1)[0]) == 2
+
+def test_bridge_changes():
+    previous = [{"id": 1, "state": "OPEN"}, {"id": 2, "state": "OPEN"}]
+    current = [{"id": 1, "state": "OPEN"}, {"id": 2, "state": "CLOSED"}, {"id": 3, "state": "OPEN"}]
+    assert bridge_changes(previous, current) == [("bridge", current[1]), ("bridge", current[2])]
+    assert bridge_changes(previous, previous[:1]) == [("remove", {"id": 2})]
+
+def test_heatmap_is_served_from_snapshot(client):
+    heatmap = [{"id": 1, "location": "Lakeshore Rd", "weeks_observed": 1, "closures": [0] * 168}]
+    snapshot.publish({"bridges": []}, [], -4, [], next_update=time.time() + 20, heatmap=heatmap)
+    response = client.get("/heatmap", headers=HEADERS)
+    assert response.json == heatmap
+    assert response.headers["ETag"] == snapshot.get_snapshot().responses["heatmap"].etag
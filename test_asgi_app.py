@@ -0,0 +1,92 @@
+import asyncio
+import gzip
+import json
+import time
+import pytest
+from app import app as flask_app
+from asgi_app import AsgiApp
+from bridge_events import broadcaster
+from config import API_KEY
+import snapshot
+from conftest import request
+
+HEADERS = {"X-API-Key": API_KEY}
+
+@pytest.fixture
+def published():
+    status = {"updated": "2024-06-24T18:00:00-04:00", "bridges": [{"id": 1, "location": "Lakeshore Rd", "state": "OPEN"}]}
+    snapshot.publish(status, [], -1, [], next_update=time.time() + 20)
+    return status
+
+def test_requires_api_key(published):
+    status, _, body = request("/bridge-status")
+    assert status == 401
+    assert json.loads(body) == {"error": "Unauthorized"}
+
+def test_matches_flask_output(published):
+    flask_response = flask_app.test_client().get("/stats", headers=HEADERS)
+    status, headers, body = request("/stats", HEADERS)
+    assert status == 200
+    assert body == flask_response.data
+    assert headers["etag"] == flask_response.headers["ETag"]
+    assert headers["content-type"] == "application/json"
+
+def test_conditional_and_gzip(published):
+    _, headers, _ = request("/bridge-status", HEADERS)
+    status, _, body = request("/bridge-status", {**HEADERS, "If-None-Match": headers["etag"]})
+    assert status == 304 and body == b""
+    _, headers, body = request("/bridge-status", {**HEADERS, "Accept-Encoding": "br, gzip;q=0.8"})
+    assert headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(body)) == published
+    assert headers["etag"].endswith('-gz"')
+    _, headers, _ = request("/bridge-status", {**HEADERS, "Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in headers
+
+def test_health_and_unknown_paths(published):
+    status, _, body = request("/health")
+    assert status == 200 and json.loads(body)["ready"] is True
+    assert request("/nope")[0] == 404
+    assert request("/stats", HEADERS, method="POST")[0] == 405
+
+def test_stream_pushes_changes(published):
+    async def run():
+        app = AsgiApp(fetch=False)
+        chunks = asyncio.Queue()
+        disconnect = asyncio.Event()
+        async def receive():
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+        async def send(message):
+            await chunks.put(message)
+        scope = {"type": "http", "method": "GET", "path": "/bridge-status/stream",
+                 "headers": [(b"x-api-key", API_KEY.encode())]}
+        task = asyncio.create_task(app(scope, receive, send))
+        assert (await chunks.get())["status"] == 200
+        assert (await chunks.get())["body"].startswith(b"event: snapshot\n")
+        assert broadcaster.subscribers == 1
+        broadcaster.publish([("bridge", {"id": 1, "state": "CLOSED"})])
+        body = (await asyncio.wait_for(chunks.get(), 1))["body"]
+        disconnect.set()
+        await asyncio.wait_for(task, 1)
+        assert broadcaster.subscribers == 0
+        await app.shutdown()
+        return body
+    assert b'event: bridge\ndata: {"id":1,"state":"CLOSED"}' in asyncio.run(run())
+
+def test_filtered_history_is_streamed(published):
+    history = [{"id": 1, "location": "Lakeshore Rd", "closures": [{"start": "2024-06-24T18:00:00-04:00"}], "raising_soon_times": []}]
+    snapshot.publish(published, [], -3, history, next_update=time.time() + 20)
+    status, headers, body = request("/history?bridge=1&type=closures", HEADERS)
+    assert status == 200 and "content-length" not in headers
+    assert json.loads(body)["records"] == [{"id": 1, "location": "Lakeshore Rd", "type": "closures", "start": "2024-06-24T18:00:00-04:00"}]
+    assert request("/history?bridge=one", HEADERS)[0] == 400
+
+def test_metrics(published):
+    request("/stats", HEADERS)
+    # Key names show up in the labels, so it needs a key too, here the way Prometheus sends one
+    assert request("/metrics")[0] == 401
+    status, headers, body = request("/metrics", {"Authorization": f"Bearer {API_KEY}"})
+    assert status == 200
+    assert headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'http_request_seconds_count{route="/stats",status="200"}' in body.decode()
+    assert 'bridge_data_age_seconds ' in body.decode()
@@ -0,0 +1,76 @@
+import json
+import pytest
+import auth
+import utils
+import asgi_app
+from app import app
+from auth import ApiKey, KeyStore, TokenBucket, digest, parse_keys
+from conftest import request
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, burst=3)
+    now = bucket.updated
+    assert [bucket.take(now) for _ in range(3)] == [0, 0, 0]
+    assert bucket.take(now) == pytest.approx(0.5)
+    assert bucket.take(now + 0.5) == 0
+    assert bucket.take(now + 0.5) > 0
+    # Idle time never builds up more than burst tokens
+    assert [bucket.take(now + 100) for _ in range(4)][-1] > 0
+
+def test_parse_keys_and_lookup():
+    keys = parse_keys("partner@5=abc; website=d@f ;mail=user@10=x")
+    assert [(k.name, k.bucket.rate if k.bucket else None) for k in keys] == [("partner", 5.0), ("website", None), ("mail", None)]
+    store = KeyStore(keys)
+    assert store.lookup("abc").name == "partner"
+    # Keys are taken whole, whatever they contain
+    assert store.lookup("d@f").name == "website"
+    assert store.lookup("user@10=x").name == "mail"
+    assert store.lookup("d") is None
+    assert store.lookup("") is None
+    with pytest.raises(ValueError):
+        parse_keys("partner")
+    with pytest.raises(ValueError):
+        parse_keys("partner@fast=abc")
+    with pytest.raises(ValueError):
+        KeyStore(parse_keys("a=same;b=same"))
+
+def test_keys_file_holds_digests(tmp_path, monkeypatch):
+    filename = tmp_path / "keys.json"
+    with open(filename, "w") as f:
+        json.dump([{"name": "partner", "sha256": digest("s3cret"), "daily_quota": 2}], f)
+    monkeypatch.setattr(auth, "API_KEYS", "")
+    monkeypatch.setattr(auth, "API_KEYS_FILE", str(filename))
+    monkeypatch.setattr(auth, "API_KEY_SET", False)
+    store = auth.load_keys()
+    # The default key only stays valid if it was set explicitly
+    assert [k.name for k in store.keys.values()] == ["partner"]
+    assert store.authorize("s3cret") == (200, None)
+    assert store.authorize("s3cret") == (200, None)
+    status, retry_after = store.authorize("s3cret")
+    assert status == 429 and 1 <= retry_after <= 86400
+    assert store.authorize("wrong") == (401, None)
+
+@pytest.fixture
+def limited(monkeypatch):
+    store = KeyStore([ApiKey("default", digest(auth.API_KEY)), ApiKey("tight", digest("tight-key"), rate=0.01, burst=1)])
+    monkeypatch.setattr(utils, "key_store", store)
+    monkeypatch.setattr(asgi_app, "key_store", store)
+    return store
+
+def test_flask_rate_limit(limited):
+    client = app.test_client()
+    assert client.get("/stats", headers={"X-API-Key": "tight-key"}).status_code == 200
+    response = client.get("/stats", headers={"X-API-Key": "tight-key"})
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 100
+    assert client.get("/stats", headers={"X-API-Key": "nope"}).status_code == 401
+    assert client.get("/stats", headers={"X-API-Key": auth.API_KEY}).status_code == 200
+
+def test_asgi_rate_limit(limited):
+    assert request("/stats", {"X-API-Key": "tight-key"})[0] == 200
+    status, headers, body = request("/stats", {"X-API-Key": "tight-key"})
+    assert status == 429
+    assert int(headers["retry-after"]) >= 1
+    assert json.loads(body) == {"error": "Too many requests"}
+    status, _, body = request("/metrics", {"X-API-Key": auth.API_KEY})
+    assert 'api_requests_total{key="tight",result="limited"}' in body.decode()
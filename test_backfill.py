@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import random
+import pytest
+import subprocess
+from datetime import datetime, timedelta
+from config import TORONTO_TZ
+from bridge_stats import BridgeStats
+from storage import EventLogStorage
+from history import PeriodHistory
+
+np = pytest.importorskip("numpy")
+import backfill
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "bridge_sct.html")
+
+@pytest.fixture
+def start_time():
+    return TORONTO_TZ.localize(datetime(2024, 6, 24, 18, 0, 0))
+
+def test_rebuild_matches_incremental_aggregates(start_time):
+    random.seed(3)
+    incremental = PeriodHistory()
+    t = start_time.timestamp()
+    for _ in range(300):
+        t += random.uniform(600, 30000)
+        incremental.open(t)
+        t += random.uniform(60, 95 * 60)
+        incremental.close(t)
+    incremental.expire(start_time.timestamp() + 30 * 86400)
+
+    rebuilt = backfill.ReplayHistory.from_columns(incremental.starts[incremental.head:], incremental.ends[incremental.head:])
+    backfill.rebuild_aggregates(rebuilt)
+    expected, actual = incremental.stats, rebuilt.stats
+    assert actual.count == expected.count
+    assert actual.mean_value == pytest.approx(expected.mean_value)
+    assert actual.m2 == pytest.approx(expected.m2)
+    assert actual.buckets == expected.buckets
+    assert list(actual.min_window) == pytest.approx(list(expected.min_window))
+    assert list(actual.max_window) == pytest.approx(list(expected.max_window))
+    assert rebuilt.weekly.counts == incremental.weekly.counts
+    assert rebuilt.weekly.duration_sums == pytest.approx(incremental.weekly.duration_sums, abs=1e-6)
+    assert rebuilt.weekly.minutes == pytest.approx(incremental.weekly.minutes, abs=1e-6)
+    assert rebuilt.histogram.counts == incremental.histogram.counts
+    assert [h.counts for h in rebuilt.hourly] == [h.counts for h in incremental.hourly]
+
+def write_page(directory, timestamp, first_status):
+    with open(FIXTURE) as f:
+        html = f.read().replace('class="green">Available<', f'class="green">{first_status}<', 1)
+    with open(directory / f"{timestamp.isoformat()}.html", "w") as f:
+        f.write(html)
+
+def test_backfill_pages_and_events(tmp_path, start_time):
+    pages = tmp_path / "pages"
+    pages.mkdir()
+    write_page(pages, start_time, "Available")
+    write_page(pages, start_time + timedelta(minutes=5), "Unavailable")
+    write_page(pages, start_time + timedelta(minutes=17), "Available")
+    events = tmp_path / "events.log"
+    with open(events, "w") as f:
+        for minutes, status in ((0, "Available"), (30, "Unavailable"), (42, "Available")):
+            ts = (start_time + timedelta(minutes=minutes)).isoformat()
+            f.write(json.dumps({"id": 900, "location": "Test Bridge", "status": status, "action": None, "ts": ts}) + "\n")
+
+    output = str(tmp_path / "stats.json")
+    with open(f"{output}.log", "w") as f:
+        f.write("{}\n")
+    with pytest.raises(SystemExit):
+        backfill.main(["--pages", str(pages), "--events", str(events), "--output", output])
+    backfill.main(["--pages", str(pages), "--events", str(events), "--output", output, "--force"])
+    assert not os.path.exists(f"{output}.log")
+
+    reloaded = BridgeStats(output, storage=EventLogStorage(output))
+    page_bridge = reloaded.stats["bridge_statistics"][0]
+    assert page_bridge["avg_closure_duration"] == 12
+    assert len(page_bridge["closures"]) == 1
+    assert reloaded.get_bridge_stat(900)["avg_closure_duration"] == 12
+    assert page_bridge["closures"].stats.count == 1
+
+def test_import_leaves_live_stats_alone(tmp_path, start_time):
+    live = str(tmp_path / "live.json")
+    stats = BridgeStats(live, storage=EventLogStorage(live))
+    stats.update_bridge_stat(1, "Lakeshore Rd", "Available", None, start_time)
+    files = {name: (tmp_path / name).read_bytes() for name in os.listdir(tmp_path)}
+    assert "live.json.log" in files
+    # A fresh interpreter, the tools' imports would otherwise load and compact the live file
+    env = {**os.environ, "BRIDGE_STATS_FILE": live}
+    subprocess.run([sys.executable, "-c", "import backfill, bridge_status"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                   env=env, check=True)
+    assert {name: (tmp_path / name).read_bytes() for name in os.listdir(tmp_path)} == files
+
+def test_seed_from_history_export(tmp_path, start_time):
+    open_start = (start_time + timedelta(hours=2)).isoformat()
+    exported = [{
+        "id": 1,
+        "location": "Lakeshore Rd",
+        "closures": [
+            {"start": start_time.isoformat(), "end": (start_time + timedelta(minutes=20)).isoformat()},
+            {"start": open_start}
+        ],
+        "raising_soon_times": []
+    }]
+    seed = tmp_path / "history.json"
+    with open(seed, "w") as f:
+        json.dump(exported, f)
+    events = tmp_path / "events.log"
+    with open(events, "w") as f:
+        ts = (start_time + timedelta(hours=2, minutes=10)).isoformat()
+        f.write(json.dumps({"id": 1, "location": "Lakeshore Rd", "status": "Available", "action": None, "ts": ts}) + "\n")
+
+    bridge_stats, _ = backfill.backfill([str(seed)], [str(events)])
+    bridge_stat = bridge_stats.get_bridge_stat(1)
+    assert bridge_stat["last_status"] == "Available"
+    assert len(bridge_stat["closures"]) == 2
+    assert bridge_stat["avg_closure_duration"] == 15
+    assert bridge_stat["shortest_closure"] == 10
+    assert bridge_stat["longest_closure"] == 20
+
+def test_seed_drops_outliers_and_sorts(start_time):
+    def period(minutes, duration=None):
+        start = start_time + timedelta(minutes=minutes)
+        return {"start": start.isoformat(), **({"end": (start + timedelta(minutes=duration)).isoformat()} if duration else {})}
+    records = [period(300, 15), period(0, 10), period(100, 120), period(200), period(400)]
+    history = backfill.seed_columns(records)
+    # The 120 minute outlier and the stale open period are dropped, the rest are in start order
+    assert list(history) == [period(0, 10), period(300, 15), period(400)]
+    assert list(history) == list(PeriodHistory(sorted(records[:2] + records[4:], key=lambda r: r["start"])))
+    backfill.rebuild_aggregates(history)
+    assert history.stats.count == 2
+    assert history.expire((start_time + timedelta(minutes=100)).timestamp()) == 1
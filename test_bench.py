@@ -0,0 +1,50 @@
+import os
+import sys
+import json
+import subprocess
+from datetime import datetime
+from config import TORONTO_TZ
+from bridge_stats import BridgeStats
+from storage import JsonFileStorage, EventLogStorage
+import synthetic_history
+import bench
+
+def test_synthetic_history_loads(tmp_path):
+    filename = str(tmp_path / "stats.json")
+    end = TORONTO_TZ.localize(datetime(2024, 6, 24, 18, 0, 0))
+    generated = synthetic_history.write(filename, bridges=3, days=20, end=end)
+    assert generated == synthetic_history.generate(bridges=3, days=20, end=end)
+
+    bridge_stats = BridgeStats(filename, storage=JsonFileStorage(filename))
+    assert [s["location"] for s in bridge_stats.stats["bridge_statistics"]] == ["Lakeshore Rd", "Carlton St.", "Queenston St."]
+    for bridge_stat in bridge_stats.stats["bridge_statistics"]:
+        assert len(bridge_stat["closures"]) > 60
+        assert 5 <= bridge_stat["avg_closure_duration"] <= 30
+        assert bridge_stat["longest_closure"] <= 90
+
+def test_bench_report(tmp_path):
+    output = tmp_path / "bench.json"
+    assert bench.main(["--bridges", "2", "--days", "2", "--repeat", "2", "--output", str(output)]) == 0
+    with open(output) as f:
+        report = json.load(f)
+    assert report["params"] == {"bridges": 2, "days": 2, "repeat": 2}
+    for name in ("load_cold", "load_warm", "cleanup_data", "update_bridge_stat", "save_stats", "extract_bridges",
+                 "serialize_history", "poll_cycle", "get_stats", "get_history"):
+        assert report["results"][name]["runs"] == 2
+
+    slower = {"results": {name: dict(result, median_ms=result["median_ms"] / 10) for name, result in report["results"].items()}}
+    assert bench.compare(report["results"], slower, 1.25)
+    assert not bench.compare(report["results"], report, 1.25)
+
+def test_bench_leaves_live_stats_alone(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    live = str(data / "stats.json")
+    stats = BridgeStats(live, storage=EventLogStorage(live))
+    stats.update_bridge_stat(1, "Lakeshore Rd", "Available", None, datetime.now(TORONTO_TZ))
+    files = {name: (data / name).read_bytes() for name in os.listdir(data)}
+    # Only the benchmark's temp directory and --output are written to
+    env = {**os.environ, "BRIDGE_STATS_FILE": live}
+    subprocess.run([sys.executable, bench.__file__, "--bridges", "1", "--days", "1", "--repeat", "1",
+                    "--output", str(tmp_path / "bench.json")], env=env, check=True, capture_output=True)
+    assert {name: (data / name).read_bytes() for name in os.listdir(data)} == files
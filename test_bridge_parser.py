@@ -0,0 +1,57 @@
+import os
+import pytest
+import bridge_parser
+from bridge_parser import EXTRACTORS, extract_bs4, extract_bridges
+from utils import parse_status
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'r') as f:
+        return f.read()
+
+EXPECTED = {
+    'bridge_sct.html': [
+        (1, 'Lakeshore Rd', 'Available'),
+        (2, 'Carlton St.', 'Available (Raising Soon)'),
+        (3, 'Queenston St.', 'Unavailable (Fully Raised since 17:15)'),
+        (4, 'Glendale Ave.', 'Unavailable (--Lowering--)'),
+        (5, 'Highway 20', 'Available')
+    ],
+    # Upper case markup, entities, nested tags in the status and a bridge missing its status span
+    'bridge_sct_messy.html': [
+        (1, 'Lakeshore\xa0Rd', 'Unavailable (Raising)'),
+        (3, 'Queenston St.', 'Unavailable (Work in Progress)'),
+        (4, 'Glendale Ave.', 'Available'),
+        (5, 'Highway 20', 'Available')
+    ]
+}
+
+def available_extractors():
+    names = []
+    for name, extract in EXTRACTORS.items():
+        try:
+            extract('')
+        except ImportError:
+            continue
+        except Exception:
+            pass
+        names.append(name)
+    return names
+
+@pytest.mark.parametrize('fixture', sorted(EXPECTED))
+@pytest.mark.parametrize('name', available_extractors())
+def test_extractors_match_fixtures(name, fixture):
+    html = read_fixture(fixture)
+    assert EXTRACTORS[name](html) == EXPECTED[fixture]
+    assert EXTRACTORS[name](html) == extract_bs4(html)
+
+def test_falls_back_to_bs4(monkeypatch):
+    monkeypatch.setattr(bridge_parser, 'extractor', 'stream')
+    monkeypatch.setitem(EXTRACTORS, 'stream', lambda html: [])
+    assert extract_bridges(read_fixture('bridge_sct.html')) == EXPECTED['bridge_sct.html']
+
+def test_parse_status_fixture_values():
+    assert parse_status('Unavailable (--Lowering--)') == ('Unavailable', 'Lowering')
+    assert parse_status('Unavailable (Fully Raised since 17:15)') == ('Unavailable', 'Fully Raised')
+    assert parse_status('Available (Raising Soon)') == ('Available', 'Raising Soon')
@@ -0,0 +1,245 @@
+import os
+import math
+import random
+import statistics
+import json
+import threading
+import pytest
+from datetime import datetime, timedelta
+from bridge_stats import BridgeStats
+from config import TORONTO_TZ
+from storage import EventLogStorage
+import history
+from history import PeriodHistory
+from running_stats import RunningStats, HourOfWeekStats, DurationHistogram
+
+@pytest.fixture
+def start_time():
+    return TORONTO_TZ.localize(datetime(2024, 6, 24, 18, 0, 0))
+
+def run_closure(bridge_stats, start_time, minutes, bridge_id=1):
+    bridge_stats.update_bridge_stat(bridge_id, "Lakeshore Rd", "Available", None, start_time)
+    bridge_stats.update_bridge_stat(bridge_id, "Lakeshore Rd", "Unavailable", None, start_time + timedelta(minutes=1))
+    bridge_stats.update_bridge_stat(bridge_id, "Lakeshore Rd", "Available", None, start_time + timedelta(minutes=1 + minutes))
+
+def test_unchanged_polls_are_not_logged(tmp_path, start_time):
+    filename = str(tmp_path / "stats.json")
+    bridge_stats = BridgeStats(filename, storage=EventLogStorage(filename))
+    for i in range(10):
+        bridge_stats.update_bridge_stat(1, "Lakeshore Rd", "Available", None, start_time + timedelta(seconds=30 * i))
+    with open(f"{filename}.log") as f:
+        assert len(f.readlines()) == 1
+
+def test_event_log_replay(tmp_path, start_time):
+    filename = str(tmp_path / "stats.json")
+    bridge_stats = BridgeStats(filename, storage=EventLogStorage(filename))
+    run_closure(bridge_stats, start_time, 20)
+    assert not os.path.exists(filename)
+
+    reloaded = BridgeStats(filename, storage=EventLogStorage(filename))
+    bridge_stat = reloaded.get_bridge_stat(1)
+    assert bridge_stat["avg_closure_duration"] == 20
+    assert len(bridge_stat["closures"]) == 1
+    # Boot folds the replayed log into the snapshot
+    assert os.path.exists(filename)
+    assert not os.path.exists(f"{filename}.log")
+
+def test_compaction_keeps_events_written_after_snapshot(tmp_path, start_time):
+    filename = str(tmp_path / "stats.json")
+    bridge_stats = BridgeStats(filename, storage=EventLogStorage(filename))
+    run_closure(bridge_stats, start_time, 20)
+    bridge_stats.save_stats()
+    run_closure(bridge_stats, start_time + timedelta(hours=1), 10)
+
+    with open(filename) as f:
+        assert len(json.load(f)["bridge_statistics"][0]["closures"]) == 1
+    reloaded = BridgeStats(filename, storage=EventLogStorage(filename))
+    assert len(reloaded.get_bridge_stat(1)["closures"]) == 2
+
+def test_compaction_encodes_outside_the_lock(tmp_path, start_time):
+    filename = str(tmp_path / "stats.json")
+    bridge_stats = BridgeStats(filename, storage=EventLogStorage(filename))
+    run_closure(bridge_stats, start_time, 20)
+    serialize = bridge_stats.storage.serialize
+    def serialize_unlocked(stats):
+        # A poller can take the lock while the snapshot is encoded, and its update doesn't change the captured copy
+        poller = threading.Thread(target=run_closure, args=(bridge_stats, start_time + timedelta(hours=1), 10))
+        poller.start()
+        poller.join(timeout=5)
+        assert not poller.is_alive()
+        return serialize(stats)
+    bridge_stats.storage.serialize = serialize_unlocked
+    bridge_stats.save_stats()
+
+    with open(filename) as f:
+        assert len(json.load(f)["bridge_statistics"][0]["closures"]) == 1
+    assert len(bridge_stats.get_bridge_stat(1)["closures"]) == 2
+    reloaded = BridgeStats(filename, storage=EventLogStorage(filename))
+    assert len(reloaded.get_bridge_stat(1)["closures"]) == 2
+    assert reloaded.get_bridge_stat(1)["closures"].to_state() == bridge_stats.get_bridge_stat(1)["closures"].to_state()
+
+def test_replay_skips_events_already_in_snapshot(tmp_path, start_time):
+    filename = str(tmp_path / "stats.json")
+    bridge_stats = BridgeStats(filename, storage=EventLogStorage(filename))
+    run_closure(bridge_stats, start_time, 20)
+    # Simulate a crash after the snapshot was written but before the old log was removed
+    with open(f"{filename}.log") as f:
+        events = f.read()
+    bridge_stats.save_stats()
+    with open(f"{filename}.log.compacting", 'w') as f:
+        f.write(events)
+
+    reloaded = BridgeStats(filename, storage=EventLogStorage(filename))
+    assert len(reloaded.get_bridge_stat(1)["closures"]) == 1
+
+def test_period_history_round_trips_iso(start_time):
+    records = [
+        {"start": start_time.isoformat(), "end": (start_time + timedelta(minutes=12, seconds=30)).isoformat()},
+        {"start": (start_time + timedelta(hours=1)).isoformat()}
+    ]
+    history = PeriodHistory(records)
+    assert history.to_list() == records
+    assert history.closed_durations() == [12.5]
+    assert history.is_open()
+
+def test_cleanup_drops_expired_and_outliers(tmp_path, start_time):
+    filename = str(tmp_path / "stats.json")
+    bridge_stats = BridgeStats(filename, storage=EventLogStorage(filename))
+    run_closure(bridge_stats, start_time, 20)
+    run_closure(bridge_stats, start_time + timedelta(hours=2), 120)
+    bridge_stat = bridge_stats.get_bridge_stat(1)
+    assert bridge_stat["closures"].closed_durations() == [20]
+
+    bridge_stats.update_bridge_stat(1, "Lakeshore Rd", "Available", None, start_time + timedelta(days=181))
+    assert len(bridge_stat["closures"]) == 0
+    assert bridge_stat["avg_closure_duration"] == 0
+
+def test_expiry_subtracts_from_aggregates(tmp_path, start_time):
+    filename = str(tmp_path / "stats.json")
+    bridge_stats = BridgeStats(filename, storage=EventLogStorage(filename))
+    for day, minutes in enumerate([5, 40, 12, 20]):
+        run_closure(bridge_stats, start_time + timedelta(days=day), minutes)
+    bridge_stat = bridge_stats.get_bridge_stat(1)
+    assert (bridge_stat["shortest_closure"], bridge_stat["longest_closure"]) == (5, 40)
+
+    # Expire the first two closures
+    bridge_stats.update_bridge_stat(1, "Lakeshore Rd", "Available", None, start_time + timedelta(days=181, hours=12))
+    assert bridge_stat["closures"].closed_durations() == [12, 20]
+    assert bridge_stat["avg_closure_duration"] == 16
+    assert (bridge_stat["shortest_closure"], bridge_stat["longest_closure"]) == (12, 20)
+    assert bridge_stat["closure_durations"]["10-15m"] == 1
+    assert bridge_stat["closure_durations"]["31m+"] == 0
+
+def test_running_stats_matches_batch_after_removal():
+    durations = [5.5, 40, 12, 20.25, 8, 33, 17, 9.75, 26, 14, 11, 19, 22, 30, 6, 13]
+    running = RunningStats()
+    for i, duration in enumerate(durations):
+        running.add(i, duration)
+    running.remove(0, durations[0])
+    remaining = durations[1:]
+
+    assert running.mean() == pytest.approx(statistics.mean(remaining))
+    assert running.variance() == pytest.approx(statistics.variance(remaining))
+    margin = 2.1448 * statistics.stdev(remaining) / math.sqrt(len(remaining))
+    assert running.ci() == (round(statistics.mean(remaining) - margin), round(statistics.mean(remaining) + margin))
+    assert (running.min(), running.max()) == (6, 40)
+
+def test_hour_of_week_splits_periods_across_hours(start_time):
+    weekly = HourOfWeekStats()
+    start = (start_time + timedelta(minutes=40)).timestamp()
+    weekly.add(start, start + 45 * 60)
+    # Monday 18:40 for 45 minutes
+    assert weekly.counts[18] == 1
+    assert (weekly.minutes[18], weekly.minutes[19]) == pytest.approx((20, 25))
+    assert weekly.summary(1)["mean_durations"][18] == 45
+    weekly.remove(start, start + 45 * 60)
+    assert weekly.counts == [0] * 168
+    assert weekly.summary(1)["probabilities"] == [0] * 168
+
+def test_heatmap_tracks_closures_and_expiry(tmp_path, start_time):
+    filename = str(tmp_path / "stats.json")
+    bridge_stats = BridgeStats(filename, storage=EventLogStorage(filename))
+    run_closure(bridge_stats, start_time, 40)
+    run_closure(bridge_stats, start_time + timedelta(days=1), 70)
+    heatmap = bridge_stats.get_heatmap((start_time + timedelta(days=1, hours=2)).timestamp())[0]
+    assert heatmap["weeks_observed"] == 1
+    assert (heatmap["closures"][18], heatmap["closures"][24 + 18]) == (1, 1)
+    assert heatmap["avg_closure_duration"][24 + 18] == 70
+    assert heatmap["closure_probability"][18] == pytest.approx(40 / 60, abs=1e-4)
+    assert heatmap["closure_probability"][24 + 19] == pytest.approx(11 / 60, abs=1e-4)
+
+    bridge_stats.save_stats()
+    reloaded = BridgeStats(filename, storage=EventLogStorage(filename))
+    assert reloaded.get_bridge_stat(1)["closures"].weekly.to_state() == bridge_stats.get_bridge_stat(1)["closures"].weekly.to_state()
+
+    # Once the Monday closure expires only Tuesday's is left
+    bridge_stats.update_bridge_stat(1, "Lakeshore Rd", "Available", None, start_time + timedelta(days=180, hours=12))
+    heatmap = bridge_stats.get_heatmap((start_time + timedelta(days=180, hours=12)).timestamp())[0]
+    assert heatmap["closures"][18] == 0 and heatmap["closure_probability"][18] == 0
+    assert heatmap["closures"][24 + 18] == 1
+
+def test_duration_histogram_quantiles():
+    rng = random.Random(1)
+    durations = [min(89.9, 5 + rng.gammavariate(2, 8)) for _ in range(2000)]
+    histogram = DurationHistogram()
+    for duration in durations:
+        histogram.add(duration)
+    survivors, (p10, p50, p90) = histogram.quantiles(0)
+    expected = statistics.quantiles(durations, n=10)
+    assert survivors == len(durations)
+    assert (p10, p50, p90) == pytest.approx((expected[0], expected[4], expected[8]), abs=0.5)
+    # Only periods that lasted at least 20 minutes count once 20 minutes have passed
+    survivors, (p10, p50, p90) = histogram.quantiles(20.5)
+    longer = [d for d in durations if d >= 20]
+    expected = statistics.quantiles(longer, n=10)
+    assert survivors == len(longer)
+    assert (p10, p50, p90) == pytest.approx((expected[0], expected[4], expected[8]), abs=0.5)
+    assert histogram.quantiles(200) == (0, (0, 0, 0))
+    before = histogram.quantiles(0)
+    histogram.add(3)
+    histogram.remove(3)
+    assert histogram.quantiles(0) == before
+
+def test_remaining_prefers_same_hour_of_day(start_time):
+    closures = PeriodHistory()
+    for day in range(12):
+        evening = (start_time + timedelta(days=day)).timestamp()
+        closures.open(evening)
+        closures.close(evening + 40 * 60)
+        morning = (start_time + timedelta(days=day, hours=-10)).timestamp()
+        closures.open(morning)
+        closures.close(morning + 10 * 60)
+    evening = (start_time + timedelta(days=20, minutes=5)).timestamp()
+    morning = (start_time + timedelta(days=20, hours=-10)).timestamp()
+    assert closures.remaining(10, evening) == (30, 30, 30)
+    assert closures.remaining(2, morning) == (8, 8, 8)
+    # An hour with no history of its own uses every closure
+    low, median, high = closures.remaining(0, (start_time + timedelta(days=20, hours=-4)).timestamp())
+    assert (low, high) == (10, 40) and 10 <= median <= 40
+
+def test_boot_trusts_derived_stats_only_when_checksum_matches(tmp_path, start_time, monkeypatch):
+    filename = str(tmp_path / "stats.json")
+    bridge_stats = BridgeStats(filename, storage=EventLogStorage(filename))
+    run_closure(bridge_stats, start_time, 20)
+    run_closure(bridge_stats, start_time + timedelta(hours=1), 10)
+    bridge_stats.save_stats()
+    assert os.path.exists(f"{filename}.derived")
+
+    parsed = []
+    original_to_epoch = history.to_epoch
+    monkeypatch.setattr(history, "to_epoch", lambda value: parsed.append(value) or original_to_epoch(value))
+    reloaded = BridgeStats(filename, storage=EventLogStorage(filename))
+    assert reloaded.get_bridge_stat(1)["closures"].closed_durations() == [20, 10]
+    assert reloaded.get_bridge_stat(1)["avg_closure_duration"] == 15
+    assert parsed == []
+    monkeypatch.undo()
+
+    # Editing the stats file invalidates the derived stats
+    with open(filename) as f:
+        data = json.load(f)
+    data["bridge_statistics"][0]["closures"].pop()
+    with open(filename, 'w') as f:
+        json.dump(data, f)
+    reloaded = BridgeStats(filename, storage=EventLogStorage(filename))
+    assert reloaded.get_bridge_stat(1)["closures"].closed_durations() == [20]
+    assert reloaded.get_bridge_stat(1)["avg_closure_duration"] == 20
@@ -1,6 +1,16 @@
+import json
+import asyncio
+import threading
 import pytest
 from datetime import datetime, timedelta
+import bridge_status
 from bridge_status import format_display_data
+from bridge_stats import BridgeStats
+from snapshot import get_snapshot
+from conftest import PAGE, FakeResponse, FakeSession
+from sources import parse_sources
+from poll_policy import PollPolicy
+from history import PeriodHistory
 
 @pytest.fixture
 def base_time_and_stat():
@@ -82,6 +92,20 @@ def test_unavailable_construction(base_time_and_stat):
     assert info == "Closed 5:25pm for construction"
     assert icon == "construction"
 
+def test_unavailable_uses_duration_quantiles(base_time_and_stat):
+    current_time, base_stat = base_time_and_stat
+    current_time = current_time.astimezone()
+    closures = PeriodHistory()
+    for day, minutes in enumerate([10, 12, 14, 16, 18, 20, 22, 24, 26, 28]):
+        start = (current_time - timedelta(days=day + 1)).timestamp()
+        closures.open(start)
+        closures.close(start + minutes * 60)
+    closures.open((current_time - timedelta(minutes=10)).timestamp())
+    base_stat["closures"] = closures
+    status, info, icon = format_display_data("Unavailable", None, current_time, base_stat)
+    assert status == "CLOSED"
+    assert info.endswith("Open in 1-17m (est)")
+
 def test_unknown_status(base_time_and_stat):
     current_time, base_stat = base_time_and_stat
     status, info, icon = format_display_data("UnknownStatus", None, current_time, base_stat)
@@ -94,4 +118,154 @@ def test_unknown_status_with_action(base_time_and_stat):
     status, info, icon = format_display_data("UnknownStatus", "SomeAction", current_time, base_stat)
     assert status == "UNKNOWN"
     assert info == "UnknownStatus (SomeAction)"
-    assert icon == "question"
\ No newline at end of file
+    assert icon == "question"
+def test_fetch_skips_unchanged_page(fetcher, monkeypatch):
+    session = FakeSession([FakeResponse(PAGE), FakeResponse(PAGE), FakeResponse(PAGE.replace("(Raising)", "(Lowering)"))])
+    monkeypatch.setattr(bridge_status, "session", session)
+    bridge_status.fetch_bridge_status()
+    bridge_status.fetch_bridge_status()
+    assert len(fetcher) == 1
+    assert [b["state"] for b in get_snapshot().status["bridges"]] == ["OPEN", "CLOSING"]
+    bridge_status.fetch_bridge_status()
+    assert len(fetcher) == 2
+    assert [b["state"] for b in get_snapshot().status["bridges"]] == ["OPEN", "OPENING"]
+
+def test_fetch_sends_validators_and_handles_304(fetcher, monkeypatch):
+    session = FakeSession([FakeResponse(PAGE, headers={"ETag": '"abc"'}), FakeResponse(status_code=304)])
+    monkeypatch.setattr(bridge_status, "session", session)
+    bridge_status.fetch_bridge_status()
+    bridge_status.fetch_bridge_status()
+    assert session.sent_headers[1] == {"If-None-Match": '"abc"'}
+    assert len(fetcher) == 1
+    assert len(get_snapshot().status["bridges"]) == 2
+
+class AsyncSession(FakeSession):
+    async def get(self, url, headers=None):
+        return super().get(url, headers)
+
+def test_async_fetch_shares_page_handling(fetcher, monkeypatch):
+    client = AsyncSession([FakeResponse(PAGE, headers={"ETag": '"abc"'}), FakeResponse(status_code=304)])
+    source = bridge_status.SOURCES[0]
+    threads = []
+    process_page = bridge_status.process_page
+    monkeypatch.setattr(bridge_status, "process_page", lambda *args: threads.append(threading.get_ident()) or process_page(*args))
+    assert asyncio.run(bridge_status.fetch_source_async(source, client)) > 0
+    asyncio.run(bridge_status.fetch_source_async(source, client))
+    assert client.sent_headers[1] == {"If-None-Match": '"abc"'}
+    assert len(fetcher) == 1
+    # Pages are processed off the event loop's thread, every poll on the same worker
+    assert threading.get_ident() not in threads
+    assert len(set(threads)) == 1
+    assert [b["state"] for b in get_snapshot().status["bridges"]] == ["OPEN", "CLOSING"]
+
+def test_parse_sources():
+    sources = parse_sources("SCT=https://example.com/a?key=BridgeSCT; PC=https://example.com/a?key=BridgePC@60")
+    assert [(s.key, s.url, s.interval) for s in sources] == [
+        ("SCT", "https://example.com/a?key=BridgeSCT", 30),
+        ("PC", "https://example.com/a?key=BridgePC", 60)
+    ]
+    assert parse_sources("")[0].key == "SCT"
+    with pytest.raises(ValueError):
+        parse_sources("https://example.com")
+    with pytest.raises(ValueError):
+        parse_sources("SCT=https://example.com/a;SCT=https://example.com/b")
+
+class UrlSession:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get(self, url, headers=None, timeout=None):
+        return FakeResponse(self.pages[url])
+
+def test_fetch_merges_sources_with_stable_ids(fetcher, monkeypatch):
+    sources = parse_sources("SCT=https://example.com/sct;PC=https://example.com/pc")
+    monkeypatch.setattr(bridge_status, "SOURCES", sources)
+    monkeypatch.setattr(bridge_status, "page_caches", {source.key: bridge_status.PageCache() for source in sources})
+    monkeypatch.setattr(bridge_status, "source_status", {})
+    monkeypatch.setattr(bridge_status, "policies", {source.key: PollPolicy(source.interval) for source in sources})
+    pc_page = PAGE.replace("Lakeshore Rd", "Clarence St.").replace("Carlton St.", "Main St.")
+    monkeypatch.setattr(bridge_status, "session", UrlSession({"https://example.com/sct": PAGE, "https://example.com/pc": pc_page}))
+
+    bridge_status.fetch_source(sources[0])
+    bridge_status.fetch_source(sources[1])
+    bridges = get_snapshot().status["bridges"]
+    assert [(b["id"], b["source"], b["location"]) for b in bridges] == [
+        (1, "SCT", "Lakeshore Rd"), (2, "SCT", "Carlton St."), (3, "PC", "Clarence St."), (4, "PC", "Main St.")
+    ]
+    # Only the St. Catharines bridges have coordinates
+    assert [b["lat"] is not None for b in bridges] == [True, True, False, False]
+    assert [c["id"] for c in json.loads(get_snapshot().responses["routes"].body)["crossings"]] == [1, 2]
+
+    # Reordering BRIDGE_SOURCES and the pages, or adding a bridge, keeps every id on its bridge
+    sources = sources[::-1]
+    monkeypatch.setattr(bridge_status, "SOURCES", sources)
+    sct_page = PAGE.replace("Lakeshore Rd", "Highway 20").replace("Carlton St.", "Lakeshore Rd")
+    pc_page = pc_page.replace("Main St.", "Carlton St.").replace("Clarence St.", "Main St.")
+    monkeypatch.setattr(bridge_status, "session", UrlSession({"https://example.com/sct": sct_page, "https://example.com/pc": pc_page}))
+    bridge_status.fetch_source(sources[0])
+    bridge_status.fetch_source(sources[1])
+    bridges = get_snapshot().status["bridges"]
+    assert [(b["id"], b["source"], b["location"]) for b in bridges] == [
+        (4, "PC", "Main St."), (5, "PC", "Carlton St."), (6, "SCT", "Highway 20"), (1, "SCT", "Lakeshore Rd")
+    ]
+
+def test_ids_survive_restart_and_claim_old_stats(tmp_path):
+    filename = str(tmp_path / "stats.json")
+    stats = BridgeStats(filename)
+    start = datetime(2024, 6, 24, 18, 0, 0)
+    # Stats saved before bridges had a source
+    stats.update_bridge_stat(101, "Clarence St.", "Available", None, start)
+    stats.update_bridge_stat(1, "Lakeshore Rd", "Available", None, start)
+    assert stats.bridge_id("PC", "Clarence St.") == 101
+    assert stats.bridge_id("SCT", "Lakeshore Rd") == 1
+    assert stats.bridge_id("SCT", "Carlton St.") == 102
+    stats.update_bridge_stat(102, "Carlton St.", "Available", None, start, "SCT")
+    stats.save_stats()
+
+    reloaded = BridgeStats(filename)
+    assert reloaded.bridge_id("SCT", "Carlton St.") == 102
+    assert reloaded.bridge_id("PC", "Clarence St.") == 101
+    # A bridge of the same name on another sector is a different bridge
+    assert reloaded.bridge_id("PC", "Lakeshore Rd") == 103
+
+def test_poll_policy_follows_bridge_state():
+    policy = PollPolicy(30, fast_interval=10, idle_interval=90, adaptive=True)
+    now = 1_700_000_000
+    quiet = ("Available", None, {})
+    assert policy.after_success([quiet, quiet], elapsed=0.2, now=now) == 90
+    assert policy.after_success([quiet, ("Available", "Raising Soon", {})], elapsed=0.2, now=now) == 10
+
+    closures = PeriodHistory()
+    closures.open(now - 10 * 60)
+    closed = ("Unavailable", None, {"closures": closures, "avg_closure_duration": 30, "closure_duration_ci": (25, 35)})
+    assert policy.after_success([quiet, closed], elapsed=0.2, now=now) == 30
+    # Within five minutes of the expected end of the closure
+    assert policy.after_success([quiet, closed], elapsed=0.2, now=now + 12 * 60) == 10
+
+def test_poll_policy_backs_off_and_opens_breaker(monkeypatch):
+    monkeypatch.setattr("poll_policy.BREAKER_FAILURES", 3)
+    monkeypatch.setattr("poll_policy.BREAKER_COOLDOWN", 300)
+    policy = PollPolicy(30, adaptive=True)
+    first, second = policy.after_failure(), policy.after_failure()
+    assert 30 <= first <= 60
+    assert 30 <= second <= 120
+    assert policy.after_failure() == 300
+    assert policy.breaker_open
+    # A slow response counts against the source but still returns at least the normal interval
+    assert policy.after_success([], elapsed=10) == 300
+    assert policy.after_success([], elapsed=0.2) == 30
+    assert not policy.breaker_open
+
+def test_async_fetch_follows_redirects(fetcher):
+    import httpx
+    from asgi_app import upstream_client
+    def handler(request):
+        if request.url.path == "/moved":
+            return httpx.Response(301, headers={"Location": "https://example.com/sct"})
+        return httpx.Response(200, text=PAGE)
+    async def run():
+        async with upstream_client(transport=httpx.MockTransport(handler)) as client:
+            return await bridge_status.fetch_source_async(bridge_status.SOURCES[0]._replace(url="https://example.com/moved"), client)
+    asyncio.run(run())
+    assert bridge_status.policies["SCT"].failures == 0
+    assert len(get_snapshot().status["bridges"]) == 2
@@ -0,0 +1,80 @@
+import gzip
+import json
+import time
+from datetime import datetime, timedelta
+import pytest
+from app import app
+from config import API_KEY, TORONTO_TZ
+from history_index import HistoryIndex, HistoryQuery
+import snapshot
+from conftest import request
+
+HEADERS = {"X-API-Key": API_KEY}
+BASE = TORONTO_TZ.localize(datetime(2024, 6, 24, 12, 0))
+
+def period(hours, minutes=20):
+    start = BASE + timedelta(hours=hours)
+    return {"start": start.isoformat(), "end": (start + timedelta(minutes=minutes)).isoformat()}
+
+HISTORY = [
+    {"id": 1, "location": "Lakeshore Rd", "closures": [period(0), period(5), period(10)], "raising_soon_times": [period(-1)]},
+    {"id": 2, "location": "Carlton St.", "closures": [period(2), period(5)], "raising_soon_times": []}
+]
+
+def starts(page):
+    return [(record["id"], record["type"], record["start"]) for record in map(json.loads, page)]
+
+def test_filters_by_bridge_type_and_time():
+    index = HistoryIndex(HISTORY)
+    page, cursor = index.query(HistoryQuery({}))
+    assert [s[2] for s in starts(page)] == sorted(s[2] for s in starts(page))
+    assert len(page) == 6 and cursor is None
+    page, _ = index.query(HistoryQuery({"bridge": "1", "type": "closures"}))
+    assert len(page) == 3
+    since = (BASE + timedelta(hours=2)).isoformat()
+    page, _ = index.query(HistoryQuery({"since": since, "until": str((BASE + timedelta(hours=10)).timestamp())}))
+    assert starts(page) == [(2, "closures", period(2)["start"]), (1, "closures", period(5)["start"]), (2, "closures", period(5)["start"])]
+
+def test_cursor_pages_through_ties():
+    index = HistoryIndex(HISTORY)
+    seen = []
+    cursor = None
+    while True:
+        args = {"limit": "2", **({"cursor": cursor} if cursor else {})}
+        page, cursor = index.query(HistoryQuery(args))
+        seen += starts(page)
+        if cursor is None:
+            break
+    assert seen == starts(index.query(HistoryQuery({}))[0])
+
+def test_invalid_query():
+    for args in ({"bridge": "x"}, {"type": "openings"}, {"limit": "0"}, {"since": "yesterday"}, {"cursor": "abc"},
+                 {"since": "nan"}, {"until": "inf"}, {"cursor": "nan:0"}):
+        with pytest.raises(ValueError):
+            HistoryQuery(args)
+
+@pytest.fixture
+def client():
+    snapshot.publish({"bridges": []}, [], -2, HISTORY, next_update=time.time() + 20)
+    return app.test_client()
+
+def test_history_endpoint(client):
+    assert json.loads(client.get("/history", headers=HEADERS).data) == HISTORY
+    response = client.get("/history?bridge=2&limit=1", headers={**HEADERS, "Accept-Encoding": "gzip"})
+    body = json.loads(gzip.decompress(response.data))
+    assert [record["start"] for record in body["records"]] == [period(2)["start"]]
+    next_page = json.loads(client.get(f"/history?bridge=2&limit=1&cursor={body['next_cursor']}", headers=HEADERS).data)
+    assert [record["start"] for record in next_page["records"]] == [period(5)["start"]]
+    assert next_page["next_cursor"] is None
+    revalidated = client.get("/history?bridge=2&limit=1", headers={**HEADERS, "If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert client.get("/history?limit=abc", headers=HEADERS).status_code == 400
+    assert client.get("/history?since=nan", headers=HEADERS).status_code == 400
+
+def test_unknown_params_keep_full_history(client):
+    # A cache buster doesn't switch to filtered pages
+    assert json.loads(client.get("/history?_=1", headers=HEADERS).data) == HISTORY
+    status, _, body = request("/history?_=1", HEADERS)
+    assert status == 200 and json.loads(body) == HISTORY
+    status, _, body = request("/history?_=1&bridge=", HEADERS)
+    assert status == 200 and len(json.loads(body)["records"]) == 6
@@ -0,0 +1,58 @@
+import pstats
+from datetime import datetime, timedelta
+import metrics
+import bridge_status
+from app import app
+from bridge_stats import BridgeStats
+from config import API_KEY, TORONTO_TZ
+
+def series(text, prefix):
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(prefix)}
+
+def test_histogram_render():
+    histogram = metrics.Histogram("test_seconds", "Test", ("route",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, 'a"b')
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{route="a\\"b",le="0.1"} 2',
+        'test_seconds_bucket{route="a\\"b",le="1"} 3',
+        'test_seconds_bucket{route="a\\"b",le="+Inf"} 4',
+        'test_seconds_sum{route="a\\"b"} 3.65',
+        'test_seconds_count{route="a\\"b"} 4'
+    ]
+
+def test_poll_and_request_metrics(tmp_path, monkeypatch):
+    stats = BridgeStats(str(tmp_path / "stats.json"))
+    start = TORONTO_TZ.localize(datetime(2024, 6, 24, 18, 0, 0))
+    before = series(metrics.render().decode(), "bridge_transitions_total")
+    stats.update_bridge_stat(7, "Lakeshore Rd", "Available", None, start)
+    stats.update_bridge_stat(7, "Lakeshore Rd", "Available", "Raising Soon", start + timedelta(minutes=1))
+    stats.update_bridge_stat(7, "Lakeshore Rd", "Available", "Raising Soon", start + timedelta(minutes=2))
+    stats.update_bridge_stat(7, "Lakeshore Rd", "Unavailable", None, start + timedelta(minutes=3))
+    monkeypatch.setattr(bridge_status, "bridge_stats", stats)
+    bridge_status.fetch_failed(bridge_status.SOURCES[0], ValueError("upstream down"))
+
+    client = app.test_client()
+    client.get("/stats", headers={"X-API-Key": API_KEY})
+    assert client.get("/metrics").status_code == 401
+    response = client.get("/metrics", headers={"X-API-Key": API_KEY})
+    assert response.status_code == 200
+    text = response.data.decode()
+    transitions = series(text, "bridge_transitions_total")
+    for state in ("Available", "Available (Raising Soon)", "Unavailable"):
+        key = f'bridge_transitions_total{{bridge="7",state="{state}"}}'
+        assert transitions[key] - before.get(key, 0) == 1
+    assert series(text, "bridge_fetch_errors_total")[f'bridge_fetch_errors_total{{source="{bridge_status.SOURCES[0].key}"}}'] >= 1
+    assert series(text, "bridge_history_periods") == {'bridge_history_periods{type="closures"}': 1,
+                                                      'bridge_history_periods{type="raising_soon_times"}': 1}
+    assert 'http_request_seconds_count{route="/stats",status="200"}' in text
+    assert 'http_response_bytes_count{route="/stats"}' in text
+
+def test_profiled_polls(tmp_path, monkeypatch):
+    profile_file = str(tmp_path / "poll.prof")
+    monkeypatch.setattr(metrics, "PROFILE_POLL_RATE", 1)
+    monkeypatch.setattr(metrics, "PROFILE_FILE", profile_file)
+    monkeypatch.setattr(metrics, "profile_stats", None)
+    assert metrics.profiled(sorted, [3, 1, 2]) == [1, 2, 3]
+    assert metrics.profiled(sorted, [2, 1]) == [1, 2]
+    assert pstats.Stats(profile_file).total_calls >= 2
@@ -0,0 +1,74 @@
+import json
+import pytest
+from datetime import datetime, timedelta
+import bridge_status
+from app import app
+from config import API_KEY, TORONTO_TZ
+from history import PeriodHistory
+from routing import RouteIndex, crossing_eta, route_response
+from snapshot import get_snapshot
+from conftest import PAGE, FakeResponse, FakeSession, request
+
+HEADERS = {"X-API-Key": API_KEY}
+NOW = TORONTO_TZ.localize(datetime(2024, 6, 24, 18, 0, 0))
+
+def entry(bridge_id, lat, state="OPEN"):
+    return {"id": bridge_id, "location": f"Bridge {bridge_id}", "state": state, "lat": lat, "lng": -79.2}
+
+def stat(minutes_ago, **fields):
+    return {"last_status_change": (NOW - timedelta(minutes=minutes_ago)).isoformat(), "closures": PeriodHistory(), **fields}
+
+def test_ranked_by_arrival():
+    now = NOW.timestamp()
+    table = [
+        # Closed right where we are, likely open in 20 minutes
+        crossing_eta(entry(1, 43.20, "CLOSED"), "Unavailable", None, stat(5, avg_closure_duration=25, closure_duration_ci=(20, 30)), now),
+        # Open 5.6km (8 minutes) away
+        crossing_eta(entry(2, 43.15), "Available", None, stat(60), now),
+        # Closed for construction next door
+        crossing_eta(entry(3, 43.201, "CLOSED"), "Unavailable", "Work in Progress", stat(600), now),
+        # Raising soon 2.2km away, closing in 5-15 minutes
+        crossing_eta(entry(4, 43.22), "Available", "Raising Soon",
+                     stat(0, avg_raising_soon_to_unavailable=10, raising_soon_ci=(5, 15), avg_closure_duration=25), now)
+    ]
+    assert table[0]["open_in"] == [15, 20, 25]
+    index = RouteIndex(table, now)
+    ranked = index.query(43.20, -79.2, now)
+    assert [c["id"] for c in ranked] == [4, 2, 1, 3]
+    assert ranked[0]["open_on_arrival"] and ranked[0]["closes_in"] == [5, 10, 15]
+    assert ranked[1]["distance_km"] == pytest.approx(5.56, abs=0.01)
+    assert ranked[3]["wait_min"] is None
+
+    # 12 minutes later the raising soon bridge has likely closed, and waiting for the closed one beats driving
+    later = index.query(43.20, -79.2, now + 12 * 60)
+    assert [c["id"] for c in later] == [1, 2, 4, 3]
+    assert later[0]["open_in"] == [3, 8, 13] and later[0]["wait_min"] == 8
+    assert [c["id"] for c in index.query(43.20, -79.2, now, limit=2)] == [4, 2]
+
+def test_rows_count_down_from_their_own_poll():
+    now = NOW.timestamp()
+    # Polled 10 minutes apart, a backing off sector's row is older than the one polled just now
+    stale = crossing_eta(entry(1, 43.20, "CLOSED"), "Unavailable", None, stat(5, avg_closure_duration=25, closure_duration_ci=(20, 30)), now)
+    fresh = crossing_eta(entry(2, 43.30, "CLOSED"), "Unavailable", None, stat(5, avg_closure_duration=25, closure_duration_ci=(20, 30)), now + 600)
+    assert stale["open_in"] == [15, 20, 25] and fresh["open_in"] == [5, 10, 15]
+    index = RouteIndex([stale, fresh], now)
+    crossings = {c["id"]: c for c in index.query(43.20, -79.2, now + 600)}
+    assert crossings[1]["open_in"] == [5, 10, 15] and crossings[2]["open_in"] == [5, 10, 15]
+
+def test_route_endpoint(fetcher, monkeypatch):
+    monkeypatch.setattr(bridge_status, "session", FakeSession([FakeResponse(PAGE)]))
+    bridge_status.fetch_bridge_status()
+    client = app.test_client()
+    response = client.get("/route?lat=43.19&lng=-79.20", headers=HEADERS)
+    assert response.status_code == 200
+    crossings = json.loads(response.data)["crossings"]
+    # Carlton St. is closing right next to us, Lakeshore Rd is open 2.8km away
+    assert [c["location"] for c in crossings] == ["Lakeshore Rd", "Carlton St."]
+    assert crossings[0]["open_on_arrival"]
+    status, _, body = request("/route?lat=43.19&lng=-79.20", HEADERS)
+    assert status == 200 and json.loads(body) == json.loads(response.data)
+
+    assert client.get("/route?lat=43.19", headers=HEADERS).status_code == 400
+    assert json.loads(client.get("/route?lat=95&lng=0", headers=HEADERS).data) == {"error": "lat must be between -90 and 90"}
+    assert route_response(get_snapshot(), {"lat": "43", "lng": "-79", "limit": "x"}) == (400, {"error": "limit must be an integer"})
+    assert client.get("/route?lat=43.19&lng=-79.20").status_code == 401
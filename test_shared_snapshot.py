@@ -0,0 +1,97 @@
+import json
+import time
+import pytest
+from datetime import datetime, timedelta
+from app import app
+import bridge_status
+from bridge_stats import BridgeStats
+from bridge_events import Broadcaster
+from config import API_KEY
+import leader
+import shared_snapshot
+import snapshot
+
+HEADERS = {"X-API-Key": API_KEY}
+STATUS = {"updated": "2024-06-24T18:00:00-04:00", "bridges": [{"id": 1, "location": "Lakeshore Rd", "state": "OPEN"}]}
+
+@pytest.fixture
+def restore_snapshot():
+    previous = snapshot.get_snapshot()
+    yield
+    snapshot.install(previous)
+
+def test_follower_maps_leader_snapshot(tmp_path, restore_snapshot):
+    filename = str(tmp_path / "shared")
+    published = snapshot.publish(STATUS, [{"id": 1}], 7, [], next_update=time.time() + 20)
+    shared_snapshot.write(published, filename)
+    reader = shared_snapshot.SharedSnapshotReader(filename)
+    shared = reader.refresh()
+    assert isinstance(shared.responses["stats"].body, memoryview)
+    for name, cached in published.responses.items():
+        assert shared.responses[name].body == cached.body
+        assert shared.responses[name].gzip_body == cached.gzip_body
+        assert shared.responses[name].etag == cached.etag
+    assert shared.status["bridges"][0]["location"] == "Lakeshore Rd"
+    assert (shared.generation, shared.history_generation) == (published.generation, 7)
+    # Nothing new until the leader writes again
+    assert reader.refresh() is None
+    shared_snapshot.write(snapshot.publish({**STATUS, "bridges": []}, [], 7, None, next_update=time.time()), filename)
+    assert reader.refresh().status["bridges"] == ()
+
+def test_flask_serves_mapped_snapshot(tmp_path, restore_snapshot):
+    filename = str(tmp_path / "shared")
+    published = snapshot.publish(STATUS, [], -1, [], next_update=time.time() + 20)
+    shared_snapshot.write(published, filename)
+    snapshot.install(shared_snapshot.SharedSnapshotReader(filename).refresh())
+    client = app.test_client()
+    response = client.get("/bridge-status", headers=HEADERS)
+    assert response.data == published.responses["bridge-status"].body
+    assert response.headers["ETag"] == published.responses["bridge-status"].etag
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    assert client.get("/health").status_code == 200
+
+def test_follower_streams_leader_changes(tmp_path, monkeypatch, restore_snapshot):
+    events = Broadcaster()
+    monkeypatch.setattr(leader, "broadcaster", events)
+    filename = str(tmp_path / "shared")
+    snapshot.publish([], [], -1, [], next_update=0)
+    reader = shared_snapshot.SharedSnapshotReader(filename)
+    assert not leader.follow_snapshot(reader)
+    shared_snapshot.write(snapshot.publish(STATUS, [], -1, [], next_update=0), filename)
+    snapshot.publish([], [], -1, [], next_update=0)
+    assert leader.follow_snapshot(reader)
+    assert snapshot.get_snapshot().status["bridges"][0]["id"] == 1
+    assert events.events_since(0)[0] == [b'id: 1\nevent: bridge\ndata: {"id":1,"location":"Lakeshore Rd","state":"OPEN"}\n\n']
+
+def test_only_one_leader(tmp_path):
+    filename = str(tmp_path / "data" / "stats.json.lock")
+    first = leader.acquire_lock(filename)
+    assert first is not None
+    assert leader.acquire_lock(filename) is None
+    first.close()
+    second = leader.acquire_lock(filename)
+    assert second is not None
+    second.close()
+
+def test_new_leader_reencodes_history(tmp_path, monkeypatch, restore_snapshot):
+    filename = str(tmp_path / "stats.json")
+    old_leader = BridgeStats(filename)
+    loaded_generation = old_leader.history_generation
+    start = datetime(2024, 6, 24, 18, 0, 0)
+    for minutes, status in ((0, "Available"), (1, "Unavailable"), (15, "Available")):
+        old_leader.update_bridge_stat(1, "Lakeshore Rd", status, None, start + timedelta(minutes=minutes), "SCT")
+    old_leader.save_stats()
+    # Following the snapshot the old leader published when it loaded, before it saw any closures
+    shared_file = str(tmp_path / "shared")
+    shared_snapshot.write(snapshot.publish(STATUS, [], loaded_generation, [], next_update=0), shared_file)
+    snapshot.install(shared_snapshot.SharedSnapshotReader(shared_file).refresh())
+
+    new_leader = BridgeStats(filename, load=False)
+    monkeypatch.setattr(leader, "bridge_stats", new_leader)
+    monkeypatch.setattr(bridge_status, "bridge_stats", new_leader)
+    monkeypatch.setattr(shared_snapshot, "enabled", False)
+    monkeypatch.setattr(shared_snapshot, "write", lambda current: None)
+    leader.lead(lambda: None)
+    assert new_leader.history_generation != loaded_generation
+    history = json.loads(bytes(snapshot.get_snapshot().responses["history"].body))
+    assert [len(bridge["closures"]) for bridge in history] == [1]
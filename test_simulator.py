@@ -0,0 +1,85 @@
+import threading
+import pytest
+import requests
+from werkzeug.serving import make_server
+import bridge_status
+import simulator
+import loadtest
+from app import app
+from bridge_stats import BridgeStats
+from bridge_parser import extract_bridges
+from snapshot import get_snapshot
+from sources import parse_sources
+from utils import parse_status
+
+SCRIPT = (("Available", 60), ("Available (Raising Soon)", 10), ("Unavailable (Fully Raised since {since})", 30), ("Unavailable (--Lowering--)", 5))
+
+@pytest.fixture
+def upstream():
+    simulation = simulator.Simulation([simulator.SimulatedBridge("Lakeshore Rd", SCRIPT), simulator.SimulatedBridge("Carlton St.", SCRIPT, 65)])
+    faults = simulator.Faults()
+    server = simulator.make_server(simulation, faults)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield simulation, faults, f"http://127.0.0.1:{server.server_port}/bridgestatus/detailsnai?key=BridgeSCT"
+    server.shutdown()
+    server.server_close()
+
+def test_scripted_states_parse():
+    bridge = simulator.SimulatedBridge("Lakeshore Rd", SCRIPT)
+    start = 1719266400  # 18:00 Toronto time
+    states = [parse_status(bridge.status(elapsed, start)) for elapsed in (0, 65, 75, 102, 105, 170)]
+    assert states == [("Available", None), ("Available", "Raising Soon"), ("Unavailable", "Fully Raised"),
+                      ("Unavailable", "Lowering"), ("Available", None), ("Available", "Raising Soon")]
+    assert bridge.status(75, start) == "Unavailable (Fully Raised since 18:01)"
+
+    page = simulator.Simulation([bridge, simulator.SimulatedBridge("Carlton St.", SCRIPT, 75)], start=start).page()
+    assert [(idx, name, parse_status(status)) for idx, name, status in extract_bridges(page)] == [
+        (1, "Lakeshore Rd", ("Available", None)), (2, "Carlton St.", ("Unavailable", "Fully Raised"))]
+
+def test_conditional_requests_and_errors(upstream):
+    _, faults, url = upstream
+    response = requests.get(url)
+    assert response.status_code == 200
+    assert requests.get(url, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    faults.error_rate = 1
+    assert requests.get(url).status_code == 503
+
+def test_fetch_and_serve_pipeline(upstream, tmp_path, monkeypatch):
+    _, _, url = upstream
+    source = parse_sources(f"SIM={url}", 30)[0]
+    monkeypatch.setattr(bridge_status, "SOURCES", [source])
+    monkeypatch.setattr(bridge_status, "bridge_stats", BridgeStats(str(tmp_path / "stats.json")))
+    monkeypatch.setattr(bridge_status, "page_caches", {source.key: bridge_status.PageCache()})
+    monkeypatch.setattr(bridge_status, "policies", {source.key: bridge_status.PollPolicy(30)})
+    monkeypatch.setattr(bridge_status, "source_status", {})
+    bridge_status.fetch_source(source)
+    assert [b["location"] for b in get_snapshot().status["bridges"]] == ["Lakeshore Rd", "Carlton St."]
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        report = loadtest.run_load(f"http://127.0.0.1:{server.server_port}", concurrency=2, duration=0.5, revalidate=True)
+    finally:
+        server.shutdown()
+    assert report["total"]["requests"] > 0
+    assert report["total"]["errors"] == 0
+    assert report["total"]["inconsistent"] == 0
+    assert set(report["total"]["statuses"]) <= {"200", "304"}
+
+def test_consistency_across_dst():
+    client = loadtest.Client("http://127.0.0.1:1", "key", [("/bridge-status", 1)], 0, False, False, 0)
+    # 01:30 EDT then 01:10 EST is later in time although it sorts earlier as a string
+    assert client.consistent({"updated": "2024-11-03T01:30:00-04:00", "bridges": [{"id": 1}]})
+    assert client.consistent({"updated": "2024-11-03T01:10:00-05:00", "bridges": [{"id": 1}]})
+    assert not client.consistent({"updated": "2024-11-03T01:45:00-04:00", "bridges": [{"id": 1}]})
+
+def test_failed_run_raises_its_own_error(monkeypatch):
+    upstream = simulator.make_server(simulator.Simulation([]), simulator.Faults())
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    monkeypatch.setattr(loadtest, "start_pipeline", lambda *args: (upstream, None))
+    monkeypatch.setattr(loadtest, "wait_until_ready", lambda url, timeout: True)
+    def fail(*args):
+        raise RuntimeError("server went away")
+    monkeypatch.setattr(loadtest, "run_load", fail)
+    with pytest.raises(RuntimeError, match="server went away"):
+        loadtest.main(["--server", "true"])
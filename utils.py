@@ -2,28 +2,35 @@
 
 from functools import wraps
 from flask import jsonify, request
-from config import API_KEY, TORONTO_TZ
+from config import TORONTO_TZ
 from datetime import datetime
+from auth import key_store, request_key
 import re
 
+# Checks the key and its rate limit and quota before the view runs
 def require_api_key(view_function):
     @wraps(view_function)
     def decorated_function(*args, **kwargs):
-        if request.headers.get('X-API-Key') and request.headers.get('X-API-Key') == API_KEY:
+        status, retry_after = key_store.authorize(request_key(request.headers.get('X-API-Key'), request.headers.get('Authorization')))
+        if status == 200:
             return view_function(*args, **kwargs)
+        elif status == 429:
+            return jsonify({"error": "Too many requests"}), 429, {"Retry-After": str(retry_after)}
         else:
             return jsonify({"error": "Unauthorized"}), 401
     return decorated_function
 
+STATUS_PATTERN = re.compile(r'(Available|Unavailable)(?:\s*\((.*?)\))?')
+ACTION_TRIM_PATTERN = re.compile(r'^-*\s*|\s*-*$')
+
 def parse_status(status):
-    status_pattern = re.compile(r'(Available|Unavailable)(?:\s*\((.*?)\))?')
-    match = status_pattern.match(status)
+    match = STATUS_PATTERN.match(status)
     if match:
         current_status = match.group(1)
         action_status = match.group(2) if match.group(2) else None
         if action_status:
             # Remove leading/trailing dashes and whitespace
-            action_status = re.sub(r'^-*\s*|\s*-*$', '', action_status)
+            action_status = ACTION_TRIM_PATTERN.sub('', action_status)
             if "since" in action_status:
                 action_status = action_status.split("since")[0].strip()
         return current_status, action_status
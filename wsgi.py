@@ -0,0 +1,7 @@
+# wsgi.py
+# Entry point for multi-worker WSGI servers, e.g. MULTIPROCESS=true gunicorn -w 4 -b 0.0.0.0:5000 wsgi:app
+# Don't use --preload, each worker has to start its own scheduler and take part in the leader election.
+from scheduler_init import start_scheduler
+from app import app
+
+start_scheduler()